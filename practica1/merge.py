@@ -0,0 +1,97 @@
+'''
+    merge.py
+    Junta varias trazas pcap (por ejemplo las que genera practica1.py en cada interfaz) en una sola ordenada por tiempo.
+    Las trazas de entrada se leen en secuencia con PcapStreamReader, con un bloque pequenno por fichero y sin hilos,
+    y se mezclan con un monticulo que guarda el siguiente registro de cada entrada ordenado por su timestamp, asi que
+    la memoria usada no depende del tamanno de las trazas y se pueden juntar cientos de ficheros.
+    Las entradas pueden ser de microsegundos o de nanosegundos (y estar comprimidas); la salida se escribe con
+    PcapWriter en nanosegundos si alguna entrada lo esta, salvo que se indique otro formato.
+    Uso: python3 merge.py -o salida.pcap entrada1.pcap entrada2.pcap ...
+'''
+
+from rc1_pcap import *
+import argparse
+import heapq
+import logging
+import sys
+import time
+
+#Tamanno del bloque de lectura de cada entrada
+MERGE_BLOCK = 64 * 1024
+
+'''
+Nombre: mergeTraces
+Descripcion: Esta funcion junta las trazas inputs en el fichero output ordenando los registros por timestamp. A igualdad
+    de timestamp se respeta el orden de las entradas y, dentro de cada entrada, el orden del fichero.
+Argumentos:
+    -inputs: lista de ficheros pcap de entrada (todos con el mismo tipo de enlace)
+    -output: fichero de salida (.gz o .xz para comprimirlo)
+    -fmt: formato de salida (PCAP_FORMAT_USEC o PCAP_FORMAT_NSEC). None => nanosegundos si alguna entrada lo esta
+    -blockSize: tamanno del bloque de lectura de cada entrada
+Retorno: lista con el numero de registros leidos de cada entrada
+'''
+def mergeTraces(inputs, output, fmt=None, blockSize=MERGE_BLOCK):
+
+    readers = []
+    try:
+        for fname in inputs:
+            readers.append(PcapStreamReader(fname, blockSize, threaded=False))
+        linktypes = set(r.linktype for r in readers)
+        if len(linktypes) > 1:
+            raise ValueError('Las trazas tienen distintos tipos de enlace: ' + str(sorted(linktypes)))
+        if fmt is None:
+            fmt = PCAP_FORMAT_NSEC if any(r.tsresol != 1000000 for r in readers) else PCAP_FORMAT_USEC
+        linktype = linktypes.pop() if linktypes else DLT_EN10MB
+        snaplen = max([r.snaplen for r in readers] + [1])
+        counts = [0] * len(readers)
+        with PcapWriter(output, linktype, snaplen, fmt, threaded=True) as writer:
+            # Factor para pasar el timestamp de cada entrada a nanosegundos y de nanosegundos a la salida
+            scales = [1000000000 // r.tsresol for r in readers]
+            outScale = 1000000000 // writer.tsresol
+            iters = [iter(r) for r in readers]
+            heap = []
+            for i, it in enumerate(iters):
+                for tv_sec, tv_frac, caplen, length, data in it:
+                    heap.append((tv_sec * 1000000000 + tv_frac * scales[i], i, length, data))
+                    break
+            heapq.heapify(heap)
+            while heap:
+                ts, i, length, data = heap[0]
+                tv_sec, ns = divmod(ts, 1000000000)
+                writer.write(tv_sec, ns // outScale, data, length)
+                counts[i] += 1
+                for tv_sec, tv_frac, caplen, length, data in iters[i]:
+                    heapq.heapreplace(heap, (tv_sec * 1000000000 + tv_frac * scales[i], i, length, data))
+                    break
+                else:
+                    # Entrada terminada
+                    heapq.heappop(heap)
+        return counts
+    finally:
+        for r in readers:
+            r.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Junta varias trazas pcap en una sola ordenada por tiempo')
+    parser.add_argument('inputs', nargs='+', help='Trazas de entrada')
+    parser.add_argument('-o', dest='output', required=True, help='Traza de salida')
+    parser.add_argument('--format', dest='format', default=None, choices=[PCAP_FORMAT_USEC, PCAP_FORMAT_NSEC], help='Precisión de la salida (por defecto la mayor de las entradas)')
+    parser.add_argument('--block', dest='block', type=int, default=MERGE_BLOCK // 1024, help='KB de lectura por cada traza de entrada')
+    parser.add_argument('--debug', dest='debug', default=False, action='store_true', help='Activar Debug messages')
+    args = parser.parse_args()
+
+    if args.debug:
+        logging.basicConfig(level = logging.DEBUG, format = '[%(asctime)s %(levelname)s]\t%(message)s')
+    else:
+        logging.basicConfig(level = logging.INFO, format = '[%(asctime)s %(levelname)s]\t%(message)s')
+
+    start = time.perf_counter()
+    try:
+        counts = mergeTraces(args.inputs, args.output, args.format, args.block * 1024)
+    except (OSError, ValueError) as e:
+        logging.error(str(e))
+        sys.exit(-1)
+    for fname, n in zip(args.inputs, counts):
+        logging.debug('{}: {} registros'.format(fname, n))
+    logging.info('{} registros de {} trazas en {:.2f} s'.format(sum(counts), len(counts), time.perf_counter() - start))
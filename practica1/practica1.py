@@ -16,34 +16,135 @@ import argparse
 from argparse import RawTextHelpFormatter
 import time
 import logging
+import threading
 
 ETH_FRAME_MAX = 1514
 PROMISC = 1
 NO_PROMISC = 0
 TO_MS = 10
 num_paquete = 0
+stop = False
 TIME_OFFSET = 30*60
+#Bytes de vistas previas acumulados antes de volcarlos a la salida y segundos maximos que pueden esperar en el buffer
+DISPLAY_BUFSIZE = 64 * 1024
+DISPLAY_FLUSH = 0.2
+
+'''
+Clase que muestra las tramas capturadas sin que la salida por pantalla frene la captura:
+	-la vista previa de cada trama (sus nbytes primeros bytes en hexadecimal) se acumula en un buffer que se vuelca
+	 cuando supera DISPLAY_BUFSIZE bytes o, desde un hilo aparte, cada DISPLAY_FLUSH segundos
+	-se puede mostrar solo una de cada every tramas y/o como mucho perSecond tramas por segundo
+	-si interval es mayor que 0, cada interval segundos se muestra una linea con paquetes/s, bytes/s y descartes
+	 (drops es una funcion que devuelve el total de tramas descartadas hasta el momento)
+	-con previews a False solo se muestran las lineas de estadisticas
+'''
+class PreviewDisplay():
+
+	def __init__(self,nbytes,every=1,perSecond=0,interval=0,previews=True,drops=None,out=None):
+		self.nbytes = nbytes
+		self.every = max(every, 1)
+		self.perSecond = perSecond
+		self.interval = interval
+		self.previews = previews
+		self.drops = drops
+		self.out = out if out is not None else sys.stdout.buffer
+		self.buf = bytearray()
+		self.lock = threading.Lock()
+		self.packets = 0
+		self.bytes = 0
+		self.windowEnd = 0
+		self.windowShown = 0
+		self.last = (time.monotonic(), 0, 0, 0)
+		self.done = threading.Event()
+		self.thread = threading.Thread(target=self._run, daemon=True)
+		self.thread.start()
+
+	def packet(self,header,data):
+		self.packets += 1
+		self.bytes += header.len
+		if not self.previews or self.packets % self.every:
+			return
+		if self.perSecond > 0:
+			now = time.monotonic()
+			if now >= self.windowEnd:
+				self.windowEnd = now + 1
+				self.windowShown = 0
+			if self.windowShown >= self.perSecond:
+				return
+			self.windowShown += 1
+		with self.lock:
+			self.buf += binascii.hexlify(data[:self.nbytes])
+			self.buf += b'\n'
+			if len(self.buf) >= DISPLAY_BUFSIZE:
+				self._flush()
+
+	def _flush(self):
+		# Llamar con self.lock cogido
+		if self.buf:
+			self.out.write(self.buf)
+			self.out.flush()
+			del self.buf[:]
+
+	def _stats(self):
+		# Llamar con self.lock cogido. Annade al buffer la linea de estadisticas desde la anterior
+		now = time.monotonic()
+		packets, nbytes = self.packets, self.bytes
+		drops = self.drops() if self.drops is not None else 0
+		elapsed = max(now - self.last[0], 1e-9)
+		self.buf += '[{}] {:.1f} paquetes/s, {:.1f} bytes/s, {} descartes ({} paquetes en total)\n'.format(
+			datetime.now().strftime('%H:%M:%S'), (packets - self.last[1]) / elapsed, (nbytes - self.last[2]) / elapsed,
+			drops - self.last[3], packets).encode('ascii')
+		self.last = (now, packets, nbytes, drops)
+
+	def _run(self):
+		nextStats = self.last[0] + self.interval
+		tick = min(DISPLAY_FLUSH, self.interval) if self.interval > 0 else DISPLAY_FLUSH
+		while not self.done.wait(tick):
+			with self.lock:
+				if self.interval > 0 and time.monotonic() >= nextStats:
+					self._stats()
+					nextStats += self.interval
+				self._flush()
+
+	def close(self):
+		self.done.set()
+		self.thread.join()
+		with self.lock:
+			if self.interval > 0 and self.packets > self.last[1]:
+				self._stats()
+			self._flush()
 
 def signal_handler(nsignal,frame):
+	global stop
 	logging.info('Control C pulsado')
+	stop = True
 	if handle:
 		pcap_breakloop(handle)
 
+def procesa_stream(reader,count):
+	#equivalente a pcap_loop para las trazas comprimidas, que no puede abrir libpcap
+	n = 0
+	for tv_sec, tv_frac, caplen, length, data in reader:
+		if stop:
+			return -2
+		header = pcap_pkthdr()
+		header.len = length
+		header.caplen = caplen
+		header.ts = timeval(tv_sec, tv_frac if reader.tsresol == 1000000 else tv_frac // 1000)
+		procesa_paquete(None, header, bytearray(data))
+		n += 1
+		if count > 0 and n >= count:
+			break
+	return 0
+
 def procesa_paquete(us,header,data):
 	global num_paquete, pdumper
 	num_paquete += 1	
-	#create the dumper
-	if pdumper is None:
-		descriptor = pcap_open_dead(DLT_EN10MB, ETH_FRAME_MAX)
-		if args.interface is not False:
-			pdumper = pcap_dump_open(descriptor, 'captura.' + str(args.interface) + str(header.ts.tv_sec + TIME_OFFSET) + '.pcap')
-		else:
-			pdumper = pcap_dump_open(descriptor, 'captura.file.' + args.tracefile + str(header.ts.tv_sec + TIME_OFFSET) + '.pcap')
 	
-	#imprimimos los N primeros bytes
-	print (binascii.hexlify(data[:args.nbytes]))
-	#Escribir el tráfico al fichero de captura con el offset temporal
-	pcap_dump(pdumper, header, data)
+	#imprimimos los N primeros bytes (a traves del buffer de PreviewDisplay)
+	display.packet(header, data)
+	#Escribir el tráfico al fichero de captura (el escritor se abre antes de pcap_loop)
+	pdumper.dump(header, data)
 
 	
 if __name__ == "__main__":
@@ -56,6 +157,19 @@ if __name__ == "__main__":
 	parser.add_argument('--itf', dest='interface', default=False,help='Interfaz a abrir')
 	parser.add_argument('--nbytes', dest='nbytes', type=int, default=14,help='Número de bytes a mostrar por paquete')
 	parser.add_argument('--debug', dest='debug', default=False, action='store_true',help='Activar Debug messages')
+	parser.add_argument('--format', dest='format', default=PCAP_FORMAT_USEC, choices=[PCAP_FORMAT_USEC, PCAP_FORMAT_NSEC, PCAP_FORMAT_PCAPNG], help='Formato del fichero de salida: pcap de microsegundos, pcap de nanosegundos o pcapng')
+	parser.add_argument('--writerThread', dest='writerThread', default=False, action='store_true', help='Volcar el fichero de salida desde un hilo aparte')
+	parser.add_argument('--compress', dest='compress', default='', choices=['', 'gz', 'xz'], help='Comprimir los ficheros de salida con gzip o xz')
+	parser.add_argument('--index', dest='index', type=int, default=0, help='Escribir un índice de timestamps (.idx) con una entrada cada N paquetes (0 => sin índice)')
+	parser.add_argument('--count', dest='count', type=int, default=50, help='Número de paquetes a capturar (-1 => hasta pulsar Control C)')
+	parser.add_argument('--rotateSize', dest='rotateSize', type=int, default=0, help='Cambiar de fichero de salida cada N MB (0 => no rotar por tamaño)')
+	parser.add_argument('--rotateTime', dest='rotateTime', type=int, default=0, help='Cambiar de fichero de salida cada N segundos (0 => no rotar por tiempo)')
+	parser.add_argument('--keepFiles', dest='keepFiles', type=int, default=0, help='Conservar solo los N últimos ficheros de salida (0 => todos)')
+	parser.add_argument('--queueSize', dest='queueSize', type=int, default=PCAP_ROTATE_QUEUE, help='Tamaño de la cola hacia el hilo escritor al rotar ficheros')
+	parser.add_argument('--profile', dest='profile', default=None, choices=sorted(PCAP_PROFILES), help='Perfil de captura (pcap_create/pcap_activate): low-latency o high-throughput')
+	parser.add_argument('--every', dest='every', type=int, default=1, help='Mostrar solo uno de cada N paquetes')
+	parser.add_argument('--perSecond', dest='perSecond', type=int, default=0, help='Mostrar como mucho N paquetes por segundo (0 => sin límite)')
+	parser.add_argument('--statsInterval', dest='statsInterval', type=float, default=0, help='Mostrar cada N segundos una línea con paquetes/s, bytes/s y descartes en lugar de una línea por paquete.\nCon --every o --perSecond se siguen mostrando los paquetes muestreados')
 	args = parser.parse_args()
 
 	if args.debug:
@@ -73,42 +187,83 @@ if __name__ == "__main__":
 
 	errbuf = bytearray()
 	handle = None
+	reader = None
 	pdumper = None
 	
 	#case --itf
 	if args.interface is not False:
 		#open the interface for capture it. When its open_live we want to capture the package complete
-		handle = pcap_open_live(args.interface, ETH_FRAME_MAX, NO_PROMISC, 1000, errbuf)
+		if args.profile is not None:
+			handle = pcap_open_profile(args.interface, ETH_FRAME_MAX, NO_PROMISC, args.profile, errbuf)
+		else:
+			handle = pcap_open_live(args.interface, ETH_FRAME_MAX, NO_PROMISC, 1000, errbuf)
 		#check it went right
 		if handle is None:
 			print ("No se ha capturado nada")
 			sys.exit(-1)
 		#case --itf
 	elif args.tracefile is not False:
-		#open the file
-		handle = pcap_open_offline(args.tracefile, errbuf)
+		#open the file (libpcap no lee trazas comprimidas: esas se leen con pcap_open_stream)
+		if pcap_compressed(args.tracefile) is not None:
+			reader = pcap_open_stream(args.tracefile)
+		else:
+			handle = pcap_open_offline(args.tracefile, errbuf)
 		#check it went right
-		if handle is None:
+		if handle is None and reader is None:
 			print ("No se ha capturado nada")
 			sys.exit(-1)
 
+	#create the dumper
+	compress = '.' + args.compress if args.compress else ''
+	extension = ('.pcapng' if args.format == PCAP_FORMAT_PCAPNG else '.pcap') + compress
+	if args.interface is not False:
+		prefix = 'captura.' + str(args.interface)
+	else:
+		prefix = 'captura.file.' + args.tracefile
+	if args.rotateSize > 0 or args.rotateTime > 0:
+		#anillo de ficheros escrito desde otro hilo: pcap_loop nunca espera al disco
+		pdumper = RotatingPcapWriter(prefix, DLT_EN10MB, ETH_FRAME_MAX, args.format, args.rotateSize * 1024 * 1024, args.rotateTime, args.keepFiles, args.queueSize, compress=compress, index=args.index)
+	else:
+		#al comprimir, la compresion se hace en el hilo escritor
+		pdumper = PcapWriter(prefix + str(int(time.time()) + TIME_OFFSET) + extension, DLT_EN10MB, ETH_FRAME_MAX, args.format, threaded=args.writerThread or bool(compress), index=args.index)
+
+	#descartes: los del kernel (pcap_stats, solo en interfaces) mas los de la cola del escritor al rotar ficheros
+	def drops():
+		n = 0
+		if handle is not None and args.interface is not False:
+			st = pcap_stat()
+			if pcap_stats(handle, st) == 0:
+				n += st.ps_drop + st.ps_ifdrop
+		if isinstance(pdumper, RotatingPcapWriter):
+			n += pdumper.stats()['dropped']
+		return n
 
+	previews = args.statsInterval <= 0 or args.every > 1 or args.perSecond > 0
+	display = PreviewDisplay(args.nbytes, args.every, args.perSecond, args.statsInterval, previews, drops)
 	
 	#loop. It is interrupted when we send SIGINT, when it reads all the packages or when there's an error
-	ret = pcap_loop(handle,50,procesa_paquete,None)
+	if reader is not None:
+		ret = procesa_stream(reader,args.count)
+	else:
+		ret = pcap_loop(handle,args.count,procesa_paquete,None)
 	if ret == -1:
 		logging.error('Error al capturar un paquete')
 	elif ret == -2:
 		logging.debug('pcap_breakloop() llamado')
 	elif ret == 0:
 		logging.debug('No mas paquetes o limite superado')
+	display.close()
 	logging.info('{} paquetes procesados'.format(num_paquete)) #when it ends we show the number of packages
 	
 	#close descriptors
 	if handle is not None:
 		pcap_close(handle)
+	if reader is not None:
+		reader.close()
 
 	if pdumper is not None:
-		pcap_dump_close(pdumper)
+		pdumper.close()
+		if isinstance(pdumper, RotatingPcapWriter):
+			logging.info('Registros encolados: {queued}, escritos: {written}, descartados: {dropped}, ficheros: {files}'.format(**pdumper.stats()))
 	
 
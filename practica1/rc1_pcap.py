@@ -1,7 +1,17 @@
 import ctypes,sys
+import threading
+import queue
+import struct
+import bisect
+import gzip
+import lzma
+import time
+import os
+import logging
 from ctypes.util import find_library
 
-user_callback = None
+#Funcion de callback de pcap_loop/pcap_dispatch. Es por hilo: cada hilo de captura tiene la suya
+_callbacks = threading.local()
 
 DLT_EN10MB = 1
 
@@ -10,8 +20,10 @@ def mycallback(us,h,data):
     header.len = h[0].len
     header.caplen = h[0].caplen
     header.ts = timeval(h[0].tv_sec,h[0].tv_usec)
+    user_callback = getattr(_callbacks, 'fn', None)
     if user_callback is not None:
-        user_callback (us,header,bytearray(data[:header.caplen]))
+        #Una sola copia de la trama (el buffer de libpcap se reutiliza al volver)
+        user_callback (us,header,ctypes.string_at(data,header.caplen))
 
 
 
@@ -32,6 +44,11 @@ class pcap_pkthdr():
 class pcappkthdr(ctypes.Structure):
     _fields_ = [("tv_sec", ctypes.c_long), ("tv_usec", ctypes.c_long), ("caplen", ctypes.c_uint32), ("len", ctypes.c_uint32)]
 
+#  typedef void (*pcap_handler)(u_char *user, const struct pcap_pkthdr *h,const u_char *bytes);
+PCAP_HANDLER = ctypes.CFUNCTYPE(ctypes.c_void_p, ctypes.c_char_p,ctypes.POINTER(pcappkthdr),ctypes.POINTER(ctypes.c_uint8))
+#El trampolin se crea una unica vez y se reutiliza en todas las llamadas a pcap_loop/pcap_dispatch
+_pcap_handler = PCAP_HANDLER(mycallback)
+
 
 def pcap_open_offline(fname,errbuf):
     #pcap_t *pcap_open_offline(const char *fname, char *errbuf);
@@ -115,33 +132,27 @@ def pcap_next(handle,header):
 
 
 def pcap_loop(handle,cnt,callback_fun,user):
-    global user_callback
-    user_callback = callback_fun
-    #  typedef void (*pcap_handler)(u_char *user, const struct pcap_pkthdr *h,const u_char *bytes);
-    PCAP_HANDLER = ctypes.CFUNCTYPE(ctypes.c_void_p, ctypes.c_char_p,ctypes.POINTER(pcappkthdr),ctypes.POINTER(ctypes.c_uint8))
-    cf = PCAP_HANDLER(mycallback)
+    #pcap llama a la callback en el hilo que ejecuta el bucle
+    _callbacks.fn = callback_fun
     #int pcap_loop(pcap_t *p, int cnt,pcap_handler callback, u_char *user);
     pl = pcap.pcap_loop
     pl.restype = ctypes.c_int
     us = ctypes.c_void_p(user)
     c = ctypes.c_int(cnt)
-    ret = pl(handle,c,cf,us)
-    user_callback = None
+    ret = pl(handle,c,_pcap_handler,us)
+    _callbacks.fn = None
     return ret
 
 def pcap_dispatch(handle,cnt,callback_fun,user):
-    global user_callback
-    user_callback = callback_fun
-    #  typedef void (*pcap_handler)(u_char *user, const struct pcap_pkthdr *h,const u_char *bytes);
-    PCAP_HANDLER = ctypes.CFUNCTYPE(ctypes.c_void_p, ctypes.c_char_p,ctypes.POINTER(pcappkthdr),ctypes.POINTER(ctypes.c_uint8))
-    cf = PCAP_HANDLER(mycallback)
-    #int pcap_loop(pcap_t *p, int cnt,pcap_handler callback, u_char *user);
-    pd = pcap.pcap_dispacth
+    #pcap llama a la callback en el hilo que ejecuta el bucle
+    _callbacks.fn = callback_fun
+    #int pcap_dispatch(pcap_t *p, int cnt,pcap_handler callback, u_char *user);
+    pd = pcap.pcap_dispatch
     pd.restype = ctypes.c_int
     us = ctypes.c_void_p(user)
     c = ctypes.c_int(cnt)
-    ret = pd(handle,c,cf,us)
-    user_callback = None
+    ret = pd(handle,c,_pcap_handler,us)
+    _callbacks.fn = None
     return ret
 
 def pcap_breakloop(hanlde):
@@ -150,5 +161,801 @@ def pcap_breakloop(hanlde):
     pbl(hanlde)
 
 
+#  typedef void (*pcap_handler)(u_char *user, const struct pcap_pkthdr *h,const u_char *bytes);
+#Version para la captura por lotes: el argumento user es la clave del lote en _batch_states
+PCAP_BATCH_HANDLER = ctypes.CFUNCTYPE(None, ctypes.c_void_p,ctypes.POINTER(pcappkthdr),ctypes.POINTER(ctypes.c_uint8))
+
+#Estado de cada iterador de lotes activo (clave -> _BatchState)
+_batch_states = {}
+_batch_lock = threading.Lock()
+_batch_next_key = 1
+
+class _BatchState():
+    __slots__ = ('buffer','address','offset','records')
+    def __init__(self,size):
+        self.buffer = bytearray(size)
+        self.address = ctypes.addressof((ctypes.c_uint8 * size).from_buffer(self.buffer))
+        self.offset = 0
+        self.records = []
+
+def _batch_callback(us,h,data):
+    st = _batch_states[us]
+    hdr = h[0]
+    caplen = hdr.caplen
+    off = st.offset
+    if off + caplen > len(st.buffer):
+        caplen = len(st.buffer) - off
+    ctypes.memmove(st.address + off,data,caplen)
+    st.records.append((hdr.tv_sec + hdr.tv_usec * 1e-6,caplen,hdr.len,off))
+    st.offset = off + caplen
+
+_pcap_batch_handler = PCAP_BATCH_HANDLER(_batch_callback)
+
+def pcap_snapshot(handle):
+    #int pcap_snapshot(pcap_t *p);
+    ps = pcap.pcap_snapshot
+    ps.restype = ctypes.c_int
+    return ps(handle)
+
+def pcap_file(handle):
+    #FILE *pcap_file(pcap_t *p);
+    pf = pcap.pcap_file
+    pf.restype = ctypes.c_void_p
+    return pf(handle)
+
+def pcap_geterr(handle):
+    #char *pcap_geterr(pcap_t *p);
+    pge = pcap.pcap_geterr
+    pge.restype = ctypes.c_char_p
+    return pge(handle).decode('ascii','replace')
+
+def iter_batches(handle,max_batch=64):
+    '''
+    Generador que llama a pcap_dispatch pidiendo hasta max_batch tramas por llamada y las copia
+    en un unico buffer reservado al principio. Por cada llamada que devuelva tramas se entrega
+    una lista de tuplas (timestamp, caplen, len, memoryview). Las memoryview apuntan al buffer
+    compartido, que se reutiliza en el siguiente lote: si se quieren conservar los datos hay que
+    copiarlos (bytes(mv)) antes de pedir el siguiente lote.
+    Termina cuando se llama a pcap_breakloop o, si el handle es un fichero (pcap_open_offline), cuando se
+    acaba el fichero. Si pcap_dispatch devuelve error se lanza OSError con el mensaje de pcap_geterr.
+    '''
+    global _batch_next_key
+    snaplen = pcap_snapshot(handle)
+    if snaplen <= 0:
+        snaplen = 65535
+    offline = pcap_file(handle) is not None
+    st = _BatchState(max_batch * snaplen)
+    view = memoryview(st.buffer)
+    with _batch_lock:
+        key = _batch_next_key
+        _batch_next_key += 1
+        _batch_states[key] = st
+    #int pcap_dispatch(pcap_t *p, int cnt,pcap_handler callback, u_char *user);
+    pd = pcap.pcap_dispatch
+    pd.restype = ctypes.c_int
+    c = ctypes.c_int(max_batch)
+    us = ctypes.c_void_p(key)
+    try:
+        while True:
+            st.offset = 0
+            st.records = []
+            ret = pd(handle,c,_pcap_batch_handler,us)
+            if ret == -1:
+                raise OSError('pcap_dispatch: ' + pcap_geterr(handle))
+            if ret < 0:
+                #-2: pcap_breakloop
+                break
+            if ret == 0:
+                if offline:
+                    break
+                continue
+            yield [(ts,caplen,length,view[off:off + caplen]) for (ts,caplen,length,off) in st.records]
+    finally:
+        with _batch_lock:
+            del _batch_states[key]
+
+
+class pcap_stat():
+    def __init__(self):
+        self.ps_recv = 0
+        self.ps_drop = 0
+        self.ps_ifdrop = 0
+
+class pcapstat(ctypes.Structure):
+    _fields_ = [("ps_recv", ctypes.c_uint), ("ps_drop", ctypes.c_uint), ("ps_ifdrop", ctypes.c_uint)]
+
+def pcap_stats(handle,stats):
+    #int pcap_stats(pcap_t *p, struct pcap_stat *ps);
+    ps = pcap.pcap_stats
+    ps.restype = ctypes.c_int
+    s = pcapstat()
+    ret = ps(handle,ctypes.byref(s))
+    stats.ps_recv = s.ps_recv
+    stats.ps_drop = s.ps_drop
+    stats.ps_ifdrop = s.ps_ifdrop
+    return ret
+
+#Valores de precision de los timestamps para pcap_set_tstamp_precision
+PCAP_TSTAMP_PRECISION_MICRO = 0
+PCAP_TSTAMP_PRECISION_NANO = 1
+
+#Perfiles de captura para pcap_open_profile:
+#   -low-latency: cada trama se entrega en cuanto llega (immediate mode), con un buffer pequenno
+#   -high-throughput: las tramas se entregan por lotes (timeout largo) con un buffer del kernel grande para no perder tramas
+PCAP_PROFILES = {
+    'low-latency': {'buffer_size': 2 * 1024 * 1024, 'immediate': 1, 'timeout': 1, 'tstamp_precision': PCAP_TSTAMP_PRECISION_MICRO},
+    'high-throughput': {'buffer_size': 64 * 1024 * 1024, 'immediate': 0, 'timeout': 100, 'tstamp_precision': PCAP_TSTAMP_PRECISION_MICRO},
+}
+
+def pcap_create(device,errbuf):
+    #pcap_t *pcap_create(const char *source, char *errbuf);
+    pcr = pcap.pcap_create
+    pcr.restype = ctypes.c_void_p
+    dv = bytes(str(device), 'ascii')
+    eb = ctypes.create_string_buffer(256)
+    handle = pcr(dv,eb)
+    errbuf.extend(bytes(format(eb.value).encode('ascii')))
+    return handle
+
+def pcap_set_snaplen(handle,snaplen):
+    #int pcap_set_snaplen(pcap_t *p, int snaplen);
+    pss = pcap.pcap_set_snaplen
+    pss.restype = ctypes.c_int
+    return pss(handle,ctypes.c_int(snaplen))
+
+def pcap_set_promisc(handle,promisc):
+    #int pcap_set_promisc(pcap_t *p, int promisc);
+    psp = pcap.pcap_set_promisc
+    psp.restype = ctypes.c_int
+    return psp(handle,ctypes.c_int(promisc))
+
+def pcap_set_timeout(handle,to_ms):
+    #int pcap_set_timeout(pcap_t *p, int to_ms);
+    pst = pcap.pcap_set_timeout
+    pst.restype = ctypes.c_int
+    return pst(handle,ctypes.c_int(to_ms))
+
+def pcap_set_buffer_size(handle,buffer_size):
+    #int pcap_set_buffer_size(pcap_t *p, int buffer_size);
+    psb = pcap.pcap_set_buffer_size
+    psb.restype = ctypes.c_int
+    return psb(handle,ctypes.c_int(buffer_size))
+
+def pcap_set_immediate_mode(handle,immediate_mode):
+    #int pcap_set_immediate_mode(pcap_t *p, int immediate_mode);
+    psi = pcap.pcap_set_immediate_mode
+    psi.restype = ctypes.c_int
+    return psi(handle,ctypes.c_int(immediate_mode))
+
+def pcap_set_tstamp_precision(handle,tstamp_precision):
+    #int pcap_set_tstamp_precision(pcap_t *p, int tstamp_precision);
+    pstp = pcap.pcap_set_tstamp_precision
+    pstp.restype = ctypes.c_int
+    return pstp(handle,ctypes.c_int(tstamp_precision))
+
+def pcap_activate(handle):
+    #int pcap_activate(pcap_t *p);
+    pa = pcap.pcap_activate
+    pa.restype = ctypes.c_int
+    return pa(handle)
+
+def pcap_statustostr(error):
+    #const char *pcap_statustostr(int error);
+    pstr = pcap.pcap_statustostr
+    pstr.restype = ctypes.c_char_p
+    return pstr(ctypes.c_int(error)).decode('ascii','replace')
+
+def pcap_open_profile(device,snaplen,promisc,profile,errbuf):
+    #Equivalente a pcap_open_live usando pcap_create/pcap_activate con uno de los perfiles de PCAP_PROFILES
+    conf = PCAP_PROFILES[profile]
+    handle = pcap_create(device,errbuf)
+    if not handle:
+        return None
+    pcap_set_snaplen(handle,snaplen)
+    pcap_set_promisc(handle,promisc)
+    pcap_set_timeout(handle,conf['timeout'])
+    pcap_set_buffer_size(handle,conf['buffer_size'])
+    pcap_set_immediate_mode(handle,conf['immediate'])
+    #Si la interfaz no admite la precision pedida se queda con la que tenga
+    pcap_set_tstamp_precision(handle,conf['tstamp_precision'])
+    ret = pcap_activate(handle)
+    if ret < 0:
+        errbuf.extend(bytes(pcap_statustostr(ret).encode('ascii')))
+        pcap_close(handle)
+        return None
+    return handle
+
+
+#Numeros magicos de los ficheros de captura
+PCAP_MAGIC_USEC = 0xa1b2c3d4
+PCAP_MAGIC_NSEC = 0xa1b23c4d
+PCAPNG_SHB_TYPE = 0x0A0D0D0A
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+PCAPNG_IDB_TYPE = 0x00000001
+PCAPNG_OPB_TYPE = 0x00000002
+PCAPNG_SPB_TYPE = 0x00000003
+PCAPNG_EPB_TYPE = 0x00000006
+PCAP_GLOBAL_HLEN = 24
+PCAP_RECORD_HLEN = 16
+
+#Formatos de salida de PcapWriter
+PCAP_FORMAT_USEC = 'usec'
+PCAP_FORMAT_NSEC = 'nsec'
+PCAP_FORMAT_PCAPNG = 'pcapng'
+#Tamanno por defecto del buffer de escritura de PcapWriter
+PCAP_WRITER_BUFSIZE = 1 << 20
+#Relleno de los bloques pcapng hasta multiplo de 4 bytes
+PCAPNG_PADDING = (b'',b'\x00',b'\x00\x00',b'\x00\x00\x00')
+
+#Indice de timestamps de un fichero pcap (fichero auxiliar <captura>.idx): una entrada cada PCAP_INDEX_EVERY registros
+PCAP_INDEX_SUFFIX = '.idx'
+PCAP_INDEX_EVERY = 1000
+PCAP_INDEX_MAGIC = b'PIDX'
+#Cabecera: magico, version, registros entre entradas, unidades de timestamp por segundo
+PCAP_INDEX_HDR = struct.Struct('<4sIII')
+#Entrada: numero de registro (desde 0), posicion de su cabecera en el fichero, timestamp en unidades de 1/tsresol s
+PCAP_INDEX_ENTRY = struct.Struct('<QQQ')
+
+class PcapIndex():
+    '''
+    Indice de un fichero pcap: guarda la posicion y el timestamp de uno de cada every registros para poder saltar
+    a un numero de registro o a un instante sin recorrer el fichero desde el principio.
+    Las busquedas por tiempo suponen que los timestamps del fichero no decrecen (como en una captura en vivo).
+    '''
+    def __init__(self,every=PCAP_INDEX_EVERY,tsresol=1000000):
+        self.every = every
+        self.tsresol = tsresol
+        self.numbers = []
+        self.offsets = []
+        self.stamps = []
+
+    def add(self,number,offset,stamp):
+        self.numbers.append(number)
+        self.offsets.append(offset)
+        self.stamps.append(stamp)
+
+    def header(self):
+        return PCAP_INDEX_HDR.pack(PCAP_INDEX_MAGIC,1,self.every,self.tsresol)
+
+    def save(self,fname):
+        with open(fname,'wb') as f:
+            f.write(self.header())
+            for entry in zip(self.numbers,self.offsets,self.stamps):
+                f.write(PCAP_INDEX_ENTRY.pack(*entry))
+
+    @classmethod
+    def load(cls,fname):
+        with open(fname,'rb') as f:
+            data = f.read()
+        if len(data) < PCAP_INDEX_HDR.size:
+            raise ValueError('Indice incompleto: ' + str(fname))
+        magic,version,every,tsresol = PCAP_INDEX_HDR.unpack_from(data,0)
+        if magic != PCAP_INDEX_MAGIC or version != 1:
+            raise ValueError('Formato de indice desconocido: ' + str(fname))
+        index = cls(every,tsresol)
+        #Una entrada a medio escribir al final (captura en curso) se ignora
+        n = (len(data) - PCAP_INDEX_HDR.size) // PCAP_INDEX_ENTRY.size
+        for entry in PCAP_INDEX_ENTRY.iter_unpack(memoryview(data)[PCAP_INDEX_HDR.size:PCAP_INDEX_HDR.size + n * PCAP_INDEX_ENTRY.size]):
+            index.add(*entry)
+        return index
+
+    def find_packet(self,number):
+        #Devuelve (numero, posicion) de la ultima entrada que no pasa del registro number, o None
+        i = bisect.bisect_right(self.numbers,number) - 1
+        if i < 0:
+            return None
+        return self.numbers[i],self.offsets[i]
+
+    def find_time(self,stamp):
+        #Devuelve (numero, posicion) de la ultima entrada anterior al instante stamp (en unidades de 1/tsresol s), o None
+        i = bisect.bisect_left(self.stamps,stamp) - 1
+        if i < 0:
+            return None
+        return self.numbers[i],self.offsets[i]
+
+class PcapWriter():
+    '''
+    Escritor de ficheros de captura que no usa libpcap: sustituye a pcap_dump_open/pcap_dump.
+    Las cabeceras de cada registro se serializan con struct.pack_into en un buffer grande que se reutiliza y
+    el buffer se vuelca al fichero con una unica llamada a write cuando se llena (o con flush/close).
+    Con threaded=True el volcado lo hace un hilo aparte: mientras se escribe un buffer se rellena el otro.
+    Formatos: PCAP_FORMAT_USEC (pcap clasico), PCAP_FORMAT_NSEC (pcap de nanosegundos) y PCAP_FORMAT_PCAPNG
+    (una seccion con una unica interfaz con if_tsresol de nanosegundos).
+    Si fname termina en .gz o .xz el fichero se comprime al vuelo (ver pcap_fopen); con threaded=True la compresion
+    tambien la hace el hilo escritor.
+    Con index > 0 se va escribiendo a la vez el indice <fname>.idx (ver PcapIndex) con una entrada cada index
+    registros; las entradas se vuelcan junto con el buffer, asi que el indice esta listo al cerrar la captura.
+    '''
+    def __init__(self,fname,linktype=DLT_EN10MB,snaplen=65535,fmt=PCAP_FORMAT_USEC,bufsize=PCAP_WRITER_BUFSIZE,threaded=False,fileobj=None,index=0):
+        if fmt not in (PCAP_FORMAT_USEC,PCAP_FORMAT_NSEC,PCAP_FORMAT_PCAPNG):
+            raise ValueError('Formato de captura desconocido: ' + str(fmt))
+        if index > 0 and (fmt == PCAP_FORMAT_PCAPNG or fileobj is not None or str(fname).endswith((PCAP_GZIP_SUFFIX,PCAP_XZ_SUFFIX))):
+            raise ValueError('Solo se pueden indexar ficheros pcap sin comprimir')
+        self.fname = fname
+        self.fmt = fmt
+        self.linktype = linktype
+        self.snaplen = snaplen
+        self.tsresol = 1000000 if fmt == PCAP_FORMAT_USEC else 1000000000
+        self.packets = 0
+        self.bytes = 0
+        self._file = fileobj if fileobj is not None else pcap_fopen(fname,'wb')
+        self._buf = bytearray(bufsize)
+        self._pos = 0
+        #Bytes entregados ya al fichero (la posicion de cada registro es _offset + _pos)
+        self._offset = 0
+        self._thread = None
+        self._error = None
+        self.index = index
+        self._idxfile = None
+        if index > 0:
+            self._idxbuf = bytearray()
+            self._idxfile = open(str(fname) + PCAP_INDEX_SUFFIX,'wb')
+            self._idxfile.write(PcapIndex(index,self.tsresol).header())
+        if threaded:
+            #Dos buffers: uno se rellena mientras el hilo escribe el otro
+            self._free = queue.Queue()
+            self._free.put(bytearray(bufsize))
+            self._pending = queue.Queue()
+            self._thread = threading.Thread(target=self._writer,daemon=True)
+            self._thread.start()
+        if fmt == PCAP_FORMAT_PCAPNG:
+            self._hlen = 28
+            self._rec = struct.Struct('<IIIIIII')
+            self._write_pcapng_header()
+        else:
+            self._hlen = PCAP_RECORD_HLEN
+            self._rec = struct.Struct('<IIII')
+            magic = PCAP_MAGIC_USEC if fmt == PCAP_FORMAT_USEC else PCAP_MAGIC_NSEC
+            self._append(struct.pack('<IHHiIII',magic,2,4,0,0,snaplen,linktype))
+
+    def _write_pcapng_header(self):
+        #Section Header Block (longitud de seccion desconocida) + Interface Description Block con if_tsresol = 9
+        self._append(struct.pack('<IIIHHqI',PCAPNG_SHB_TYPE,28,PCAPNG_BYTE_ORDER_MAGIC,1,0,-1,28))
+        self._append(struct.pack('<IIHHIHHB3xHHI',PCAPNG_IDB_TYPE,32,self.linktype,0,self.snaplen,9,1,9,0,0,32))
+
+    def _append(self,data):
+        n = len(data)
+        if self._pos + n > len(self._buf):
+            self.flush()
+        if n > len(self._buf):
+            self._output(data,n)
+            return
+        self._buf[self._pos:self._pos + n] = data
+        self._pos += n
+
+    def write(self,tv_sec,tv_frac,data,length=None):
+        '''
+        Escribe un registro. tv_frac esta en unidades de 1/tsresol segundos (microsegundos para PCAP_FORMAT_USEC,
+        nanosegundos para el resto) y length es la longitud original de la trama (por defecto len(data)).
+        data puede ser cualquier objeto que soporte el protocolo buffer (bytes, bytearray, memoryview...).
+        '''
+        caplen = len(data)
+        if caplen > self.snaplen:
+            data = memoryview(data)[:self.snaplen]
+            if length is None:
+                length = caplen
+            caplen = self.snaplen
+        elif length is None:
+            length = caplen
+        if self.fmt == PCAP_FORMAT_PCAPNG:
+            pad = (-caplen) & 3
+            total = 32 + caplen + pad
+            ts = tv_sec * 1000000000 + tv_frac
+        else:
+            pad = 0
+            total = PCAP_RECORD_HLEN + caplen
+        pos = self._pos
+        if pos + total > len(self._buf):
+            self.flush()
+            pos = 0
+        if self._idxfile is not None and self.packets % self.index == 0:
+            self._idxbuf += PCAP_INDEX_ENTRY.pack(self.packets,self._offset + pos,tv_sec * self.tsresol + tv_frac)
+        if total > len(self._buf):
+            #Registro mayor que el buffer: se escribe por partes sin pasar por el
+            self._write_large(tv_sec,tv_frac,data,caplen,length,pad,total)
+            return
+        buf = self._buf
+        if self.fmt == PCAP_FORMAT_PCAPNG:
+            self._rec.pack_into(buf,pos,PCAPNG_EPB_TYPE,total,0,ts >> 32,ts & 0xffffffff,caplen,length)
+            end = pos + 28 + caplen
+            buf[pos + 28:end] = data
+            buf[end:end + pad] = PCAPNG_PADDING[pad]
+            struct.pack_into('<I',buf,end + pad,total)
+        else:
+            self._rec.pack_into(buf,pos,tv_sec,tv_frac,caplen,length)
+            buf[pos + PCAP_RECORD_HLEN:pos + total] = data
+        self._pos = pos + total
+        self.packets += 1
+        self.bytes += caplen
+
+    def _write_large(self,tv_sec,tv_frac,data,caplen,length,pad,total):
+        if self.fmt == PCAP_FORMAT_PCAPNG:
+            ts = tv_sec * 1000000000 + tv_frac
+            self._output(self._rec.pack(PCAPNG_EPB_TYPE,total,0,ts >> 32,ts & 0xffffffff,caplen,length),28)
+            self._output(bytes(data) + bytes(pad) + struct.pack('<I',total),caplen + pad + 4)
+        else:
+            self._output(self._rec.pack(tv_sec,tv_frac,caplen,length),PCAP_RECORD_HLEN)
+            self._output(bytes(data),caplen)
+        self.packets += 1
+        self.bytes += caplen
+
+    def dump(self,header,data):
+        '''
+        Equivalente a pcap_dump: recibe la cabecera pcap_pkthdr (timestamp en microsegundos) que entrega pcap_loop.
+        '''
+        tv_usec = header.ts.tv_usec
+        if self.tsresol != 1000000:
+            tv_usec *= 1000
+        self.write(header.ts.tv_sec,tv_usec,memoryview(data)[:header.caplen],header.len)
+
+    def _output(self,buf,n,recycle=False):
+        #Entrega n bytes de buf al fichero (o al hilo escritor, que devuelve buf a los libres si recycle es True)
+        self._offset += n
+        if self._thread is None:
+            self._file.write(memoryview(buf)[:n])
+            return
+        if self._error is not None:
+            raise self._error
+        self._pending.put((buf,n,recycle))
+
+    def _writer(self):
+        while True:
+            item = self._pending.get()
+            if item is None:
+                return
+            buf,n,recycle = item
+            try:
+                if self._error is None:
+                    self._file.write(memoryview(buf)[:n])
+            except OSError as e:
+                self._error = e
+            if recycle:
+                self._free.put(buf)
+
+    @property
+    def bytesWritten(self):
+        #Tamanno del fichero (sin comprimir) con los registros escritos hasta ahora, incluidos los que estan en el buffer
+        return self._offset + self._pos
+
+    def flush(self):
+        '''
+        Vuelca al fichero los registros pendientes del buffer (y sus entradas del indice).
+        '''
+        if self._pos > 0:
+            if self._thread is None:
+                self._output(self._buf,self._pos)
+            else:
+                full = self._buf
+                #El hilo escritor devuelve el buffer a la cola de libres cuando termina con el
+                self._buf = self._free.get()
+                self._output(full,self._pos,True)
+            self._pos = 0
+        if self._idxfile is not None and self._idxbuf:
+            self._idxfile.write(self._idxbuf)
+            self._idxfile.flush()
+            del self._idxbuf[:]
+
+    def close(self):
+        if self._file is None:
+            return
+        try:
+            self.flush()
+        finally:
+            if self._thread is not None:
+                self._pending.put(None)
+                self._thread.join()
+                self._thread = None
+            self._file.close()
+            self._file = None
+            if self._idxfile is not None:
+                self._idxfile.close()
+                self._idxfile = None
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+#Tamanno por defecto de la cola entre el hilo de captura y el hilo escritor de RotatingPcapWriter
+PCAP_ROTATE_QUEUE = 10000
+#Cada cuanto (segundos) comprueba el hilo escritor la rotacion por tiempo si no llegan registros
+PCAP_ROTATE_TICK = 0.5
+
+class RotatingPcapWriter():
+    '''
+    Escritor de capturas continuas sobre un anillo de ficheros. El hilo de captura solo encola los registros
+    (dump no bloquea nunca: si la cola esta llena el registro se descarta y se cuenta) y un hilo escritor los
+    vuelca con PcapWriter, cambiando de fichero cuando el actual supera maxBytes bytes o lleva maxSeconds
+    segundos abierto. Con keepFiles > 0 solo se conservan los ultimos keepFiles ficheros.
+    Los ficheros se llaman <prefix>.<numero de fichero>.<segundos de apertura>.pcap (o .pcapng), seguido de compress
+    ('.gz' o '.xz') si se quieren comprimidos. maxBytes se refiere a los datos antes de comprimir.
+    Con index > 0 cada fichero lleva su indice .idx (ver PcapWriter), que se borra junto con el fichero.
+    Contadores (ver stats): queued (encolados), written (escritos), dropped (descartados por cola llena) y files.
+    '''
+    def __init__(self,prefix,linktype=DLT_EN10MB,snaplen=65535,fmt=PCAP_FORMAT_USEC,maxBytes=0,maxSeconds=0,keepFiles=0,queueSize=PCAP_ROTATE_QUEUE,bufsize=PCAP_WRITER_BUFSIZE,compress='',index=0):
+        self.prefix = prefix
+        self.linktype = linktype
+        self.snaplen = snaplen
+        self.fmt = fmt
+        self.maxBytes = maxBytes
+        self.maxSeconds = maxSeconds
+        self.keepFiles = keepFiles
+        self.bufsize = bufsize
+        self.index = index
+        self.extension = ('.pcapng' if fmt == PCAP_FORMAT_PCAPNG else '.pcap') + compress
+        self.queued = 0
+        self.written = 0
+        self.dropped = 0
+        #Descartados por el hilo escritor tras un error (dropped solo lo incrementa el hilo de captura)
+        self._lost = 0
+        self.files = 0
+        self.closedFiles = []
+        self._writer = None
+        self._opened = 0
+        self._error = None
+        self._queue = queue.Queue(maxsize=queueSize)
+        self._thread = threading.Thread(target=self._run,daemon=True)
+        self._thread.start()
+
+    def dump(self,header,data):
+        '''
+        Encola un registro con la cabecera pcap_pkthdr que entrega pcap_loop. data no debe modificarse despues
+        (mycallback entrega una copia nueva de cada trama). Devuelve False si el registro se ha descartado.
+        '''
+        try:
+            self._queue.put_nowait((header.ts.tv_sec,header.ts.tv_usec,header.len,data))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self.queued += 1
+        return True
+
+    def _open(self):
+        now = time.time()
+        fname = '{}.{:04d}.{}{}'.format(self.prefix,self.files,int(now),self.extension)
+        self._writer = PcapWriter(fname,self.linktype,self.snaplen,self.fmt,self.bufsize,index=self.index)
+        self._opened = time.monotonic()
+        self.files += 1
+
+    def _rotate(self):
+        if self._writer is None:
+            return
+        self._writer.close()
+        self.closedFiles.append(self._writer.fname)
+        self._writer = None
+        while self.keepFiles > 0 and len(self.closedFiles) >= self.keepFiles:
+            #Se cuenta tambien el fichero que se va a abrir
+            fname = self.closedFiles.pop(0)
+            try:
+                os.remove(fname)
+                if self.index > 0:
+                    os.remove(fname + PCAP_INDEX_SUFFIX)
+            except OSError as e:
+                logging.warning('No se ha podido borrar el fichero de captura: ' + str(e))
+
+    def _expired(self):
+        if self._writer is None:
+            return False
+        if self.maxBytes > 0 and self._writer.bytesWritten >= self.maxBytes:
+            return True
+        return self.maxSeconds > 0 and time.monotonic() - self._opened >= self.maxSeconds
+
+    def _run(self):
+        nsec = self.fmt != PCAP_FORMAT_USEC
+        while True:
+            try:
+                item = self._queue.get(timeout=PCAP_ROTATE_TICK)
+            except queue.Empty:
+                item = False
+            if item is None:
+                break
+            try:
+                if self._expired():
+                    self._rotate()
+                if item is False:
+                    continue
+                tv_sec,tv_usec,length,data = item
+                if self._writer is None:
+                    self._open()
+                self._writer.write(tv_sec,tv_usec * 1000 if nsec else tv_usec,data,length)
+                self.written += 1
+            except OSError as e:
+                #Sin disco no se puede seguir: los registros siguientes se descartan
+                logging.error('Error escribiendo la captura: ' + str(e))
+                self._error = e
+                #El fichero (y su indice) se cierra igualmente para que cuente en keepFiles
+                if self._writer is not None:
+                    try:
+                        self._writer.close()
+                    except OSError:
+                        pass
+                    self.closedFiles.append(self._writer.fname)
+                    self._writer = None
+                self._drain()
+                return
+        if self._writer is not None:
+            self._writer.close()
+            self.closedFiles.append(self._writer.fname)
+            self._writer = None
+
+    def _drain(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            self._lost += 1
+
+    def stats(self):
+        return {'queued': self.queued, 'written': self.written, 'dropped': self.dropped + self._lost, 'files': self.files}
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+#Extensiones de los ficheros de captura comprimidos y nivel de compresion al escribirlos
+PCAP_GZIP_SUFFIX = '.gz'
+PCAP_XZ_SUFFIX = '.xz'
+PCAP_GZIP_LEVEL = 6
+PCAP_XZ_PRESET = 3
+#Tamanno de los bloques que lee PcapStreamReader y numero de bloques que puede adelantar su hilo lector
+PCAP_STREAM_BLOCK = 4 * 1024 * 1024
+PCAP_STREAM_AHEAD = 4
+
+def pcap_compressed(fname):
+    '''
+    Devuelve el modulo (gzip o lzma) con el que esta comprimido el fichero segun su numero magico, o None.
+    '''
+    with open(fname,'rb') as f:
+        magic = f.read(6)
+    if magic[:2] == b'\x1f\x8b':
+        return gzip
+    if magic == b'\xfd7zXZ\x00':
+        return lzma
+    return None
+
+def pcap_fopen(fname,mode):
+    '''
+    Abre un fichero de captura en modo binario ('rb' o 'wb'). Los ficheros .gz y .xz se comprimen o descomprimen
+    al vuelo con gzip y lzma de la libreria estandar. Al leer, el formato se detecta por el numero magico.
+    '''
+    if mode.startswith('r'):
+        codec = pcap_compressed(fname)
+        if codec is not None:
+            return codec.open(fname,'rb')
+        return open(fname,'rb')
+    if str(fname).endswith(PCAP_GZIP_SUFFIX):
+        return gzip.open(fname,'wb',compresslevel=PCAP_GZIP_LEVEL)
+    if str(fname).endswith(PCAP_XZ_SUFFIX):
+        return lzma.open(fname,'wb',preset=PCAP_XZ_PRESET)
+    return open(fname,'wb')
+
+class PcapStreamReader():
+    '''
+    Lector secuencial de ficheros pcap (microsegundos o nanosegundos), comprimidos o no (ver pcap_fopen).
+    El fichero se lee en bloques de blockSize bytes; con threaded=True un hilo lector va descomprimiendo
+    hasta PCAP_STREAM_AHEAD bloques por adelantado mientras se procesan los registros.
+    Al iterar se obtienen las mismas tuplas que con PcapReader: (tv_sec, tv_frac, caplen, len, data), donde
+    data es una memoryview sobre el bloque leido (solo se copian los registros que quedan partidos entre dos bloques).
+    '''
+    def __init__(self,fname,blockSize=PCAP_STREAM_BLOCK,threaded=True):
+        self.fname = fname
+        self.blockSize = blockSize
+        self.pcapng = False
+        self._file = pcap_fopen(fname,'rb')
+        header = self._file.read(PCAP_GLOBAL_HLEN)
+        magic = None
+        if len(header) == PCAP_GLOBAL_HLEN:
+            for endian in ('<','>'):
+                magic = struct.unpack_from(endian + 'I',header,0)[0]
+                if magic in (PCAP_MAGIC_USEC,PCAP_MAGIC_NSEC):
+                    break
+        if magic not in (PCAP_MAGIC_USEC,PCAP_MAGIC_NSEC):
+            self._file.close()
+            raise ValueError('Formato de captura no soportado en modo secuencial: ' + str(fname))
+        self.endian = endian
+        self.tsresol = 1000000000 if magic == PCAP_MAGIC_NSEC else 1000000
+        self.snaplen,self.linktype = struct.unpack_from(endian + 'II',header,16)
+        self._thread = None
+        if threaded:
+            self._blocks = queue.Queue(maxsize=PCAP_STREAM_AHEAD)
+            self._stop = False
+            self._error = None
+            self._thread = threading.Thread(target=self._reader,daemon=True)
+            self._thread.start()
+
+    def _reader(self):
+        try:
+            while not self._stop:
+                block = self._file.read(self.blockSize)
+                self._blocks.put(block)
+                if not block:
+                    return
+        except (OSError,EOFError,lzma.LZMAError) as e:
+            self._error = e
+            self._blocks.put(b'')
+
+    def _next_block(self):
+        if self._thread is None:
+            return self._file.read(self.blockSize)
+        block = self._blocks.get()
+        if not block and self._error is not None:
+            raise self._error
+        return block
+
+    def __iter__(self):
+        unpack_from = struct.Struct(self.endian + 'IIII').unpack_from
+        block = b''
+        view = memoryview(block)
+        off = 0
+        while True:
+            if off + PCAP_RECORD_HLEN <= len(block):
+                tv_sec,tv_frac,caplen,length = unpack_from(view,off)
+                end = off + PCAP_RECORD_HLEN + caplen
+                if end <= len(block):
+                    yield (tv_sec,tv_frac,caplen,length,view[off + PCAP_RECORD_HLEN:end])
+                    off = end
+                    continue
+            #Registro partido entre dos (o mas) bloques: se copia a un bytearray propio
+            pending = bytearray(view[off:])
+            off = len(block)
+            need = PCAP_RECORD_HLEN
+            caplen = None
+            while caplen is None or len(pending) < need:
+                if len(pending) >= need:
+                    caplen = unpack_from(pending,0)[2]
+                    need += caplen
+                    continue
+                if off >= len(block):
+                    block = self._next_block()
+                    if not block:
+                        #Fin del fichero (un registro incompleto al final se ignora)
+                        return
+                    view = memoryview(block)
+                    off = 0
+                take = min(need - len(pending),len(block) - off)
+                pending += view[off:off + take]
+                off += take
+            tv_sec,tv_frac,caplen,length = unpack_from(pending,0)
+            yield (tv_sec,tv_frac,caplen,length,memoryview(pending)[PCAP_RECORD_HLEN:])
+
+    def close(self):
+        if self._file is None:
+            return
+        if self._thread is not None:
+            self._stop = True
+            #Vaciamos la cola para que el hilo lector no se quede bloqueado en put
+            while self._thread.is_alive():
+                try:
+                    self._blocks.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            self._thread = None
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        return self
 
+    def __exit__(self,*args):
+        self.close()
 
+def pcap_open_stream(fname,blockSize=PCAP_STREAM_BLOCK,threaded=True):
+    '''
+    Equivalente a pcap_open_offline para ficheros pcap comprimidos (.gz, .xz) o planos leidos en secuencia:
+    devuelve un PcapStreamReader que se recorre con un for y se cierra con close().
+    '''
+    return PcapStreamReader(fname,blockSize,threaded)
@@ -0,0 +1,217 @@
+'''
+    rewrite.py
+    Reescribe una traza pcap completa en un solo recorrido:
+        -timestamps: desplazamiento (--offset segundos) y/o cambio de escala respecto al primer paquete (--scale)
+        -recorte de cada trama a --snaplen bytes
+        -seleccion por tiempo (--start/--end, sobre los timestamps originales) o por numero de registro (--skip/--count)
+        -muestreo de uno de cada N registros (--sample N)
+    Normalmente la traza se lee en secuencia (PcapStreamReader) y se escribe con PcapWriter, asi que sirve para ficheros
+    mucho mayores que la memoria. Si solo se cambian timestamps se puede usar --inplace: el fichero se proyecta en
+    memoria con mmap y se sobreescriben las cabeceras de los registros sin copiar los datos.
+    Uso: python3 rewrite.py --file traza.pcap [-o salida.pcap] [opciones]
+'''
+
+from rc1_pcap import *
+import argparse
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+
+'''
+Clase que calcula los nuevos timestamps. Trabaja en unidades de 1/tsresol segundos para no perder precision:
+    nuevo = primero + (original - primero) * scale + offset
+donde primero es el timestamp del primer registro reescrito.
+'''
+class tsRewriter():
+
+    def __init__(self, tsresol, offset=0.0, scale=1.0):
+        self.tsresol = tsresol
+        self.offset = int(round(offset * tsresol))
+        self.scale = scale
+        self.first = None
+        self.clamped = 0
+
+    def identity(self):
+        return self.offset == 0 and self.scale == 1.0
+
+    def rewrite(self, tv_sec, tv_frac):
+        ts = tv_sec * self.tsresol + tv_frac
+        if self.first is None:
+            self.first = ts
+        if self.scale != 1.0:
+            ts = self.first + int(round((ts - self.first) * self.scale))
+        ts += self.offset
+        if ts < 0:
+            # Un pcap no admite timestamps anteriores a 1970
+            self.clamped += 1
+            ts = 0
+        return divmod(ts, self.tsresol)
+
+
+'''
+Nombre: rewriteInPlace
+Descripcion: Esta funcion cambia los timestamps de todos los registros de un fichero pcap sin moverlos: proyecta el
+    fichero en memoria y reescribe con struct.pack_into los dos primeros campos de cada cabecera.
+    Antes de escribir nada se recorren las cabeceras para comprobar que los nuevos timestamps caben en el formato pcap,
+    de modo que un error no deja el fichero a medio reescribir. Si el fichero tiene indice (<fname>.idx, ver
+    PcapWriter) se vuelve a generar con los nuevos timestamps y el mismo numero de registros entre entradas.
+Argumentos:
+    -fname: fichero pcap (sin comprimir)
+    -offset, scale: ver tsRewriter
+Retorno: numero de registros reescritos
+'''
+def rewriteInPlace(fname, offset=0.0, scale=1.0):
+
+    idxname = str(fname) + PCAP_INDEX_SUFFIX
+    every = None
+    if os.path.exists(idxname):
+        try:
+            every = PcapIndex.load(idxname).every
+        except ValueError:
+            every = PCAP_INDEX_EVERY
+    with open(fname, 'r+b') as f:
+        mm = mmap.mmap(f.fileno(), 0)
+        try:
+            if len(mm) < PCAP_GLOBAL_HLEN:
+                raise ValueError('Fichero demasiado corto para ser un pcap: ' + str(fname))
+            for endian in ('<', '>'):
+                magic = struct.unpack_from(endian + 'I', mm, 0)[0]
+                if magic in (PCAP_MAGIC_USEC, PCAP_MAGIC_NSEC):
+                    break
+            else:
+                raise ValueError('Solo se pueden reescribir en el sitio ficheros pcap: ' + str(fname))
+            tsresol = 1000000000 if magic == PCAP_MAGIC_NSEC else 1000000
+            rec = struct.Struct(endian + 'IIII')
+            size = len(mm)
+
+            # Primer recorrido: solo se comprueba que todos los timestamps nuevos se pueden escribir
+            ts = tsRewriter(tsresol, offset, scale)
+            off = PCAP_GLOBAL_HLEN
+            while off + PCAP_RECORD_HLEN <= size:
+                tv_sec, tv_frac, caplen, length = rec.unpack_from(mm, off)
+                if ts.rewrite(tv_sec, tv_frac)[0] > 0xffffffff:
+                    raise ValueError('Los nuevos timestamps no caben en un fichero pcap (posteriores a 2106)')
+                off += PCAP_RECORD_HLEN + caplen
+
+            ts = tsRewriter(tsresol, offset, scale)
+            index = None if every is None else PcapIndex(every, tsresol)
+            off = PCAP_GLOBAL_HLEN
+            n = 0
+            while off + PCAP_RECORD_HLEN <= size:
+                tv_sec, tv_frac, caplen, length = rec.unpack_from(mm, off)
+                tv_sec, tv_frac = ts.rewrite(tv_sec, tv_frac)
+                struct.pack_into(endian + 'II', mm, off, tv_sec, tv_frac)
+                if index is not None and n % index.every == 0:
+                    index.add(n, off, tv_sec * tsresol + tv_frac)
+                off += PCAP_RECORD_HLEN + caplen
+                n += 1
+            mm.flush()
+        finally:
+            mm.close()
+    if index is not None:
+        index.save(idxname)
+    if ts.clamped:
+        logging.warning('{} timestamps anteriores a 1970 se han dejado a 0'.format(ts.clamped))
+    return n
+
+
+'''
+Nombre: rewriteTrace
+Descripcion: Esta funcion copia la traza fname en output aplicando las operaciones indicadas, en un solo recorrido.
+Argumentos:
+    -fname: traza de entrada (pcap, puede estar comprimida)
+    -output: traza de salida (.gz o .xz para comprimirla)
+    -offset, scale: cambio de timestamps (ver tsRewriter)
+    -snaplen: si es mayor que 0, bytes maximos de cada trama en la salida
+    -start, end: si no son None, solo se copian los registros con timestamp original en [start, end) segundos
+    -skip, count: se saltan los skip primeros registros y se copian como mucho count (None => todos)
+    -sample: se copia uno de cada sample registros de los seleccionados
+Retorno: tupla (registros leidos, registros escritos)
+'''
+def rewriteTrace(fname, output, offset=0.0, scale=1.0, snaplen=0, start=None, end=None, skip=0, count=None, sample=1):
+
+    read = 0
+    selected = 0
+    written = 0
+    with PcapStreamReader(fname) as reader:
+        res = reader.tsresol
+        ts = tsRewriter(res, offset, scale)
+        first = None if start is None else int(round(start * res))
+        stop = None if end is None else int(round(end * res))
+        outSnaplen = min(snaplen, reader.snaplen) if snaplen > 0 and reader.snaplen > 0 else (snaplen or reader.snaplen or 65535)
+        fmt = PCAP_FORMAT_NSEC if res != 1000000 else PCAP_FORMAT_USEC
+        with PcapWriter(output, reader.linktype, outSnaplen, fmt, threaded=True) as writer:
+            for tv_sec, tv_frac, caplen, length, data in reader:
+                if count is not None and written >= count:
+                    break
+                read += 1
+                if read <= skip:
+                    continue
+                if first is not None or stop is not None:
+                    stamp = tv_sec * res + tv_frac
+                    if (first is not None and stamp < first) or (stop is not None and stamp >= stop):
+                        continue
+                selected += 1
+                if (selected - 1) % sample != 0:
+                    continue
+                if not ts.identity():
+                    tv_sec, tv_frac = ts.rewrite(tv_sec, tv_frac)
+                writer.write(tv_sec, tv_frac, data, length)
+                written += 1
+    if ts.clamped:
+        logging.warning('{} timestamps anteriores a 1970 se han dejado a 0'.format(ts.clamped))
+    return read, written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Reescribe timestamps, recorta, selecciona y muestrea una traza pcap')
+    parser.add_argument('--file', dest='tracefile', default=False, help='Traza de entrada')
+    parser.add_argument('-o', dest='output', default=None, help='Traza de salida (no hace falta con --inplace)')
+    parser.add_argument('--offset', dest='offset', type=float, default=0.0, help='Segundos a sumar a cada timestamp (puede ser negativo)')
+    parser.add_argument('--scale', dest='scale', type=float, default=1.0, help='Factor de escala de los tiempos respecto al primer paquete')
+    parser.add_argument('--snaplen', dest='snaplen', type=int, default=0, help='Recortar cada trama a N bytes (0 => no recortar)')
+    parser.add_argument('--start', dest='start', type=float, default=None, help='Copiar solo registros con timestamp >= start (segundos)')
+    parser.add_argument('--end', dest='end', type=float, default=None, help='Copiar solo registros con timestamp < end (segundos)')
+    parser.add_argument('--skip', dest='skip', type=int, default=0, help='Saltar los N primeros registros')
+    parser.add_argument('--count', dest='count', type=int, default=None, help='Copiar como mucho N registros')
+    parser.add_argument('--sample', dest='sample', type=int, default=1, help='Copiar uno de cada N registros')
+    parser.add_argument('--inplace', dest='inplace', default=False, action='store_true', help='Cambiar los timestamps en el propio fichero (solo --offset y --scale)')
+    parser.add_argument('--debug', dest='debug', default=False, action='store_true', help='Activar Debug messages')
+    args = parser.parse_args()
+
+    if args.debug:
+        logging.basicConfig(level = logging.DEBUG, format = '[%(asctime)s %(levelname)s]\t%(message)s')
+    else:
+        logging.basicConfig(level = logging.INFO, format = '[%(asctime)s %(levelname)s]\t%(message)s')
+
+    if args.tracefile is False:
+        logging.error('No se ha especificado fichero')
+        parser.print_help()
+        sys.exit(-1)
+
+    if args.sample < 1 or args.scale <= 0:
+        logging.error('--sample debe ser al menos 1 y --scale mayor que 0')
+        sys.exit(-1)
+
+    begin = time.perf_counter()
+    try:
+        if args.inplace:
+            # En el sitio solo se puede hacer lo que no cambia el tamanno ni el numero de registros
+            if args.snaplen or args.start is not None or args.end is not None or args.skip or args.count is not None or args.sample != 1:
+                logging.error('Con --inplace solo se pueden usar --offset y --scale')
+                sys.exit(-1)
+            n = rewriteInPlace(args.tracefile, args.offset, args.scale)
+            logging.info('{} registros reescritos en {:.2f} s'.format(n, time.perf_counter() - begin))
+        else:
+            if args.output is None:
+                logging.error('No se ha especificado fichero de salida')
+                sys.exit(-1)
+            read, written = rewriteTrace(args.tracefile, args.output, args.offset, args.scale, args.snaplen,
+                                         args.start, args.end, args.skip, args.count, args.sample)
+            logging.info('{} registros leidos, {} escritos en {:.2f} s'.format(read, written, time.perf_counter() - begin))
+    except (OSError, ValueError) as e:
+        logging.error(str(e))
+        sys.exit(-1)
@@ -8,6 +8,7 @@
 
 
 from ethernet import *
+from packet import Packet
 import logging
 import socket
 import struct
@@ -17,25 +18,39 @@ from threading import Lock
 from expiringdict import ExpiringDict
 from time import sleep
 
-#Semaforo global
-globalLock = Lock()
 #Direccion de difusion (Broadcast)
 broadcastAddr = bytes([0xFF]*6)
 #Cabecera ARP comun a peticiones y respuestas. Especifica para la combinacion Ethernet/IP
 ARPHeader = bytes([0x00,0x01,0x08,0x00,0x06,0x04])
 #longitud (en bytes) de la cabecera comun ARP
 ARP_HLEN = 6
-#Variable que alamacenara que direccion IP se esta intentando resolver
-requestedIP = None
-#Variable que alamacenara que direccion MAC resuelta o None si no se ha podido obtener
-resolvedMAC = None
-#Variable que alamacenara True mientras estemos esperando una respuesta ARP
-awaitingResponse = False
 
-#Variable para proteger la cachae
-cacheLock = Lock()
-#Cachae de ARP. Es un diccionario similar al estandar de Python solo que eliminara las entradas a los 10 segundos
-cache = ExpiringDict(max_len=100, max_age_seconds=10)
+
+'''
+Clase que implementa una cachae ARP compartida entre procesos sobre un diccionario de multiprocessing.Manager.
+Se usa igual que la ExpiringDict: cada entrada guarda la MAC junto con su instante de caducidad.
+'''
+class sharedCache():
+
+    def __init__(self, d, max_age_seconds):
+        self.d = d
+        self.maxAge = max_age_seconds
+
+    def __contains__(self, ip):
+        entry = self.d.get(ip)
+        return entry is not None and entry[1] > time.time()
+
+    def __getitem__(self, ip):
+        entry = self.d.get(ip)
+        if entry is None or entry[1] <= time.time():
+            raise KeyError(ip)
+        return entry[0]
+
+    def __setitem__(self, ip, mac):
+        self.d[ip] = (bytes(mac), time.time() + self.maxAge)
+
+    def __iter__(self):
+        return iter(list(self.d.keys()))
 
 
 '''
@@ -56,6 +71,223 @@ def getIP(interface):
     return struct.unpack('!I',ip)[0]
 
 
+'''
+Clase que implementa el nivel ARP sobre un nivel Ethernet (eth, ver EthernetLevel en ethernet.py). Guarda la IP y la
+MAC propias, la cachae y las variables con las que ARPResolution espera las respuestas, que antes eran globales del
+modulo, para poder tener un nivel ARP por interfaz. Las peticiones y respuestas salen por el nivel Ethernet al que esta
+asociado. Las funciones del modulo trabajan sobre defaultARP, asociado a defaultLevel.
+Cada metodo hace lo mismo que la funcion del modulo del mismo nombre (ver su descripcion mas adelante).
+'''
+class ARPLevel():
+
+    def __init__(self, eth):
+        self.eth = eth
+        #Semaforo que protege requestedIP, resolvedMAC y awaitingResponse
+        self.globalLock = Lock()
+        #Variable que alamacenara que direccion IP se esta intentando resolver
+        self.requestedIP = None
+        #Variable que alamacenara que direccion MAC resuelta o None si no se ha podido obtener
+        self.resolvedMAC = None
+        #Variable que alamacenara True mientras estemos esperando una respuesta ARP
+        self.awaitingResponse = False
+        #Variable para proteger la cachae
+        self.cacheLock = Lock()
+        #Cachae de ARP. Es un diccionario similar al estandar de Python solo que eliminara las entradas a los 10 segundos
+        self.cache = ExpiringDict(max_len=100, max_age_seconds=10)
+        #True si la cachae se comparte con los procesos de captura del modo PACKET_FANOUT (ver shareState)
+        self.cacheShared = False
+        #IP (entero de 32 bits) y MAC propias
+        self.myIP = None
+        self.myMAC = None
+        self.arpInitialized = False
+
+    def shareState(self, manager):
+        with self.cacheLock:
+            shared = sharedCache(manager.dict(), 10)
+            for k in self.cache:
+                if k in self.cache:
+                    shared[k] = self.cache[k]
+            self.cache = shared
+            self.cacheShared = True
+
+    def printCache(self):
+        print('{:>12}\t\t{:>12}'.format('IP','MAC'))
+        with self.cacheLock:
+            for k in self.cache:
+                if k in self.cache:
+                    print ('{:>12}\t\t{:>12}'.format(socket.inet_ntoa(struct.pack('!I',k)),':'.join(['{:02X}'.format(b) for b in self.cache[k]])))
+
+    def processARPRequest(self, data, MAC):
+        # Del byte 0 al 5 es la direccion MAC de origen suponiendo que este sea el primer campo de la parte no comun
+        mac_origen = data[2:8]
+
+        if mac_origen != MAC:
+            return
+
+        # del byte 6 al 10 (10 no incluido) esta la ip origen
+        ip_origen = data[8:12]
+
+        # del byte 16 al 20 (20 no incluido) esta la ip destino
+        ip_destino = data[18:22]
+
+        myIPBien = struct.pack('!I', self.myIP)
+
+        # Comprobamos con la variable local
+        if ip_destino != myIPBien:
+            return
+        frame = self.createARPReply(ip_origen, mac_origen)
+
+        self.eth.sendFrame(frame, len(frame), bytes([0x08,0x06]), mac_origen)
+        return
+
+    def processARPReply(self, data, MAC):
+        # Del byte 0 al 5 es la direccion MAC de origen suponiendo que este sea el primer campo de la parte no comun
+        # (copia: la MAC se guarda en la cachae y data es una vista de la trama recibida)
+        mac_origen = bytes(data[2:8])
+
+        if mac_origen != MAC:
+            return
+
+        # del byte 16 al 20 (20 no incluido) esta la ip destino
+        ip_destino = data[18:22]
+
+        # la de origen en una arp reply es la que queriamos resolver
+        ip_origen = data[8:12]
+
+        myIPBien = struct.pack('!I', self.myIP)
+
+        if ip_destino != myIPBien:
+            logging.debug('Respuesta ARP para otra IP')
+            return
+
+        # En modo fanout la respuesta puede llegar a otro proceso distinto del que pregunto: se guarda siempre en la cachae compartida
+        if self.cacheShared:
+            with self.cacheLock:
+                self.cache[struct.unpack('!I', ip_origen)[0]] = mac_origen
+
+        requestedIP = self.requestedIP
+        # Respuesta no solicitada (o, en modo fanout, a una peticion de otro proceso): no hay nadie esperandola
+        if requestedIP is None or ip_origen != struct.pack('!I', requestedIP):
+            logging.debug('Respuesta ARP no solicitada')
+            return
+
+        # Protegemos con lock usando el bloque with
+        with self.globalLock:
+            self.resolvedMAC = mac_origen
+
+        # aniadimos el par ip/mac , son las de origen porque el arp reply tiene como origen las de destino del arp request
+        with self.cacheLock:
+            self.cache[requestedIP] = mac_origen
+        with self.globalLock:
+            self.awaitingResponse = False
+
+        return
+
+    def createARPRequest(self, ip):
+        frame = self.myMAC + bytes(struct.pack('!I', self.myIP)) + broadcastAddr + bytes(struct.pack('!I', ip))
+        return ARPHeader + bytes([0x00,0x01]) + frame
+
+    def createARPReply(self, IP, MAC):
+        frame = self.myMAC + bytes(struct.pack('!I', self.myIP)) + MAC + IP
+        return ARPHeader + bytes([0x00,0x02]) + frame
+
+    def process_arp_frame(self, us, header, data, srcMac):
+        # Vista de la trama (ver packet.py): la cabecera ARP se decodifica una sola vez
+        pkt = Packet.of(data)
+        pkt.l3 = pkt.off
+        comun = pkt[:6]
+        # comprobar que sea correcta
+        if comun != ARPHeader:
+            print ("La cabecera comun no es correcta")
+        opcode = pkt.arpOpcode
+
+        # si es una request
+        if (opcode == 0x0001):
+            self.processARPRequest(pkt[6:], srcMac)
+        # si es una reply
+        elif (opcode == 0x0002):
+            self.processARPReply(pkt[6:], srcMac)
+        else:
+            return
+
+    def init(self, interface):
+        # Registramos el callback de process_arp_frame con el Ethertypo 0806
+        self.eth.registerCallback(self.process_arp_frame, bytes([0x08,0x06]))
+        # La cachae se comparte con los procesos de captura si se arranca el modo PACKET_FANOUT
+        self.eth.registerSharedState(self.shareState)
+
+        # Obtenemos la mac y la ip asociadas con la interfaz (o las del enlace si el nivel Ethernet no usa una interfaz)
+        link = self.eth.link
+        if link is not None:
+            self.myIP = link.ip
+            self.myMAC = link.mac
+        else:
+            self.myIP = getIP(interface)
+            self.myMAC = getHwAddr(interface)
+
+        # Resolucion ARP gratuita (con nuestra propia IP). Si no se recibe None es que algo ha ido mal
+        prueba = self.ARPResolution(self.myIP)
+        if prueba is not None:
+            logging.debug('ERROR. El ARP ya estaba inicializado')
+            return False
+
+        # El nivel ARP esta inicializado
+        self.arpInitialized = True
+        return True
+
+    def ARPResolution(self, ip):
+        # Si esta en la cache, se devuelve la MAC y listo.
+        # Protegemos con semaforo
+        with self.cacheLock:
+            if ip in self.cache:
+                return self.cache[ip]
+
+        # En el caso de que no este en la cache enviamos un ARPRequest hasta 3 veces esperando conseguir una respuesta
+        with self.globalLock:
+            self.awaitingResponse = True
+            self.requestedIP = ip
+
+        data = self.createARPRequest(ip)
+
+        for i in range(3):
+            # En modo fanout la respuesta la procesa otro proceso y solo llega a la cachae compartida
+            if self.cacheShared and ip in self.cache:
+                return self.cache[ip]
+            # Si se sigue esperando respuesta reenviamos el Request
+            if self.awaitingResponse is True:
+                if self.eth.sendFrame(data, len(data), bytes([0x08,0x06]), broadcastAddr) != 0:
+                    # Si la peticion no ha salido (por ejemplo, procesando una traza sin nivel Ethernet) no se espera respuesta
+                    break
+
+                sleep(1)
+
+            # Si se ha recibido respuesta y es la MAC de la IP por la que preguntabamos
+            else:
+                return self.resolvedMAC
+
+        if self.cacheShared and ip in self.cache:
+            return self.cache[ip]
+        return None
+
+
+#Nivel ARP sobre el que trabajan las funciones del modulo (asociado al nivel Ethernet por defecto)
+defaultARP = ARPLevel(defaultLevel)
+
+
+'''
+Nombre: shareARPState
+Descripcion: Esta funcion se registra en el nivel Ethernet (registerSharedState) y sustituye la cachae ARP por una
+    sharedCache del gestor que recibe, de modo que las respuestas ARP que procesen los procesos de captura del modo
+    PACKET_FANOUT las vea tambien ARPResolution en el proceso principal.
+Argumentos:
+    -manager: multiprocessing.Manager creado por startFanout
+Retorno: Ninguno
+'''
+def shareARPState(manager):
+
+    defaultARP.shareState(manager)
+
+
 '''
 Nombre: printCache
 Descripcion: Esta funcion imprime la cachae ARP
@@ -64,11 +296,7 @@ Retorno: Ninguno
 '''
 def printCache():
 
-    print('{:>12}\t\t{:>12}'.format('IP','MAC'))
-    with cacheLock:
-        for k in cache:
-            if k in cache:
-                print ('{:>12}\t\t{:>12}'.format(socket.inet_ntoa(struct.pack('!I',k)),':'.join(['{:02X}'.format(b) for b in cache[k]])))
+    defaultARP.printCache()
 
 
 
@@ -92,32 +320,7 @@ Retorno: Ninguno
 '''
 def processARPRequest(data, MAC):
 
-    global myIP
-    # Del byte 0 al 5 es la direccion MAC de origen suponiendo que este sea el primer campo de la parte no comun
-    
-    mac_origen = data[2:8]
-
-    
-    if mac_origen != MAC:
-    	
-    	return
-
-    # del byte 6 al 10 (10 no incluido) esta la ip origen
-    ip_origen = data[8:12]
-
-    # del byte 16 al 20 (20 no incluido) esta la ip destino
-    ip_destino = data[18:22]
-
-    myIPBien = struct.pack('!I', myIP)
-
-    # Comprobamos con la variable local
-    if ip_destino != myIPBien:
-    	return
-    # TODO revisar que esta bien
-    frame = createARPReply(ip_origen, mac_origen)
-
-    sendEthernetFrame(frame, len(frame), bytes([0x08,0x06]), mac_origen)
-    return
+    defaultARP.processARPRequest(data, MAC)
 
 
 '''
@@ -144,48 +347,7 @@ Retorno: Ninguno
 '''
 def processARPReply(data,MAC):
 
-    global requestedIP,resolvedMAC,awaitingResponse,cache, myIP
-    # Del byte 0 al 5 es la direccion MAC de origen suponiendo que este sea el primer campo de la parte no comun
-    mac_origen = data[2:8]
-
-    
-    if mac_origen != MAC:
-        return
-
-    # del byte 6 al 10 (10 no incluido) esta la ip origen, la de origen en una arp reply es la que queriamos resolver
-
-    # extraemos la mac destino del bytearray (6 bytes sin contar el 26), la que envio la arp request
-    mac_destino = data[18:24]
-
-    
-
-
-    # del byte 16 al 20 (20 no incluido) esta la ip destino
-    ip_destino = data[18:22]
-
-    ip_origen = data[8:12]
-
-    myIPBien = struct.pack('!I', myIP)
-
-    if ip_destino != myIPBien:
-        print("ERROR1")
-        return
-
-    if ip_origen != struct.pack('!I', requestedIP):
-    	print("ERROR2")
-    	return
-
-    # Protegemos con lock usando el bloque with
-    with globalLock:
-        resolvedMAC = mac_origen
-
-    with cacheLock:
-        cache = {requestedIP: mac_origen}
-    # aniadimos el par ip/mac , son las de origen porque el arp reply tiene como origen las de destino del arp request
-    with globalLock:
-        awaitingResponse = False
-
-    return
+    defaultARP.processARPReply(data, MAC)
 
 '''
 Nombre: createARPRequest
@@ -196,15 +358,7 @@ Retorno: Bytes con el contenido de la trama de peticion ARP
 '''
 def createARPRequest(ip):
 
-    global myMAC,myIP
-
-    # falta la parte de la cabecera comun (type of hardware etc)
-    # no se si hay que enviarla a [0xFF]*6 o a [0x00]*6 porque es una request
-    frame = myMAC + bytes(struct.pack('!I', myIP)) + broadcastAddr + bytes(struct.pack('!I', ip))
-
-    frame = ARPHeader + bytes([0x00,0x01]) + frame
-
-    return frame
+    return defaultARP.createARPRequest(ip)
 
 
 '''
@@ -217,15 +371,7 @@ Retorno: Bytes con el contenido de la trama de peticion ARP
 '''
 def createARPReply(IP,MAC):
 
-    global myMAC,myIP
-
-    # falta la parte de la cabecera comun (type of hardware etc)
-    frame = myMAC + bytes(struct.pack('!I', myIP)) + MAC + IP
-    
-
-    frame = ARPHeader + bytes([0x00,0x02]) + frame
-    
-    return frame
+    return defaultARP.createARPReply(IP, MAC)
 
 
 '''
@@ -242,26 +388,13 @@ Esta funcion debe realizar, al menos, las siguientes tareas:
 Argumentos:
     -us: Datos de usuario pasados desde la llamada de pcap_loop. En nuestro caso sera None
     -header: cabecera pcap_pktheader
-    -data: array de bytes con el contenido de la trama ARP
+    -data: array de bytes (o vista Packet, ver packet.py) con el contenido de la trama ARP
     -srcMac: MAC origen de la trama Ethernet que se ha recibido
 Retorno: Ninguno
 '''
 def process_arp_frame(us,header,data,srcMac):
 
-	comun = data[:6]
-    # comprobar que sea correcta
-	if comun != ARPHeader:
-		print ("La cabecera comun no es correcta")
-	opcode = data[6:8]
-
-    # si es una request
-	if (opcode == bytes([0x00,0x01])):
-		processARPRequest(data[6:], srcMac)
-    # si es una reply
-	elif (opcode == bytes([0x00,0x02])):
-		processARPReply(data[6:], srcMac)
-	else:
-		return
+    defaultARP.process_arp_frame(us, header, data, srcMac)
 
 
 
@@ -275,24 +408,7 @@ Descripcion: Esta funcion construira inicializara el nivel ARP. Esta funcion deb
 '''
 def initARP(interface):
 
-    global myIP,myMAC,arpInitialized
-    
-    # Registramos el callback de process_arp_frame con el Ethertypo 0806
-    registerCallback(process_arp_frame, bytes([0x08,0x06]))
-
-    # Obtenemos la mac y la ip asociadas con la interfaz y las almacenamos en la variable global
-    myIP = getIP(interface)
-    myMAC = getHwAddr(interface)
-
-    # Resolucion ARP gratuita (con nuestra propia IP). Si no se recibe None es que algo ha ido mal
-    prueba = ARPResolution(myIP)
-    if prueba is not None:
-    	logging.debug('ERROR. El ARP ya estaba inicializado')
-    	return False
-
-    # El nivel ARP esta inicializado
-    arpInitialized = True
-    return True
+    return defaultARP.init(interface)
 
 '''
 Nombre: ARPResolution
@@ -314,37 +430,4 @@ Como estas variables globales se leen y escriben concurrentemente deben ser prot
 '''
 def ARPResolution(ip):
 
-    global requestedIP,awaitingResponse,resolvedMAC
-    
-
-    # Si esta en la cache, se devuelve la MAC y listo.
-    # Protegemos con semaforo
-    with cacheLock:
-    	if ip in cache:
-    		return cache[ip]
-
-    # En el caso de que no este en la cache enviamos un ARPRequest hasta 3 veces esperando conseguir una respuesta
-    # Primero construimos el ARPRequest
-
-    # Le damos valor a las variables globales
-    with globalLock:
-        awaitingResponse = True
-        requestedIP = ip
-
-    data = createARPRequest(ip)
-    
-    for i in range(3):
-    	# Si se sigue esperando respuesta reenviamos el Request
-        if awaitingResponse is True:
-    		# print("bytearray: "+str(bytes([0x08,0x06])))
-            sendEthernetFrame(data, len(data), bytes([0x08,0x06]), broadcastAddr)
-
-            sleep(1)
-    		# print("La requestedIP es: "+str(requestedIP))
-    		# print("lo que he enciado es:"+str(data))
-
-    	# Si se ha recibido respuesta y es la MAC de la IP por la que preguntabamos
-        else:
-            return resolvedMAC
-    
-    return None
+    return defaultARP.ARPResolution(ip)
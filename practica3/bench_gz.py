@@ -0,0 +1,79 @@
+'''
+    bench_gz.py
+    Compara la lectura de una traza plana con la lectura de la misma traza comprimida con gzip y con xz.
+    A partir del fichero pcap indicado se generan las copias .pcap.gz y .pcap.xz con PcapWriter y se recorren:
+        -plana con PcapReader (mmap) y con PcapStreamReader
+        -comprimidas con PcapStreamReader, con y sin hilo lector (con hilo la descompresion se solapa con el proceso)
+    Por cada trama se calcula un CRC32 para simular el procesado de los paquetes.
+    Para cada modo muestra el tamaño del fichero, paquetes por segundo y MB/s de datos sin comprimir.
+    No necesita permisos ni abrir ninguna interfaz.
+'''
+
+from rc1_pcap import *
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+import zlib
+
+def replay(reader):
+    start = time.perf_counter()
+    packets = 0
+    nbytes = 0
+    crc = 0
+    for tv_sec, tv_frac, caplen, length, data in reader:
+        crc = zlib.crc32(data, crc)
+        packets += 1
+        nbytes += caplen
+    elapsed = time.perf_counter() - start
+    reader.close()
+    return packets / elapsed, nbytes / elapsed / 1e6
+
+def compress(src, dst):
+    start = time.perf_counter()
+    with PcapReader(src) as reader:
+        # tv_frac se copia tal cual: la copia tiene que tener la misma resolucion que el original
+        fmt = PCAP_FORMAT_NSEC if reader.tsresol != 1000000 else PCAP_FORMAT_USEC
+        writer = PcapWriter(dst, reader.linktype, max(reader.snaplen, 65535), fmt, threaded=True)
+        for tv_sec, tv_frac, caplen, length, data in reader:
+            writer.write(tv_sec, tv_frac, data, length)
+        writer.close()
+    return time.perf_counter() - start
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark de la lectura de trazas planas frente a trazas comprimidas (gzip, xz)')
+    parser.add_argument('--file', dest='tracefile', default=False, help='Fichero pcap (sin comprimir) a usar')
+    parser.add_argument('--repeat', dest='repeat', type=int, default=3, help='Número de veces que se recorre cada fichero (se muestra la mejor)')
+    parser.add_argument('--debug', dest='debug', default=False, action='store_true', help='Activar Debug messages')
+    args = parser.parse_args()
+
+    if args.debug:
+        logging.basicConfig(level = logging.DEBUG, format = '[%(asctime)s %(levelname)s]\t%(message)s')
+    else:
+        logging.basicConfig(level = logging.INFO, format = '[%(asctime)s %(levelname)s]\t%(message)s')
+
+    if args.tracefile is False:
+        logging.error('Hay que especificar un fichero pcap')
+        parser.print_help()
+        sys.exit(-1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        gz = os.path.join(tmp, 'traza.pcap' + PCAP_GZIP_SUFFIX)
+        xz = os.path.join(tmp, 'traza.pcap' + PCAP_XZ_SUFFIX)
+        for dst in (gz, xz):
+            logging.info('Generado {} en {:.2f} s'.format(os.path.basename(dst), compress(args.tracefile, dst)))
+
+        modes = (
+            ('plana mmap', args.tracefile, lambda: PcapReader(args.tracefile)),
+            ('plana', args.tracefile, lambda: PcapStreamReader(args.tracefile)),
+            ('gzip sin hilo', gz, lambda: PcapStreamReader(gz, threaded=False)),
+            ('gzip con hilo', gz, lambda: PcapStreamReader(gz)),
+            ('xz sin hilo', xz, lambda: PcapStreamReader(xz, threaded=False)),
+            ('xz con hilo', xz, lambda: PcapStreamReader(xz)),
+        )
+        print('{:>16}\t{:>12}\t{:>12}\t{:>10}'.format('Modo', 'Tamaño (MB)', 'Paquetes/s', 'MB/s'))
+        for mode, fname, open_reader in modes:
+            pps, mbps = max(replay(open_reader()) for i in range(args.repeat))
+            print('{:>16}\t{:>12.2f}\t{:>12.1f}\t{:>10.2f}'.format(mode, os.path.getsize(fname) / 1e6, pps, mbps))
@@ -0,0 +1,160 @@
+'''
+    bench_link.py
+    Conecta dos pilas completas (EthernetLevel + IPLevel, con ARP, ICMP y UDP) a un segmento en memoria (memorySwitch,
+    ver memlink.py) y mide el camino de extremo a extremo:
+        -ping: la pila A envia --count ECHO_REQUEST a la pila B, que responde con el manejador de icmp.py. Se muestran
+         las respuestas recibidas y el RTT (minimo, medio y maximo)
+        -UDP: la pila A envia --udp datagramas de --size bytes a la pila B. Si no caben en la MTU salen fragmentados;
+         la pila B solo procesa el primer fragmento de cada datagrama, asi que se cuentan los datagramas recibidos y
+         las tramas IP que han llegado
+    La perdida, el retardo, el jitter y la MTU del segmento se configuran por parametros y con --seed la secuencia de
+    perdidas y retardos se repite, para poder comparar medidas.
+    No necesita permisos ni abrir ninguna interfaz.
+'''
+
+from ethernet import EthernetLevel, formatEthernetStats
+from ip import IPLevel
+from memlink import memorySwitch, ipAddr
+from packet import Packet
+import icmp
+import udp
+import argparse
+import logging
+import sys
+import threading
+import time
+
+#Direcciones de las dos pilas
+STACK_A = ('linkA', '02:00:00:00:00:0a', '10.0.0.1')
+STACK_B = ('linkB', '02:00:00:00:00:0b', '10.0.0.2')
+NETMASK = '255.255.255.0'
+#Ethertype de IP en las estadisticas del nivel Ethernet
+ETHERTYPE_IP = 0x0800
+#Puerto destino de los datagramas UDP
+BENCH_PORT = 9999
+
+def startStack(switch, name, mac, ip, mtu):
+    link = switch.attach(name, mac, ip, NETMASK, mtu=mtu)
+    eth = EthernetLevel()
+    if eth.start(None, backend=link) != 0:
+        return None
+    return link, eth, IPLevel(eth)
+
+def stopStack(stack):
+    link, eth, ipLevel = stack
+    eth.stop()
+    link.close()
+
+'''
+Clase que recoge lo que recibe cada pila: los ECHO_REPLY (en A, por numero de secuencia) y los datagramas UDP (en B).
+Sus metodos se registran como protocolos del nivel IP en lugar de los manejadores de icmp.py y udp.py.
+'''
+class benchCounters():
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.replies = {}
+        self.datagrams = 0
+
+    def process_echo_reply(self, us, header, data, srcIp):
+        now = time.perf_counter()
+        pkt = Packet.of(data)
+        pkt.l4 = pkt.off
+        if pkt.icmpType == icmp.ICMP_ECHO_REPLY_TYPE:
+            with self.lock:
+                self.replies.setdefault(pkt.icmpSeq, now)
+
+    def process_datagram(self, us, header, data, srcIp):
+        pkt = Packet.of(data)
+        pkt.l4 = pkt.off
+        if pkt.udpDstPort == BENCH_PORT:
+            with self.lock:
+                self.datagrams += 1
+
+def runPing(ipA, dstIP, counters, count, interval, timeout):
+    # Devuelve la lista de RTT (segundos) de las respuestas recibidas
+    sent = {}
+    for seq in range(count):
+        sent[seq] = time.perf_counter()
+        icmp.sendICMPMessage(b'bench_link', icmp.ICMP_ECHO_REQUEST_TYPE, 0, 1, seq, dstIP, ipA)
+        time.sleep(interval)
+    deadline = time.perf_counter() + timeout
+    while len(counters.replies) < count and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    with counters.lock:
+        return [counters.replies[seq] - sent[seq] for seq in sent if seq in counters.replies]
+
+def runUDP(ipA, dstIP, counters, count, size, timeout):
+    data = bytes(size)
+    start = time.perf_counter()
+    for i in range(count):
+        udp.sendUDPDatagram(data, BENCH_PORT, dstIP, ipA)
+    elapsed = time.perf_counter() - start
+    deadline = time.perf_counter() + timeout
+    while counters.datagrams < count and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    return elapsed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Ping y UDP entre dos pilas conectadas por un segmento en memoria')
+    parser.add_argument('--count', dest='count', type=int, default=20, help='Número de ECHO_REQUEST a enviar')
+    parser.add_argument('--interval', dest='interval', type=float, default=0.01, help='Segundos entre ECHO_REQUEST')
+    parser.add_argument('--udp', dest='udp', type=int, default=100, help='Número de datagramas UDP a enviar')
+    parser.add_argument('--size', dest='size', type=int, default=3000, help='Bytes de datos de cada datagrama UDP')
+    parser.add_argument('--loss', dest='loss', type=float, default=0.0, help='Probabilidad (0 a 1) de perder cada trama')
+    parser.add_argument('--delay', dest='delay', type=float, default=0.001, help='Retardo de cada trama en segundos')
+    parser.add_argument('--jitter', dest='jitter', type=float, default=0.0, help='Segundos máximos que se suman al retardo')
+    parser.add_argument('--mtu', dest='mtu', type=int, default=1500, help='MTU de los dos puertos')
+    parser.add_argument('--seed', dest='seed', type=int, default=None, help='Semilla de pérdidas y retardos')
+    parser.add_argument('--timeout', dest='timeout', type=float, default=2.0, help='Segundos que se esperan las últimas respuestas')
+    parser.add_argument('--debug', dest='debug', default=False, action='store_true', help='Activar Debug messages')
+    args = parser.parse_args()
+
+    if args.debug:
+        logging.basicConfig(level = logging.DEBUG, format = '[%(asctime)s %(levelname)s]\t%(message)s')
+    else:
+        logging.basicConfig(level = logging.INFO, format = '[%(asctime)s %(levelname)s]\t%(message)s')
+
+    switch = memorySwitch(args.loss, args.delay, args.jitter, args.seed)
+    stackA = startStack(switch, *STACK_A, args.mtu)
+    stackB = startStack(switch, *STACK_B, args.mtu)
+    if stackA is None or stackB is None:
+        logging.error('Iniciando el nivel Ethernet sobre el segmento')
+        sys.exit(-1)
+    ipA = stackA[2]
+    ipB = stackB[2]
+    counters = benchCounters()
+    ipA.registerIPProtocol(counters.process_echo_reply, icmp.ICMP_PROTO)
+    icmp.initICMP(ipB)
+    ipB.registerIPProtocol(counters.process_datagram, udp.UDP_PROTO)
+
+    # Cada init hace una resolucion ARP gratuita (tres intentos de un segundo): las dos a la vez
+    begin = time.perf_counter()
+    threads = [threading.Thread(target=ipLevel.init, args=(None,)) for ipLevel in (ipA, ipB)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    logging.info('Pilas iniciadas en {:.1f} s'.format(time.perf_counter() - begin))
+
+    dstIP = ipAddr(STACK_B[2])
+    # Las resoluciones ARP (en los dos sentidos: B tambien resuelve A para responder) quedan fuera de las medidas
+    ipA.arp.ARPResolution(dstIP)
+    ipB.arp.ARPResolution(ipAddr(STACK_A[2]))
+
+    try:
+        rtts = runPing(ipA, dstIP, counters, args.count, args.interval, args.timeout)
+        print('Ping: {} enviados, {} respuestas'.format(args.count, len(rtts)))
+        if rtts:
+            print('RTT (ms): min {:.3f} media {:.3f} max {:.3f}'.format(min(rtts) * 1e3, sum(rtts) / len(rtts) * 1e3, max(rtts) * 1e3))
+
+        received = stackB[1].getStats()['ethertypes'].get(ETHERTYPE_IP, 0)
+        elapsed = runUDP(ipA, dstIP, counters, args.udp, args.size, args.timeout)
+        frames = stackB[1].getStats()['ethertypes'].get(ETHERTYPE_IP, 0) - received
+        print('UDP: {} datagramas de {} bytes enviados en {:.3f} s, {} recibidos, {} tramas IP recibidas (MTU {})'
+              .format(args.udp, args.size, elapsed, counters.datagrams, frames, args.mtu))
+        for name, stack in ((STACK_A[0], stackA), (STACK_B[0], stackB)):
+            print(name + ' ' + formatEthernetStats(stack[1].getStats()))
+    finally:
+        stopStack(stackA)
+        stopStack(stackB)
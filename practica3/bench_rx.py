@@ -0,0 +1,103 @@
+'''
+    bench_rx.py
+    Mide el coste de la recepción: pasa por process_Ethernet_frame (y por debajo ARP, IP, ICMP y UDP) las tramas
+    de una traza pcap, igual que las entrega el hilo de captura (una copia por trama en bytes).
+    Muestra:
+        -Memoria extra por trama: memoria reservada a la vez durante el procesado de una trama (media y máxima),
+         agrupada por longitud de trama. Si algún nivel copia la trama crece con la longitud; con el camino de
+         memoryview solo quedan los objetos pequeños (vistas, enteros) y es la misma para todas las longitudes
+        -Tramas por segundo (sin tracemalloc)
+    No necesita permisos ni abrir ninguna interfaz: la pila se inicia como en offline.py y las respuestas que generen
+    los manejadores no se envían.
+'''
+
+from offline import *
+import argparse
+import collections
+import logging
+import socket
+import struct
+import sys
+import time
+import tracemalloc
+
+#Limites superiores de los grupos de longitud de trama
+SIZE_GROUPS = (128, 512, 1024, ETH_FRAME_MAX)
+
+def loadFrames(fname, limit):
+    frames = []
+    with PcapReader(fname) as reader:
+        for tv_sec, tv_frac, caplen, length, data in reader:
+            header = pcap_pkthdr()
+            header.len = length
+            header.caplen = caplen
+            header.ts = timeval(tv_sec, tv_frac if reader.tsresol == 1000000 else tv_frac // 1000)
+            frames.append((header, bytes(data)))
+            if limit > 0 and len(frames) >= limit:
+                break
+    return frames
+
+def measureMemory(frames):
+    # Devuelve {limite del grupo: [tramas, memoria extra total, memoria extra maxima]}
+    groups = {}
+    tracemalloc.start()
+    for header, frame in frames:
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        process_Ethernet_frame(None, header, frame)
+        extra = tracemalloc.get_traced_memory()[1] - base
+        group = groups.setdefault(next((g for g in SIZE_GROUPS if len(frame) <= g), len(frame)), [0, 0, 0])
+        group[0] += 1
+        group[1] += extra
+        group[2] = max(group[2], extra)
+    tracemalloc.stop()
+    return groups
+
+def measureRate(frames, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        for header, frame in frames:
+            process_Ethernet_frame(None, header, frame)
+    return len(frames) * repeat / (time.perf_counter() - start)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark de memoria y ritmo del camino de recepción (process_Ethernet_frame)')
+    parser.add_argument('--file', dest='tracefile', default=False, help='Fichero pcap con las tramas a procesar')
+    parser.add_argument('--mac', dest='mac', default=None, help='Dirección MAC propia (por defecto la MAC destino más frecuente de la traza)')
+    parser.add_argument('--ip', dest='ip', default='0.0.0.0', help='Dirección IP propia')
+    parser.add_argument('--count', dest='count', type=int, default=0, help='Número máximo de tramas a cargar (0 => todas)')
+    parser.add_argument('--repeat', dest='repeat', type=int, default=10, help='Número de veces que se procesan las tramas al medir el ritmo')
+    parser.add_argument('--debug', dest='debug', default=False, action='store_true', help='Activar Debug messages')
+    args = parser.parse_args()
+
+    if args.debug:
+        logging.basicConfig(level = logging.DEBUG, format = '[%(asctime)s %(levelname)s]\t%(message)s')
+    else:
+        logging.basicConfig(level = logging.INFO, format = '[%(asctime)s %(levelname)s]\t%(message)s')
+
+    if args.tracefile is False:
+        logging.error('Hay que especificar un fichero pcap')
+        parser.print_help()
+        sys.exit(-1)
+
+    frames = [(h, f) for h, f in loadFrames(args.tracefile, args.count) if len(f) >= ETH_HLEN]
+    if not frames:
+        logging.error('La traza no tiene tramas Ethernet')
+        sys.exit(-1)
+    if args.mac is not None:
+        mac = bytes.fromhex(args.mac.replace(':', ''))
+    else:
+        mac = collections.Counter(f[:6] for h, f in frames if f[:6] != broadcastAddr).most_common(1)
+        mac = mac[0][0] if mac else broadcastAddr
+    initOfflineStack(mac, struct.unpack('!I', socket.inet_aton(args.ip))[0], 0xFFFFFF00)
+
+    # Una pasada previa para que las cachés y los objetos de los módulos no cuenten en las medidas
+    measureRate(frames, 1)
+    groups = measureMemory(frames)
+    rate = measureRate(frames, args.repeat)
+    print('{} tramas, MAC propia {}'.format(len(frames), ':'.join('{:02X}'.format(b) for b in mac)))
+    print('{:>12}\t{:>8}\t{:>16}\t{:>16}'.format('Longitud', 'Tramas', 'Extra media (B)', 'Extra máx. (B)'))
+    for limit in sorted(groups):
+        n, total, worst = groups[limit]
+        print('{:>12}\t{:>8}\t{:>16.0f}\t{:>16}'.format('<= ' + str(limit), n, total / n, worst))
+    print('Tramas por segundo: {:.1f}'.format(rate))
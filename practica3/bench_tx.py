@@ -0,0 +1,77 @@
+'''
+    bench_tx.py
+    Compara el envío de datagramas UDP grandes por el camino clásico (cada nivel concatena su cabecera
+    al payload) y por el camino scatter-gather (cada nivel aporta su cabecera y el payload baja como
+    memoryview hasta un único sendmsg por trama).
+    Para cada modo muestra:
+        -Copias del payload: memoria extra máxima durante el envío de un datagrama dividida entre el tamaño del payload
+        -Datagramas por segundo y MB/s enviados
+    Necesita permisos para abrir la interfaz (igual que practica3.py).
+'''
+
+from udp import *
+import ethernet
+import argparse
+import logging
+import socket
+import struct
+import sys
+import time
+import tracemalloc
+
+DST_PORT = 9
+COPY_SAMPLES = 20
+
+def measureCopies(payload, dstIP, samples):
+    tracemalloc.start()
+    worst = 0
+    for i in range(samples):
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        sendUDPDatagram(payload, DST_PORT, dstIP)
+        worst = max(worst, tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+    return worst / len(payload)
+
+def measureRate(payload, dstIP, count):
+    start = time.perf_counter()
+    for i in range(count):
+        sendUDPDatagram(payload, DST_PORT, dstIP)
+    elapsed = time.perf_counter() - start
+    return count / elapsed, count * len(payload) / elapsed / 1e6
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark del envío concatenando cabeceras frente a scatter-gather con sendmsg')
+    parser.add_argument('--itf', dest='interface', default=False, help='Interfaz a abrir')
+    parser.add_argument('--dstIP', dest='dstIP', default=False, help='Dirección IP destino')
+    parser.add_argument('--size', dest='size', type=int, default=65000, help='Tamaño del payload UDP en bytes')
+    parser.add_argument('--count', dest='count', type=int, default=200, help='Número de datagramas a enviar por modo')
+    parser.add_argument('--debug', dest='debug', default=False, action='store_true', help='Activar Debug messages')
+    args = parser.parse_args()
+
+    if args.debug:
+        logging.basicConfig(level = logging.DEBUG, format = '[%(asctime)s %(levelname)s]\t%(message)s')
+    else:
+        logging.basicConfig(level = logging.INFO, format = '[%(asctime)s %(levelname)s]\t%(message)s')
+
+    if args.interface is False or args.dstIP is False:
+        logging.error('Hay que especificar interfaz y dirección IP destino')
+        parser.print_help()
+        sys.exit(-1)
+
+    dstIP = struct.unpack('!I', socket.inet_aton(args.dstIP))[0]
+    payload = bytes(args.size)
+
+    print('{:>16}\t{:>16}\t{:>12}\t{:>10}'.format('Modo', 'Copias payload', 'Datagramas/s', 'MB/s'))
+    for mode, scatter in (('concatenando', False), ('scatter-gather', True)):
+        if ethernet.startEthernetLevel(args.interface, scatterGather=scatter) != 0:
+            logging.error('No se ha podido iniciar el nivel Ethernet')
+            sys.exit(-1)
+        initUDP()
+        if initIP(args.interface) == False:
+            logging.error('Inicializando nivel IP')
+            sys.exit(-1)
+        copies = measureCopies(payload, dstIP, COPY_SAMPLES)
+        dps, mbps = measureRate(payload, dstIP, args.count)
+        print('{:>16}\t{:>16.2f}\t{:>12.1f}\t{:>10.2f}'.format(mode, copies, dps, mbps))
+        ethernet.stopEthernetLevel()
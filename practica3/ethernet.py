@@ -6,12 +6,19 @@
 '''
 
 from rc1_pcap import *
+from tpacket import packetRing
+from packet import Packet, ETHERTYPE, VLAN_TPIDS
 import logging
 import socket
 import struct
 from binascii import hexlify
 import struct
 import threading
+import queue
+import ctypes
+import os
+import multiprocessing
+import time
 
 #Tamanno maximo de una trama Ethernet (para las practicas)
 ETH_FRAME_MAX = 1514
@@ -22,8 +29,27 @@ NO_PROMISC = 0
 TO_MS = 10
 #Direccion de difusion (Broadcast)
 broadcastAddr = bytes([0xFF]*6)
-#Diccionario que alamacena para un Ethertype dado que funcion de callback se debe ejecutar
-upperProtos = {}
+#Numero de hilos del motor de despacho de tramas por defecto (0 => un hilo nuevo por trama)
+DISPATCH_WORKERS = 4
+#Tamanno por defecto de la cola de cada hilo del motor de despacho
+DISPATCH_QUEUE_SIZE = 1024
+#Politicas cuando la cola de un hilo esta llena: descartar la trama o bloquear la captura (como mucho DISPATCH_BLOCK_TIMEOUT segundos)
+DISPATCH_DROP = 'drop'
+DISPATCH_BLOCK = 'block'
+DISPATCH_BLOCK_TIMEOUT = 1
+#Segundos que espera startFanout a que cada proceso de captura abra su anillo TPACKET_V3
+FANOUT_START_TIMEOUT = 5
+#Cada cuantos segundos publica cada proceso de captura sus estadisticas para el proceso principal
+FANOUT_STATS_INTERVAL = 1
+#Ethertype ARP. Estas tramas no pasan por las colas (ver process_frame)
+ETHERTYPE_ARP = 0x0806
+#Longitud de la cabecera Ethernet (MAC destino, MAC origen y Ethertype)
+ETH_HLEN = 14
+#Ceros para rellenar las tramas cortas sin reservar memoria
+ZERO_PAD = memoryview(bytes(ETH_FRAME_MIN))
+#Backends de captura: pcap_loop sobre libpcap o anillo TPACKET_V3 (ver tpacket.py)
+BACKEND_PCAP = 'pcap'
+BACKEND_TPACKET = 'tpacket'
 
 
 '''
@@ -41,11 +67,925 @@ def getHwAddr(interface):
     s.close()
     return mac
 
+'''
+Clase que implementa los contadores del nivel Ethernet. process_Ethernet_frame cuenta las tramas que le llegan, las que
+descarta por no ir dirigidas a nosotros (MAC) o por no tener un Ethertype registrado y las recibidas por Ethertype.
+Los contadores de descartes del kernel y de la interfaz se leen en el momento con pcap_stats (o del anillo TPACKET_V3).
+En modo PACKET_FANOUT se suman las estadisticas que publica cada proceso de captura (ver publishStats).
+'''
+class ethernetStats():
+
+    def __init__(self, level):
+        self.level = level
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.received = 0
+            self.filteredMac = 0
+            self.filteredEthertype = 0
+            self.ethertypes = {}
+            self.vlans = {}
+
+    def count(self, ethertype, result, vlan=None):
+        # result: None si la trama se entrega, 'mac' o 'ethertype' si se descarta por ese motivo
+        with self.lock:
+            self.received += 1
+            if result == 'mac':
+                self.filteredMac += 1
+                return
+            self.ethertypes[ethertype] = self.ethertypes.get(ethertype, 0) + 1
+            if vlan is not None:
+                self.vlans[vlan] = self.vlans.get(vlan, 0) + 1
+            if result == 'ethertype':
+                self.filteredEthertype += 1
+
+    def snapshot(self):
+        with self.lock:
+            snap = {'received': self.received, 'filteredMac': self.filteredMac, 'filteredEthertype': self.filteredEthertype,
+                    'ethertypes': dict(self.ethertypes), 'vlans': dict(self.vlans)}
+        snap['kernelReceived'] = 0
+        snap['kernelDropped'] = 0
+        snap['ifDropped'] = 0
+        level = self.level
+        if level.ring is not None:
+            snap['kernelReceived'], snap['kernelDropped'] = level.ring.stats()
+        elif level.link is not None:
+            snap['kernelReceived'], snap['kernelDropped'] = level.link.stats()
+        elif level.handle is not None:
+            ps = pcap_stat()
+            if pcap_stats(level.handle, ps) == 0:
+                snap['kernelReceived'] = ps.ps_recv
+                snap['kernelDropped'] = ps.ps_drop
+                snap['ifDropped'] = ps.ps_ifdrop
+        snap['queueDropped'] = dict(level.dispatcher.dropped) if level.dispatcher is not None else {}
+        shared = level.fanoutStats
+        if shared is not None:
+            try:
+                workers = list(shared.values())
+            except (OSError, EOFError):
+                # El gestor ya se ha cerrado (stop)
+                workers = []
+            for other in workers:
+                self.merge(snap, other)
+        return snap
+
+    def merge(self, snap, other):
+        for k, v in other.items():
+            if isinstance(v, dict):
+                counts = snap.setdefault(k, {})
+                for key, n in v.items():
+                    counts[key] = counts.get(key, 0) + n
+            else:
+                snap[k] = snap.get(k, 0) + v
+
+'''
+Clase que implementa el hilo que escribe con logging.info las estadisticas del nivel Ethernet cada interval segundos.
+'''
+class statsLogger(threading.Thread):
+
+    def __init__(self, interval, level):
+        threading.Thread.__init__(self)
+        self.interval = interval
+        self.level = level
+        self.stopEvent = threading.Event()
+
+    def run(self):
+        while not self.stopEvent.wait(self.interval):
+            snap = formatEthernetStats(self.level.getStats())
+            # Con varias interfaces cada linea indica de cual es
+            if self.level.interface is not None:
+                snap = self.level.interface + ' ' + snap
+            logging.info(snap)
+
+    def stop(self):
+        self.stopEvent.set()
+
+
+'''
+Clase que implementa el motor de despacho de tramas. En lugar de crear un hilo por trama se arranca un numero fijo
+de hilos, cada uno con su propia cola acotada. Todas las tramas de una misma MAC origen van a la misma cola, de modo
+que se procesan en el orden en el que llegaron. Si una cola esta llena se aplica la politica configurada:
+    -DISPATCH_DROP: la trama se descarta
+    -DISPATCH_BLOCK: el hilo de captura espera a que haya hueco (como mucho DISPATCH_BLOCK_TIMEOUT segundos) y si no lo hay se descarta
+Los descartes se cuentan en el diccionario dropped por politica.
+Cada hilo entrega las tramas a process (el process_Ethernet_frame del nivel que lo ha creado).
+'''
+class dispatchEngine():
+
+    def __init__(self, workers=DISPATCH_WORKERS, queueSize=DISPATCH_QUEUE_SIZE, policy=DISPATCH_DROP, process=None):
+        if policy not in (DISPATCH_DROP, DISPATCH_BLOCK):
+            raise ValueError('Politica de despacho desconocida: ' + str(policy))
+        self.policy = policy
+        self.process = process if process is not None else process_Ethernet_frame
+        self.queues = [queue.Queue(maxsize=queueSize) for i in range(workers)]
+        self.threads = []
+        self.dropped = {DISPATCH_DROP: 0, DISPATCH_BLOCK: 0}
+        self.queued = 0
+        self.bypassed = 0
+        self.statsLock = threading.Lock()
+
+    def start(self):
+        for q in self.queues:
+            t = threading.Thread(target=self.worker, args=(q,))
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def worker(self, q):
+        process = self.process
+        while True:
+            item = q.get()
+            if item is None:
+                return
+            try:
+                process(*item)
+            except Exception:
+                logging.exception('Error procesando trama')
+
+    def submit(self, us, header, data):
+        # Las tramas ARP se procesan en el propio hilo de captura: un hilo que este esperando en ARPResolution
+        # una respuesta de la misma MAC origen no podria procesarla nunca si esta pasase por su cola
+        ethertype = ETHERTYPE.unpack_from(data, 12)[0]
+        if ethertype in VLAN_TPIDS:
+            ethertype = Packet(data).ethertype
+        if ethertype == ETHERTYPE_ARP:
+            with self.statsLock:
+                self.bypassed += 1
+            self.process(us, header, data)
+            return
+        q = self.queues[int.from_bytes(data[6:12], 'big') % len(self.queues)]
+        try:
+            if self.policy == DISPATCH_BLOCK:
+                q.put((us, header, data), timeout=DISPATCH_BLOCK_TIMEOUT)
+            else:
+                q.put_nowait((us, header, data))
+        except queue.Full:
+            with self.statsLock:
+                self.dropped[self.policy] += 1
+            return
+        with self.statsLock:
+            self.queued += 1
+
+    def stop(self):
+        for q in self.queues:
+            q.put(None)
+        for t in self.threads:
+            t.join(DISPATCH_BLOCK_TIMEOUT)
+        self.threads = []
+
+'''
+Clase que implementa el motor de transmision del nivel Ethernet. Usa siempre el handle de pcap abierto en
+startEthernetLevel y cada hilo que envia tiene su propio buffer de ETH_FRAME_MAX bytes con la MAC origen ya escrita:
+por cada trama solo se escriben en su sitio la MAC destino y el Ethertype, se copia el payload una vez y, si la trama
+es corta, se rellena con ceros sin crear objetos nuevos.
+Sin handle (backend TPACKET_V3) las tramas se envian por el socket AF_PACKET enlazado a la interfaz (sock).
+Si se activa scatter tambien puede enviar tramas en modo scatter-gather por ese socket (sendv): la cabecera Ethernet, las cabeceras de los niveles superiores y el payload se pasan al kernel como una lista
+de buffers en una unica llamada a sendmsg, sin juntarlos antes en memoria.
+Las rafagas de tramas (sendBatch) se construyen en un buffer por hilo y se envian con sendmmsg sobre el socket de pcap
+(fd), es decir, con una llamada al sistema para toda la rafaga.
+'''
+class txEngine():
+
+    def __init__(self, handle, mac, sock=None, fd=None, scatter=False):
+        self.handle = handle
+        self.mac = mac
+        self.sock = sock
+        self.scatter = scatter
+        # Descriptor sobre el que se hace sendmmsg en sendBatch (None => bucle de pcap_inject)
+        self.fd = fd
+        self.local = threading.local()
+
+    def frameBuffer(self):
+        frame = getattr(self.local, 'frame', None)
+        if frame is None:
+            frame = bytearray(ETH_FRAME_MAX)
+            frame[6:12] = self.mac
+            self.local.frame = frame
+            # Array de ctypes sobre el mismo buffer para pasarlo a pcap_inject sin copiarlo
+            self.local.cframe = (ctypes.c_char * ETH_FRAME_MAX).from_buffer(frame)
+        return frame
+
+    def send(self, data, length, etherType, dstMac):
+        # Primero comprobar que la trama no va a ser de longitud mayor que la permitida
+        if length + ETH_HLEN > ETH_FRAME_MAX:
+            logging.debug('Se ha intentado crear una trama ethernet con longitud mayor de lo permitido: '+str(length + ETH_HLEN)+".\nSiendo lo maximo: "+str(ETH_FRAME_MAX))
+            return -1
+        frame = self.frameBuffer()
+        frame[0:6] = dstMac
+        frame[12:14] = etherType
+        end = ETH_HLEN + length
+        frame[ETH_HLEN:end] = data
+        # Si la trama es demasiado corta la relleno con ceros
+        if end < ETH_FRAME_MIN:
+            frame[end:ETH_FRAME_MIN] = ZERO_PAD[:ETH_FRAME_MIN - end]
+            end = ETH_FRAME_MIN
+        if self.handle is None:
+            try:
+                self.sock.send(memoryview(frame)[:end])
+            except OSError as e:
+                logging.error('Error enviando trama Ethernet: ' + str(e))
+                return -1
+            return 0
+        # Por ultimo, llamo a pcap inject
+        if pcap_inject(self.handle, self.local.cframe, end) == -1:
+            logging.error('Error enviando trama Ethernet: ' + pcap_geterr(self.handle))
+            return -1
+        return 0
+
+    def sendv(self, buffers, length, etherType, dstMac):
+        if length + ETH_HLEN > ETH_FRAME_MAX:
+            logging.debug('Se ha intentado crear una trama ethernet con longitud mayor de lo permitido: '+str(length + ETH_HLEN)+".\nSiendo lo maximo: "+str(ETH_FRAME_MAX))
+            return -1
+        header = getattr(self.local, 'header', None)
+        if header is None:
+            header = bytearray(ETH_HLEN)
+            header[6:12] = self.mac
+            self.local.header = header
+        header[0:6] = dstMac
+        header[12:14] = etherType
+        iov = [header]
+        iov.extend(buffers)
+        # Si la trama es demasiado corta el relleno es un buffer mas
+        if length + ETH_HLEN < ETH_FRAME_MIN:
+            iov.append(ZERO_PAD[:ETH_FRAME_MIN - ETH_HLEN - length])
+        try:
+            self.sock.sendmsg(iov)
+        except OSError as e:
+            logging.error('Error enviando trama Ethernet: ' + str(e))
+            return -1
+        return 0
+
+    def sendBatch(self, frames):
+        n = len(frames)
+        st = [0] * n
+        # Buffer de la rafaga: una trama de ETH_FRAME_MAX bytes por mensaje, reservado por hilo y reutilizado
+        batch = getattr(self.local, 'batch', None)
+        if batch is None or len(batch) < n * ETH_FRAME_MAX:
+            batch = bytearray(n * ETH_FRAME_MAX)
+            self.local.batch = batch
+            self.local.cbatch = (ctypes.c_char * len(batch)).from_buffer(batch)
+            self.local.iovs = (iovec * n)()
+            self.local.msgs = (mmsghdr * n)()
+            for j in range(n):
+                self.local.msgs[j].msg_hdr.msg_iov = ctypes.pointer(self.local.iovs[j])
+                self.local.msgs[j].msg_hdr.msg_iovlen = 1
+        base = ctypes.addressof(self.local.cbatch)
+        iovs = self.local.iovs
+        msgs = self.local.msgs
+        lengths = [0] * n
+        for k in range(n):
+            data, length, etherType, dstMac = frames[k]
+            if length + ETH_HLEN > ETH_FRAME_MAX:
+                logging.debug('Se ha intentado crear una trama ethernet con longitud mayor de lo permitido: '+str(length + ETH_HLEN)+".\nSiendo lo maximo: "+str(ETH_FRAME_MAX))
+                st[k] = -1
+                continue
+            off = k * ETH_FRAME_MAX
+            batch[off:off + 6] = dstMac
+            batch[off + 6:off + 12] = self.mac
+            batch[off + 12:off + 14] = etherType
+            # El payload puede venir en varios trozos (cabecera IP + fragmento de datos): se copian una vez cada uno
+            pos = off + ETH_HLEN
+            for piece in (data if isinstance(data, list) else (data,)):
+                batch[pos:pos + len(piece)] = piece
+                pos += len(piece)
+            end = pos - off
+            if end < ETH_FRAME_MIN:
+                batch[pos:off + ETH_FRAME_MIN] = ZERO_PAD[:ETH_FRAME_MIN - end]
+                end = ETH_FRAME_MIN
+            lengths[k] = end
+        pending = [k for k in range(n) if st[k] == 0]
+        if self.fd is not None:
+            # Un mensaje de un solo iovec por trama; las que han fallado antes no se incluyen
+            for j in range(len(pending)):
+                k = pending[j]
+                iovs[j].iov_base = base + k * ETH_FRAME_MAX
+                iovs[j].iov_len = lengths[k]
+            j = 0
+            while j < len(pending):
+                ret = sendmmsg(self.fd, msgs, j, len(pending) - j, 0)
+                if ret < 0:
+                    # La trama j no se ha podido enviar: se marca y se sigue con la siguiente
+                    logging.error('Error enviando trama Ethernet: ' + os.strerror(-ret))
+                    st[pending[j]] = -1
+                    j += 1
+                else:
+                    j += ret
+        elif self.handle is None:
+            view = memoryview(batch)
+            for k in pending:
+                try:
+                    self.sock.send(view[k * ETH_FRAME_MAX:k * ETH_FRAME_MAX + lengths[k]])
+                except OSError as e:
+                    logging.error('Error enviando trama Ethernet: ' + str(e))
+                    st[k] = -1
+        else:
+            for k in pending:
+                if pcap_inject(self.handle, ctypes.c_void_p(base + k * ETH_FRAME_MAX), lengths[k]) == -1:
+                    logging.error('Error enviando trama Ethernet: ' + pcap_geterr(self.handle))
+                    st[k] = -1
+        return st
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+'''
+Clase que implementa un hilo de recepcion. De esta manera al iniciar el nivel Ethernet
+podemos dejar un hilo con pcap_loop que reciba los paquetes sin bloquear el envio.
+En esta clase NO se debe modificar codigo
+'''
+class rxThread(threading.Thread):
+
+    def __init__(self, level):
+        threading.Thread.__init__(self)
+        self.level = level
+
+    def run(self):
+        handle = self.level.handle
+        # Ejecuta pcap_loop. OJO: handle debe estar inicializado con el resultado de pcap_open_live
+        if handle is not None:
+            pcap_loop(handle,-1,self.level.process_frame,None)
+    def stop(self):
+        handle = self.level.handle
+        # Para la ejecucion de pcap_loop
+        if handle is not None:
+            pcap_breakloop(handle)
+
+
+'''
+Clase que implementa el hilo de recepcion para el backend TPACKET_V3: recorre el anillo (ring) y entrega cada trama
+a process_frame, igual que rxThread hace con pcap_loop.
+'''
+class ringThread(threading.Thread):
+
+    def __init__(self, level):
+        threading.Thread.__init__(self)
+        self.level = level
+
+    def run(self):
+        ring = self.level.ring
+        if ring is not None:
+            ring.loop(self.level.process_frame,None)
+    def stop(self):
+        # Para el recorrido del anillo
+        ring = self.level.ring
+        if ring is not None:
+            ring.breakloop()
+
+
+'''
+Clase que implementa el hilo de recepcion cuando el nivel se inicia sobre un enlace (link) en lugar de una interfaz,
+por ejemplo un puerto memoryLink de memlink.py. Un enlace es cualquier objeto con:
+    -name, mac, ip, netmask, gateway y mtu: la configuracion que en una interfaz real se consulta al sistema
+    -loop(callback,us) y breakloop(): entregan cada trama a callback(us,header,data), como pcap_loop
+    -send(buffer) y sendmsg(buffers): envian una trama, como un socket (se pasa a txEngine en lugar del socket)
+    -stats(): (recibidas, descartadas)
+El nivel no cierra el enlace al pararse (solo llama a breakloop): lo cierra quien lo haya creado.
+'''
+class linkThread(threading.Thread):
+
+    def __init__(self, level):
+        threading.Thread.__init__(self)
+        self.level = level
+
+    def run(self):
+        link = self.level.link
+        if link is not None:
+            link.loop(self.level.process_frame,None)
+    def stop(self):
+        # Para la entrega de tramas del enlace
+        link = self.level.link
+        if link is not None:
+            link.breakloop()
+
+
+'''
+Clase que implementa el nivel Ethernet sobre una interfaz. Guarda todo el estado que antes eran variables globales del
+modulo (MAC, handle de pcap o anillo TPACKET_V3, hilo de recepcion, motor de transmision, motor de despacho, filtro,
+Ethertypes registrados y estadisticas), de modo que un mismo proceso puede tener la pila abierta sobre varias
+interfaces a la vez, cada una con su propio hilo de recepcion y su propio motor de transmision:
+    eth1 = EthernetLevel()
+    eth1.start('eth1')
+    ip1 = IPLevel(eth1)     (ver ip.py, crea tambien su nivel ARP)
+    ip1.init('eth1')
+Las funciones del modulo (startEthernetLevel, registerCallback, sendEthernetFrame...) trabajan sobre defaultLevel,
+una instancia creada al importar el modulo, asi que el codigo que solo usa una interfaz no cambia.
+Cada metodo hace lo mismo que la funcion del modulo del mismo nombre (ver su descripcion mas adelante).
+'''
+class EthernetLevel():
+
+    def __init__(self):
+        #Diccionario que alamacena para un Ethertype dado (entero) que funcion de callback se debe ejecutar
+        self.upperProtos = {}
+        #Tablas por VLAN (VLAN ID -> diccionario como upperProtos) que tienen prioridad sobre upperProtos en esa VLAN
+        self.vlanProtos = {}
+        #Interfaz y direccion MAC sobre las que se ha iniciado el nivel
+        self.interface = None
+        self.macAddress = None
+        #Handle de pcap de la interfaz abierta (None si el nivel no esta inicializado)
+        self.handle = None
+        #Anillo de captura TPACKET_V3 (None si se usa libpcap)
+        self.ring = None
+        #Enlace sobre el que se ha iniciado el nivel en lugar de una interfaz (ver linkThread)
+        self.link = None
+        #Indica si el nivel Ethernet esta inicializado
+        self.levelInitialized = False
+        #Expresion BPF adicional indicada por el usuario en start
+        self.userFilter = None
+        #Si es True se instala en el kernel un filtro construido a partir de nuestra MAC y los Ethertypes registrados
+        self.autoFilter = True
+        #Semaforo para no instalar dos filtros a la vez
+        self.filterLock = threading.Lock()
+        #Motor de despacho de tramas (None => un hilo por trama)
+        self.dispatcher = None
+        #Motor de transmision de tramas (se crea en start)
+        self.transmitter = None
+        #Configuracion del motor de despacho (workers, queueSize, queuePolicy) con la que se inicio el nivel
+        self.dispatchConfig = (DISPATCH_WORKERS, DISPATCH_QUEUE_SIZE, DISPATCH_DROP)
+        #Procesos de captura del modo PACKET_FANOUT y gestor del estado compartido con ellos
+        self.fanoutProcs = []
+        self.fanoutManager = None
+        #Estadisticas que publican los procesos de captura (diccionario del gestor: numero de proceso -> getStats)
+        self.fanoutStats = None
+        #Funciones que los niveles superiores registran para compartir su estado con los procesos de captura
+        self.sharedStateHooks = []
+        #Hilo de recepcion e hilo que escribe periodicamente las estadisticas (start con statsInterval > 0)
+        self.recvThread = None
+        self.statsThread = None
+        #Perfil de captura de PCAP_PROFILES con el que se abrio la interfaz (None => pcap_open_live)
+        self.captureProfile = None
+        #Estadisticas del nivel (ver getStats)
+        self.stats = ethernetStats(self)
+
+    def captureTimeout(self):
+        if self.captureProfile is None:
+            return TO_MS
+        return PCAP_PROFILES[self.captureProfile]['timeout']
+
+    def buildFilter(self):
+        parts = []
+        if self.autoFilter:
+            mac = ':'.join(['{:02x}'.format(b) for b in self.macAddress])
+            parts.append('(ether dst ' + mac + ' or ether broadcast)')
+        if self.userFilter is not None:
+            parts.append('(' + self.userFilter + ')')
+        if self.autoFilter:
+            ethertypes = set(self.upperProtos)
+            for table in self.vlanProtos.values():
+                ethertypes.update(table)
+            if len(ethertypes) > 0:
+                types = '(' + ' or '.join(['ether proto 0x{:04x}'.format(k) for k in sorted(ethertypes)]) + ')'
+                # Tambien las tramas con una o dos etiquetas VLAN. Cada "vlan" desplaza los offsets del resto de la
+                # expresion, por eso va al final (detras del filtro del usuario) y anidado en lugar de con otro or
+                parts.append('(' + types + ' or (vlan and (' + types + ' or (vlan and ' + types + '))))')
+        if len(parts) == 0:
+            return None
+        return ' and '.join(parts)
+
+    def setFilter(self):
+        # Un enlace no tiene filtro en el kernel: las tramas las filtra process_Ethernet_frame
+        if self.link is not None:
+            return 0
+        handle = self.handle
+        ring = self.ring
+        if handle is None and ring is None:
+            return -1
+        expr = self.buildFilter()
+        if expr is None:
+            return 0
+        with self.filterLock:
+            fp = bpf_program()
+            # Con el anillo TPACKET_V3 no hay handle de captura: se compila sobre uno muerto y se instala en su socket
+            compiler = handle if ring is None else pcap_open_dead(DLT_EN10MB, ETH_FRAME_MAX)
+            if pcap_compile(compiler, fp, expr, 1, PCAP_NETMASK_UNKNOWN) != 0:
+                logging.error('Error compilando el filtro BPF "' + expr + '": ' + pcap_geterr(compiler))
+                if ring is not None:
+                    pcap_close(compiler)
+                return -1
+            if ring is None:
+                ret = pcap_setfilter(handle, fp)
+                error = pcap_geterr(handle) if ret != 0 else None
+            else:
+                try:
+                    ring.attachFilter(fp.bf_len, fp.bf_insns)
+                    ret = 0
+                except OSError as e:
+                    ret = -1
+                    error = str(e)
+                pcap_close(compiler)
+            pcap_freecode(fp)
+            if ret != 0:
+                logging.error('Error instalando el filtro BPF "' + expr + '": ' + error)
+                return -1
+        logging.debug('Filtro BPF instalado: ' + expr)
+        return 0
+
+    def process_Ethernet_frame(self,us,header,data):
+        stats = self.stats
+        # Vista de la trama compartida por todos los niveles (ver packet.py): los campos se leen una sola vez y los
+        # niveles superiores reciben la misma vista, no copias
+        pkt = Packet.of(data)
+        # Ethernet origen los 6 primeros bytes
+        ethernet_origen = pkt.ethSrc
+        # Ethernet destino del 6 al 12
+        ethernet_destino = pkt.ethDst
+
+        # Comprobamos si el destino somos nosotros o el broadcastAddr
+
+        if ethernet_destino != self.macAddress and ethernet_destino != broadcastAddr:
+            stats.count(None, 'mac')
+            return
+
+        # Ethertype los dos siguientes bytes (entero en orden de red), o el de despues de las etiquetas VLAN
+        ethertype = pkt.ethertype
+        vlan = pkt.vlan
+
+        # En una VLAN con tabla propia se busca primero en ella
+        func = None
+        if vlan is not None and vlan in self.vlanProtos:
+            func = self.vlanProtos[vlan].get(ethertype)
+        if func is None:
+            func = self.upperProtos.get(ethertype)
+        if func is None:
+            stats.count(ethertype, 'ethertype', vlan)
+            return
+
+        stats.count(ethertype, None, vlan)
+
+        # El payload empieza despues de la cabecera Ethernet (y de las etiquetas VLAN)
+        pkt.l3 = pkt.off = pkt.ethHeaderLength
+
+        func (us, header, pkt, ethernet_origen)
+
+    def process_frame(self,us,header,data):
+        if self.dispatcher is not None:
+            self.dispatcher.submit(us,header,data)
+            return
+        threading.Thread(target=self.process_Ethernet_frame,args=(us,header,data)).start()
+
+    def registerCallback(self, callback_func, ethertype, vlan=None):
+        # El Ethertype se guarda como entero (puede venir como entero o como 2 bytes en orden de red)
+        if not isinstance(ethertype, int):
+            ethertype = int.from_bytes(ethertype, 'big')
+        #upperProtos es el diccionario que relaciona funcion de callback y ethertype
+        if vlan is None:
+            self.upperProtos[ethertype] = callback_func
+        else:
+            self.vlanProtos.setdefault(vlan, {})[ethertype] = callback_func
+        # Si la interfaz ya esta abierta recalculamos el filtro del kernel con el nuevo Ethertype
+        if self.handle is not None or self.ring is not None:
+            self.setFilter()
+
+    def start(self, interface, bpfFilter=None, filterFrames=True, workers=DISPATCH_WORKERS, queueSize=DISPATCH_QUEUE_SIZE, queuePolicy=DISPATCH_DROP, scatterGather=False, backend=BACKEND_PCAP, statsInterval=0, profile=None):
+        # Si ya estaba inicializado no se abre otra captura (quedarian dos hilos de recepcion procesando cada trama)
+        if self.levelInitialized:
+            return -1
+        self.handle = None
+        self.ring = None
+        self.link = None
+        self.dispatchConfig = (workers, queueSize, queuePolicy)
+        self.userFilter = bpfFilter
+        self.autoFilter = filterFrames
+        errbuf = bytearray()
+        if profile is not None and profile not in PCAP_PROFILES:
+            logging.error('Perfil de captura desconocido: ' + str(profile))
+            return -1
+        self.captureProfile = profile
+
+        # Si backend no es uno de los nombres es un enlace (ver linkThread) que sustituye a la interfaz
+        if not isinstance(backend, str):
+            self.link = backend
+            interface = backend.name
+
+        # Comprobamos parametros
+        if interface is None:
+            return -1
+
+        # Almacenamos la direccion MAC de la interfaz
+        self.interface = interface
+        self.macAddress = getHwAddr(interface) if self.link is None else self.link.mac
+
+        if self.link is not None:
+            # Se envia por el propio enlace, que se usa como el socket del modo scatter-gather
+            self.transmitter = txEngine(None, self.macAddress, self.link, None, scatterGather)
+        elif backend == BACKEND_TPACKET:
+            # Abrimos la interfaz en modo promiscuo con un anillo TPACKET_V3. Se envia por el mismo socket
+            try:
+                self.ring = packetRing(interface, True, self.captureTimeout())
+            except OSError as e:
+                logging.error('Error abriendo el anillo TPACKET_V3: ' + str(e))
+                return -1
+            fd = self.ring.fileno() if hasattr(libc, 'sendmmsg') else None
+            self.transmitter = txEngine(None, self.macAddress, self.ring.sock, fd, scatterGather)
+        else:
+            # Abrimos la interfaz en modo promiscuo con la libreria pcap (con pcap_create/pcap_activate si hay perfil)
+            if profile is not None:
+                self.handle = pcap_open_profile(interface, ETH_FRAME_MAX, PROMISC, profile, errbuf)
+            else:
+                self.handle = pcap_open_live(interface, ETH_FRAME_MAX, PROMISC, TO_MS, errbuf)
+
+            # Control de errores
+            if self.handle is None:
+                logging.error('Error abriendo la interfaz ' + interface + ': ' + errbuf.decode('ascii', 'replace'))
+                return -1
+
+            # Todas las tramas se envian por el mismo handle (y por el mismo socket en modo scatter-gather)
+            sock = None
+            if scatterGather:
+                sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW)
+                sock.bind((interface, 0))
+            fd = pcap_fileno(self.handle)
+            if fd < 0 or not hasattr(libc, 'sendmmsg'):
+                fd = None
+            self.transmitter = txEngine(self.handle, self.macAddress, sock, fd, scatterGather)
+
+        # Filtramos en el kernel lo que process_Ethernet_frame descartaria
+        if self.setFilter() != 0:
+            self.transmitter.close()
+            self.transmitter = None
+            if self.link is not None:
+                self.link = None
+            elif self.ring is not None:
+                self.ring.close()
+                self.ring = None
+            else:
+                pcap_close(self.handle)
+                self.handle = None
+            return -1
+
+        # Ahora el nivel SI esta inicializado
+        self.levelInitialized = True
+
+        # Arrancamos el motor de despacho antes que el hilo de recepcion
+        if self.dispatcher is not None:
+            self.dispatcher.stop()
+            self.dispatcher = None
+        if workers > 0:
+            self.dispatcher = dispatchEngine(workers, queueSize, queuePolicy, self.process_Ethernet_frame)
+            self.dispatcher.start()
+
+        self.startReceiver()
+
+        if self.statsThread is not None:
+            self.statsThread.stop()
+            self.statsThread = None
+        if statsInterval > 0:
+            self.statsThread = statsLogger(statsInterval, self)
+            self.statsThread.daemon = True
+            self.statsThread.start()
+        return 0
+
+    def startReceiver(self):
+        if self.link is not None:
+            self.recvThread = linkThread(self)
+        elif self.ring is not None:
+            self.recvThread = ringThread(self)
+        else:
+            self.recvThread = rxThread(self)
+        self.recvThread.daemon = True
+        self.recvThread.start()
+
+    def stop(self):
+        if self.statsThread is not None:
+            self.statsThread.stop()
+            self.statsThread = None
+
+        # Paramos los procesos de captura del modo PACKET_FANOUT
+        for p in self.fanoutProcs:
+            p.terminate()
+        for p in self.fanoutProcs:
+            p.join()
+        self.fanoutProcs = []
+        if self.fanoutManager is not None:
+            self.fanoutManager.shutdown()
+            self.fanoutManager = None
+        self.fanoutStats = None
+
+        # Paramos el hilo de recepcion
+        if self.recvThread is not None:
+            self.recvThread.stop()
+
+        # El enlace no se cierra: es de quien lo ha creado (memorySwitch.attach), que puede volver a iniciar el nivel sobre el
+        if self.link is not None:
+            self.recvThread.join()
+            self.transmitter = None
+            self.link = None
+
+        # Con el anillo TPACKET_V3 hay que esperar a que el hilo deje de recorrerlo antes de liberarlo
+        if self.ring is not None:
+            self.recvThread.join()
+            packets, drops = self.ring.stats()
+            logging.info('Anillo TPACKET_V3: ' + str(packets) + ' tramas recibidas, ' + str(drops) + ' descartadas')
+            if self.transmitter is not None:
+                self.transmitter.close()
+            self.transmitter = None
+            self.ring.close()
+            self.ring = None
+
+        # cerramos el descriptor
+        if self.handle is not None:
+            pcap_close(self.handle)
+            # Asi registerCallback no intenta instalar filtros sobre un handle cerrado
+            self.handle = None
+            if self.transmitter is not None:
+                self.transmitter.close()
+            self.transmitter = None
+
+        # Tras startFanout el proceso principal ya no captura: solo queda su socket de envio
+        if self.transmitter is not None:
+            self.transmitter.close()
+            self.transmitter = None
+
+        # Paramos los hilos del motor de despacho
+        if self.dispatcher is not None:
+            self.dispatcher.stop()
+            self.dispatcher = None
+
+        # Ahora el nivel no esta inicializado
+        self.levelInitialized = False
+        return 0
+
+    def sendFrame(self, data, len, etherType, dstMac):
+        # La construccion y el envio los hace el motor de transmision creado en start
+        transmitter = self.transmitter
+        if transmitter is None:
+            logging.debug('Se ha intentado enviar una trama sin inicializar el nivel Ethernet')
+            return -1
+        return transmitter.send(data,len,etherType,dstMac)
+
+    def scatterGatherEnabled(self):
+        return self.transmitter is not None and self.transmitter.scatter
+
+    def sendFrameV(self, buffers, len, etherType, dstMac):
+        transmitter = self.transmitter
+        if transmitter is None:
+            logging.debug('Se ha intentado enviar una trama sin inicializar el nivel Ethernet')
+            return -1
+        if not transmitter.scatter:
+            return transmitter.send(b''.join(buffers),len,etherType,dstMac)
+        return transmitter.sendv(buffers,len,etherType,dstMac)
+
+    def sendFrames(self, batch):
+        transmitter = self.transmitter
+        if transmitter is None:
+            logging.debug('Se ha intentado enviar una trama sin inicializar el nivel Ethernet')
+            return [-1] * len(batch)
+        return transmitter.sendBatch(batch)
+
+    def registerSharedState(self, hook):
+        if hook not in self.sharedStateHooks:
+            self.sharedStateHooks.append(hook)
+
+    def fanoutWorker(self, interface, groupId, conn=None, index=0):
+        # Del proceso principal solo se hereda el estado: el handle de pcap y los hilos no son de este proceso.
+        # De su captura solo se cierra la copia del descriptor (pcap_close liberaria el anillo del socket compartido)
+        if self.transmitter is not None:
+            self.transmitter.close()
+        if self.ring is not None:
+            self.ring.close()
+        elif self.handle is not None:
+            os.close(pcap_fileno(self.handle))
+        self.handle = None
+        self.ring = None
+        self.fanoutProcs = []
+        # Contadores propios, que se publican en el diccionario compartido (los del proceso principal los cuenta el)
+        self.stats = ethernetStats(self)
+        shared = self.fanoutStats
+        self.fanoutStats = None
+        # Se avisa al proceso principal por conn: None si el anillo esta listo o el texto del error
+        try:
+            self.ring = packetRing(interface, True, self.captureTimeout(), fanout=groupId)
+        except OSError as e:
+            if conn is not None:
+                conn.send('Error abriendo el anillo TPACKET_V3: ' + str(e))
+            return
+        fd = self.ring.fileno() if hasattr(libc, 'sendmmsg') else None
+        self.transmitter = txEngine(None, self.macAddress, self.ring.sock, fd, False)
+        if self.setFilter() != 0:
+            if conn is not None:
+                conn.send('Error instalando el filtro BPF')
+            return
+        workers, queueSize, queuePolicy = self.dispatchConfig
+        self.dispatcher = None
+        if workers > 0:
+            self.dispatcher = dispatchEngine(workers, queueSize, queuePolicy, self.process_Ethernet_frame)
+            self.dispatcher.start()
+        if conn is not None:
+            conn.send(None)
+            conn.close()
+        if shared is not None:
+            publisher = threading.Thread(target=self.publishStats, args=(shared, index))
+            publisher.daemon = True
+            publisher.start()
+        self.ring.loop(self.process_frame, None)
+
+    def publishStats(self, shared, index):
+        while True:
+            time.sleep(FANOUT_STATS_INTERVAL)
+            try:
+                shared[index] = self.stats.snapshot()
+            except (OSError, EOFError):
+                # El proceso principal ha cerrado el gestor
+                return
+
+    def startFanout(self, interface, processes):
+        # El modo PACKET_FANOUT necesita una interfaz real
+        if self.levelInitialized is not True or processes <= 0 or len(self.fanoutProcs) > 0 or self.link is not None:
+            return -1
+
+        # Si un intento anterior fallo el estado ya esta compartido con el gestor
+        if self.fanoutManager is None:
+            self.fanoutManager = multiprocessing.Manager()
+            for hook in self.sharedStateHooks:
+                hook(self.fanoutManager)
+            self.fanoutStats = self.fanoutManager.dict()
+
+        # El proceso principal deja de capturar: las tramas llegan ahora a los procesos del grupo
+        self.recvThread.stop()
+        self.recvThread.join()
+
+        # fork para que los procesos hereden los manejadores registrados y el estado de los niveles
+        ctx = multiprocessing.get_context('fork')
+        # Un grupo por interfaz (el identificador tiene que ser distinto para cada una)
+        groupId = (os.getpid() + id(self)) & 0xffff
+        conns = []
+        for i in range(processes):
+            recvEnd, sendEnd = ctx.Pipe(False)
+            p = ctx.Process(target=self.fanoutWorker, args=(interface, groupId, sendEnd, i))
+            p.daemon = True
+            p.start()
+            # Solo el hijo se queda con su extremo: si muere sin avisar recv recibe EOF
+            sendEnd.close()
+            self.fanoutProcs.append(p)
+            conns.append(recvEnd)
+
+        # Esperamos a que todos los procesos tengan su anillo listo
+        errors = []
+        for conn in conns:
+            if not conn.poll(FANOUT_START_TIMEOUT):
+                errors.append('el proceso de captura no ha respondido')
+                continue
+            try:
+                error = conn.recv()
+            except EOFError:
+                error = 'el proceso de captura ha terminado'
+            if error is not None:
+                errors.append(error)
+        for conn in conns:
+            conn.close()
+        if not errors:
+            # El proceso principal solo envia: su captura se sustituye por un socket que no recibe nada (protocolo 0)
+            # para que el kernel no siga copiando tramas a un handle o un anillo que ya no se lee
+            sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, 0)
+            sock.bind((interface, 0))
+            fd = sock.fileno() if hasattr(libc, 'sendmmsg') else None
+            transmitter = self.transmitter
+            self.transmitter = txEngine(None, self.macAddress, sock, fd, transmitter.scatter)
+            transmitter.close()
+            if self.ring is not None:
+                self.ring.close()
+                self.ring = None
+            else:
+                pcap_close(self.handle)
+                self.handle = None
+            return 0
+
+        # Si alguno ha fallado se paran todos y el proceso principal vuelve a capturar (el estado sigue compartido
+        # con el gestor hasta stop)
+        logging.error('Iniciando el modo PACKET_FANOUT: ' + '; '.join(errors))
+        for p in self.fanoutProcs:
+            p.terminate()
+        for p in self.fanoutProcs:
+            p.join()
+        self.fanoutProcs = []
+        self.startReceiver()
+        return -1
+
+    def getStats(self):
+        return self.stats.snapshot()
+
+
+#Nivel Ethernet sobre el que trabajan las funciones del modulo
+defaultLevel = EthernetLevel()
+#Estadisticas del nivel Ethernet por defecto (ver getEthernetStats)
+stats = defaultLevel.stats
+
+
+'''
+Nombre: captureTimeout
+Descripcion: Devuelve el timeout de lectura (ms) que corresponde al perfil de captura activo, o TO_MS si no hay perfil
+'''
+def captureTimeout():
+    return defaultLevel.captureTimeout()
+
 '''
 Nombre: process_Ethernet_frame
 Descripcion: Esta funcion se ejecutara cada vez que llegue una trama Ethernet.
     Esta funcion debe realizar, al menos, las siguientes tareas:
-        -Extraer los campos de direccion Ethernet destino, origen y ethertype
+        -Extraer los campos de direccion Ethernet destino, origen y ethertype (quitando las etiquetas VLAN 802.1Q/QinQ)
         -Comprobar si la direccion destino es la propia o la de broadcast. En caso de que la trama no vaya en difusion o no sea para nuestra interfaz la descartaremos (haciendo un return).
         -Comprobar si existe una funcion de callback de nivel superior asociada al Ethertype de la trama:
             -En caso de que exista, llamar a la funcion de nivel superior con los parametros que corresponde:
@@ -62,40 +1002,38 @@ Retorno:
     -Ninguno
 '''
 def process_Ethernet_frame(us,header,data):
-	global macAddress
-	data = bytes(data)
-    # Ethernet origen los 6 primeros bytes
-	ethernet_origen = data[6:12]
-	# Ethernet destino del 6 al 12
-	ethernet_destino = data[:6]
-
-    # Ethertype los dos siguientes bytes
-	ethertype = data [12:14]
+    defaultLevel.process_Ethernet_frame(us,header,data)
 
-    # Comprobamos si el destino somos nosotros o el broadcastAddr
-    
-	if ethernet_destino != macAddress and ethernet_destino != broadcastAddr:
-
-		return
+'''
+Nombre: buildEthernetFilter
+Descripcion: Esta funcion construye la expresion BPF que se instala en el kernel para que solo suban a Python las tramas
+    que process_Ethernet_frame no descartaria: las dirigidas a nuestra MAC o a broadcast y con un Ethertype registrado
+    en upperProtos (o en una tabla por VLAN), sin etiquetas o con una o dos etiquetas VLAN. Si el usuario ha indicado
+    una expresion propia se annade con un and (o se usa sola si autoFilter es False).
+Argumentos: Ninguno
+Retorno:
+    -Cadena con la expresion BPF o None si no hay que filtrar
+'''
+def buildEthernetFilter():
 
-	ethertypeBien = struct.unpack('h',ethertype)
+    return defaultLevel.buildFilter()
 
-	if not ethertypeBien in upperProtos:
-		# print("No se ha encontrado el ethertype: "+str(ethertype)+"en el diccionario")
-		# print(upperProtos)
-		
-		return
-    
-	func = upperProtos[ethertypeBien]
-	
-	func (us, header, data[14:], ethernet_origen)
+'''
+Nombre: setEthernetFilter
+Descripcion: Esta funcion compila (pcap_compile) e instala (pcap_setfilter) en la interfaz abierta el filtro devuelto por
+    buildEthernetFilter. Se llama al iniciar el nivel Ethernet y cada vez que se registra un nuevo Ethertype.
+Argumentos: Ninguno
+Retorno: 0 si todo es correcto, -1 en otro caso
+'''
+def setEthernetFilter():
 
+    return defaultLevel.setFilter()
 
 '''
 Nombre: process_frame
-Descripcion: Esta funcion se pasa a pcap_loop y se ejecutara cada vez que llegue una trama. La funcion
-ejecutara la funcion process_Ethernet_frame en un hilo nuevo para evitar interbloqueos entre 2 recepciones
-consecutivas de tramas dependientes. Esta funcion NO debe modifciarse
+Descripcion: Esta funcion se pasa a pcap_loop y se ejecutara cada vez que llegue una trama. Si hay un motor de despacho
+(dispatcher) la trama se entrega a sus hilos; si no, se ejecuta process_Ethernet_frame en un hilo nuevo. En ambos casos
+se evitan interbloqueos entre 2 recepciones consecutivas de tramas dependientes.
 Argumentos:
     -us: datos de usuarios pasados desde pcap_loop (en nuestro caso sera None)
     -header: estructura pcap_pkthdr que contiene los campos len, caplen y ts.
@@ -105,29 +1043,7 @@ Retorno:
 '''
 def process_frame(us,header,data):
 
-    threading.Thread(target=process_Ethernet_frame,args=(us,header,data)).start()
-
-
-'''
-Clase que implementa un hilo de recepcion. De esta manera al iniciar el nivel Ethernet
-podemos dejar un hilo con pcap_loop que reciba los paquetes sin bloquear el envio.
-En esta clase NO se debe modificar codigo
-'''
-class rxThread(threading.Thread):
-
-    def __init__(self):
-        threading.Thread.__init__(self)
-
-    def run(self):
-        global handle
-        # Ejecuta pcap_loop. OJO: handle debe estar inicializado con el resultado de pcap_open_live
-        if handle is not None:
-            pcap_loop(handle,-1,process_frame,None)
-    def stop(self):
-        global handle
-        # Para la ejecucion de pcap_loop
-        if handle is not None:
-            pcap_breakloop(handle)
+    defaultLevel.process_frame(us,header,data)
 
 
 '''
@@ -144,17 +1060,25 @@ Argumentos:
             -us: son los datos de usuarios pasados por pcap_loop (en nuestro caso este valor sera siempre None)
             -header: estructura pcap_pkthdr que contiene los campos len, caplen y ts.
             -data: payload de la trama Ethernet. Es decir, la cabecera Ethernet NUNCA se pasa hacia arriba.
-            -srcMac: direccion MAC que ha enviado la trama actual.
+                Es una vista Packet (ver packet.py) colocada en el payload: se usa como el payload en bytes (len,
+                indices y slices relativos al payload, que devuelven memoryviews de la trama) y ademas da acceso a los
+                campos ya decodificados. Si la funcion quiere guardar el payload (o parte) despues de retornar debe
+                copiarlo con bytes().
+            -srcMac: direccion MAC que ha enviado la trama actual (tambien una memoryview, con la misma regla).
+        Si la trama venia con etiquetas VLAN, estas ya se han quitado y data.vlan es el VLAN ID (data.vlans todos, el
+        exterior primero en QinQ); en una trama sin etiquetas data.vlan es None.
         La funcion no retornara nada. Si una trama se quiere descartar basta con hacer un return sin valor y dejara de procesarse.
-    -ethertype: valor de Ethernetype para el cual se quiere registrar una funcion de callback.
+    -ethertype: valor de Ethernetype para el cual se quiere registrar una funcion de callback (entero, por ejemplo 0x0800,
+        o 2 bytes en orden de red).
+    -vlan: si se indica, la funcion solo se usa para las tramas de esa VLAN (VLAN ID interior) y, en ella, tiene
+        prioridad sobre la registrada sin VLAN. Con None se usa para las tramas sin etiquetas y las de cualquier VLAN
+        que no tenga una funcion propia para ese Ethertype.
 Retorno:
 	Ninguno
 '''
-def registerCallback(callback_func, ethertype):
+def registerCallback(callback_func, ethertype, vlan=None):
 
-    global upperProtos
-    #upperProtos es el diccionario que relaciona funcion de callback y ethertype
-    upperProtos[struct.unpack('h',ethertype)] = callback_func
+    defaultLevel.registerCallback(callback_func, ethertype, vlan)
 
 
 '''
@@ -168,46 +1092,25 @@ Descripcion: Esta funcion recibe el nombre de una interfaz de red e inicializa e
         -Si todo es correcto marcar la variable global de nivel incializado a True
 Argumentos:
     -Interface: nombre de la interfaz sobre la que inicializar el nivel Ethernet
+    -bpfFilter: expresion BPF opcional que se annade al filtro automatico (ver buildEthernetFilter)
+    -filterFrames: si es False no se instala el filtro automatico (solo bpfFilter, si se indica)
+    -workers: numero de hilos del motor de despacho. Con 0 se crea un hilo por trama
+    -queueSize: tamanno de la cola de cada hilo del motor de despacho
+    -queuePolicy: DISPATCH_DROP o DISPATCH_BLOCK (ver dispatchEngine)
+    -scatterGather: si es True se abre un socket AF_PACKET para enviar con sendmsg sin copiar (ver sendEthernetFrameV)
+    -backend: BACKEND_PCAP (pcap_loop) o BACKEND_TPACKET (anillo TPACKET_V3 proyectado en memoria, ver tpacket.py).
+        Tambien puede ser un enlace (ver linkThread), por ejemplo un puerto de memlink.py: en ese caso no se abre
+        ninguna interfaz (interface puede ser None) y la MAC es la del enlace
+    -statsInterval: si es mayor que 0, cada cuantos segundos se escriben las estadisticas del nivel (ver getEthernetStats)
+    -profile: perfil de captura de PCAP_PROFILES ('low-latency' o 'high-throughput'). Con None se abre la interfaz con
+        pcap_open_live y los valores por defecto. Con el backend tpacket solo se aplica el timeout del perfil
 Retorno: 0 si todo es correcto, -1 en otro caso
 '''
-def startEthernetLevel(interface):
-
-    global macAddress, handle, levelInitialized, recvThread
-    handle = None
-    errbuf = bytearray()
-
-    # Comprobamos parametros
-    if interface is None:
-        return -1
-
-     # Comprobamos si esta inicializado
-    #if levelInitialized is True:
-    #    return -1
+def startEthernetLevel(interface, bpfFilter=None, filterFrames=True, workers=DISPATCH_WORKERS, queueSize=DISPATCH_QUEUE_SIZE, queuePolicy=DISPATCH_DROP, scatterGather=False, backend=BACKEND_PCAP, statsInterval=0, profile=None):
 
-    # Almacenamos la direccion MAC de la interfaz
-    macAddress = getHwAddr(interface)
+    return defaultLevel.start(interface, bpfFilter, filterFrames, workers, queueSize, queuePolicy, scatterGather, backend, statsInterval, profile)
 
-    # Abrimos la interfaz en modo promiscuo con la libreria pcap
-    handle = pcap_open_live(interface, ETH_FRAME_MAX, PROMISC, TO_MS, errbuf)
 
-    # Control de errores
-    if handle is None:
-        return -1
-
-    # Ahora el nivel SI esta inicializado
-    levelInitialized = True
-
-    # Una vez hemos abierto la interfaz para captura y hemos inicializado las variables globales
-    # (macAddress, handle y levelInitialized) arrancamos el hilo de recepcion
-
-    # TODO comprobar esto por si acaso
-    recvThread = rxThread()
-    recvThread.daemon = True
-    recvThread.start()
-    return 0
-
-
-global macAddress, handle, levelInitialized, recvThread
 '''
 Nombre: stopEthernetLevel
 Descripcion_ Esta funcion parara y liberara todos los recursos necesarios asociados al nivel Ethernet.
@@ -220,17 +1123,7 @@ Retorno: 0 si todo es correcto y -1 en otro caso
 '''
 def stopEthernetLevel():
 
-    # Paramos el hilo de recepcion
-    recvThread.stop()
-
-    # cerramos el descriptor
-    if handle is not None:
-        pcap_close(handle)
-        recvThread.stop()
-
-    # Ahora el nivel no esta inicializado
-    levelInitialized = False
-    return 0
+    return defaultLevel.stop()
 
 
 
@@ -252,41 +1145,149 @@ Retorno: 0 si todo es correcto, -1 en otro caso
 '''
 def sendEthernetFrame(data,len,etherType,dstMac):
 
-    global macAddress,handle
-
-    s = socket.socket(socket.AF_PACKET, socket.SOCK_RAW)
-
     # La trama ethernet que construyo esta constituida por la siguiente secuencia de bytes:
-    # 6 bytes de la direccion MAC de origen
     # 6 bytes de la direccion MAC de destino
+    # 6 bytes de la direccion MAC de origen
     # 2 bytes de la cabecera ethertype
     # el resto de bytes es el payload
+    return defaultLevel.sendFrame(data,len,etherType,dstMac)
+
+
+'''
+Nombre: scatterGatherEnabled
+Descripcion: Esta funcion indica si el nivel Ethernet se ha iniciado en modo scatter-gather. Los niveles superiores la
+    consultan para decidir si pasan sus cabeceras y el payload por separado (sendEthernetFrameV) o ya concatenados.
+Argumentos: Ninguno
+Retorno: True o False
+'''
+def scatterGatherEnabled():
+
+    return defaultLevel.scatterGatherEnabled()
+
+
+'''
+Nombre: sendEthernetFrameV
+Descripcion: Version scatter-gather de sendEthernetFrame. En lugar de un unico payload recibe una lista de buffers
+    (cabeceras de los niveles superiores y memoryview del payload) que se envian, detras de la cabecera Ethernet, en
+    una unica llamada a sendmsg. Si el nivel Ethernet no esta en modo scatter-gather se concatenan y se envian con
+    sendEthernetFrame.
+Argumentos:
+    -buffers: lista de objetos bytes/bytearray/memoryview que forman el payload de la trama
+    -len: longitud total de los buffers expresada en bytes
+    -etherType: valor de tipo Ethernet a incluir en la trama
+    -dstMac: Direccion MAC destino a incluir en la trama que se enviara
+Retorno: 0 si todo es correcto, -1 en otro caso
+'''
+def sendEthernetFrameV(buffers,len,etherType,dstMac):
+
+    return defaultLevel.sendFrameV(buffers,len,etherType,dstMac)
+
+
+'''
+Nombre: sendEthernetFrames
+Descripcion: Esta funcion envia una rafaga de tramas Ethernet con una sola llamada al sistema (sendmmsg sobre el socket
+    de la interfaz). Si sendmmsg no esta disponible se envian una a una con pcap_inject. Cada trama se construye igual
+    que en sendEthernetFrame (cabecera, relleno a ETH_FRAME_MIN y comprobacion de ETH_FRAME_MAX).
+Argumentos:
+    -batch: lista de tuplas (data, len, etherType, dstMac) con los mismos campos que sendEthernetFrame. data puede ser
+        un objeto bytes o una lista de buffers que se concatenan al construir la trama
+Retorno: lista con un 0 por cada trama enviada correctamente y un -1 por cada trama que no se ha podido enviar
+'''
+def sendEthernetFrames(batch):
+
+    return defaultLevel.sendFrames(batch)
+
+
+'''
+Nombre: registerSharedState
+Descripcion: Esta funcion registra una funcion que se ejecutara en startFanout, antes de crear los procesos de captura,
+    con un multiprocessing.Manager como argumento. Los niveles superiores la usan para sustituir su estado (por ejemplo la
+    cache ARP) por objetos del gestor, de modo que el proceso principal y todos los procesos de captura vean el mismo.
+Argumentos:
+    -hook: funcion con el prototipo hook(manager)
+Retorno: Ninguno
+'''
+def registerSharedState(hook):
+
+    defaultLevel.registerSharedState(hook)
+
+
+'''
+Nombre: fanoutWorker
+Descripcion: Esta funcion es el cuerpo de cada proceso de captura del modo PACKET_FANOUT. Abre su propio anillo TPACKET_V3
+    unido al grupo de fanout, instala el filtro BPF, crea su propio motor de despacho y de transmision y procesa localmente
+    (con los manejadores ARP/IP/ICMP/UDP heredados del proceso principal) las tramas que el kernel le asigna.
+Argumentos:
+    -interface: nombre de la interfaz
+    -groupId: identificador del grupo PACKET_FANOUT
+    -conn: extremo de escritura de un multiprocessing.Pipe por el que se envia None cuando el anillo esta listo o el
+        texto del error si no se ha podido abrir (None => no se avisa)
+    -index: numero del proceso, clave con la que publica sus estadisticas cada FANOUT_STATS_INTERVAL segundos
+Retorno: Ninguno
+'''
+def fanoutWorker(interface, groupId, conn=None, index=0):
+
+    defaultLevel.fanoutWorker(interface, groupId, conn, index)
+
+
+'''
+Nombre: startFanout
+Descripcion: Esta funcion reparte la recepcion entre varios procesos para no estar limitados por el GIL. Se llama una vez
+    iniciados el nivel Ethernet y los niveles superiores (para que los procesos hereden sus manejadores):
+        -Ejecuta las funciones registradas con registerSharedState para compartir el estado entre procesos
+        -Para el hilo de recepcion del proceso principal, que a partir de ese momento solo envia (por un socket que no
+            recibe: el handle de pcap o el anillo se cierran)
+        -Crea processes procesos (fanoutWorker), cada uno con un socket unido al mismo grupo PACKET_FANOUT en modo hash,
+            de forma que todas las tramas de un flujo las procesa siempre el mismo proceso
+        -Espera (como mucho FANOUT_START_TIMEOUT segundos) a que cada proceso avise de que su anillo esta listo. Si alguno
+            falla se paran todos, el proceso principal vuelve a capturar y se devuelve -1
+Argumentos:
+    -interface: nombre de la interfaz sobre la que se inicio el nivel Ethernet
+    -processes: numero de procesos de captura
+Retorno: 0 si todo es correcto, -1 en otro caso
+'''
+def startFanout(interface, processes):
+
+    return defaultLevel.startFanout(interface, processes)
+
+
+'''
+Nombre: getEthernetStats
+Descripcion: Esta funcion devuelve las estadisticas del nivel Ethernet en este momento. Se puede llamar en cualquier
+    momento, tambien mientras se reciben tramas.
+Argumentos: Ninguno
+Retorno: diccionario con las claves:
+    -received: tramas que han llegado a process_Ethernet_frame
+    -kernelReceived, kernelDropped, ifDropped: tramas recibidas y descartadas por el kernel y por la interfaz (pcap_stats
+        o PACKET_STATISTICS)
+    -filteredMac: tramas descartadas por no ir dirigidas a nuestra MAC ni a broadcast
+    -filteredEthertype: tramas descartadas por no tener un Ethertype registrado
+    -ethertypes: diccionario Ethertype (entero) -> tramas recibidas con ese Ethertype
+    -vlans: diccionario VLAN ID -> tramas recibidas con etiquetas de esa VLAN (la interior en QinQ)
+    -queueDropped: tramas descartadas por el motor de despacho, por politica
+    En modo PACKET_FANOUT cada contador incluye los de los procesos de captura (con hasta FANOUT_STATS_INTERVAL
+    segundos de retraso).
+'''
+def getEthernetStats():
+
+    return defaultLevel.getStats()
+
+
+'''
+Nombre: formatEthernetStats
+Descripcion: Esta funcion devuelve una linea de texto con las estadisticas devueltas por getEthernetStats
+Argumentos:
+    -snap: diccionario devuelto por getEthernetStats
+Retorno: cadena de texto
+'''
+def formatEthernetStats(snap):
 
-    # Primero comprobar que la cabecera no va a ser de longitud mayor que la permitida
-
-    if len > ETH_FRAME_MAX:
-    	logging.debug('Se ha intentado crear una cabecera ethernet con longitud mayor de lo permitido: '+str(len)+".\nSiendo lo maximo: "+str(ETH_FRAME_MAX))
-    	return -1
-    # Si la trama ethernet no se pasa de tamanno la construyo
-    ethernetFrame = dstMac + macAddress + etherType + data
-    
-    len = len + 2 + 6 + 6
-
-    # print("manAddress: "+str(macAddress))
-    # print("dstMAC: "+str(dstMac))
-    # print("ethertype: "+str(etherType))
-    # print("data: "+str(data))
-    # print("ethernet frame: "+str(ethernetFrame))
-    # Si la trama es demasiado corta la relleno con ceros
-    
-    if len < ETH_FRAME_MIN:
-    	
-    	ethernetFrame = ethernetFrame + bytes([0]*(ETH_FRAME_MIN-len))
-    	len = ETH_FRAME_MIN
-    	# print("\n\nFRAME de puta madre: \n")
-    	# print(ethernetFrame)
-    	
-    # Por ultimo, llamo a pcap inject
-    pcap_inject(handle, ethernetFrame, len)
-
-    return 0
+    types = ' '.join(['0x{:04x}={}'.format(k, v) for k, v in sorted(snap['ethertypes'].items())])
+    drops = ' '.join(['{}={}'.format(k, v) for k, v in sorted(snap['queueDropped'].items())])
+    line = ('Ethernet: recibidas={} kernel(recibidas={} descartadas={}) interfaz(descartadas={}) filtradas(mac={} ethertype={}) colas({}) ethertypes({})'
+            .format(snap['received'], snap['kernelReceived'], snap['kernelDropped'], snap['ifDropped'], snap['filteredMac'],
+                    snap['filteredEthertype'], drops, types))
+    # Las VLAN solo se muestran si han llegado tramas con etiquetas
+    if snap.get('vlans'):
+        line += ' vlans(' + ' '.join(['{}={}'.format(k, v) for k, v in sorted(snap['vlans'].items())]) + ')'
+    return line
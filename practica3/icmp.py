@@ -1,4 +1,5 @@
 import time
+import functools
 
 from ip import *
 from threading import Lock
@@ -6,7 +7,8 @@ import struct
 import logging
 
 
-from ip import registerIPProtocol, chksum, sendIPDatagram
+from ip import registerIPProtocol, chksum, chksumV, sendIPDatagram, defaultIP
+from packet import Packet
 
 ICMP_PROTO = 1
 
@@ -41,21 +43,25 @@ icmp_send_times = {}
     Argumentos:
         -us: son los datos de usuarios pasados por pcap_loop (en nuestro caso este valor será siempre None)
         -header: estructura pcap_pkthdr que contiene los campos len, caplen y ts.
-        -data: array de bytes con el conenido del mensaje ICMP
+        -data: array de bytes (o vista Packet, ver packet.py) con el conenido del mensaje ICMP
         -srcIP: dirección IP que ha enviado el datagrama actual.
+        -ipLevel: nivel IP (IPLevel) por el que ha llegado el mensaje y por el que sale la respuesta (None => defaultIP)
     Retorno: Ninguno
 
 '''
-def process_ICMP_message(us,header,data,srcIp):
-    # if chksum(data) != 0:
+def process_ICMP_message(us,header,data,srcIp,ipLevel=None):
+    # Vista de la trama (ver packet.py): la cabecera ICMP se decodifica una sola vez
+    pkt = Packet.of(data)
+    pkt.l4 = pkt.off
+    # if chksum(pkt) != 0:
     #    logging.debug("[ERROR] process_ICMP_message ha calculado un checksum distinto de 0")
     #    return
 
-    tipo = data[0]
-    codigo = data[1]
+    tipo, codigo, checksum, icmp_id, icmp_seqnum = pkt.icmpHeader
 
-    logging.debug("Tipo: "+str(tipo))
-    logging.debug("Codigo: " + str(codigo))
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug("Tipo: "+str(tipo))
+        logging.debug("Codigo: " + str(codigo))
 
     if tipo == ICMP_ECHO_REQUEST_TYPE:
         # Enviamos un reply
@@ -70,7 +76,7 @@ def process_ICMP_message(us,header,data,srcIp):
         # print("DESTINO: ")
         # print(struct.unpack('!I',srcIp))
         # print((struct.unpack('!I',srcIp)[0]).to_bytes(4, byteorder='big'))
-        sendICMPMessage(data,ICMP_ECHO_REPLY_TYPE,0,struct.unpack('!h',data[4:6])[0],struct.unpack('!h',data[6:8])[0],struct.unpack('!I',srcIp)[0])
+        sendICMPMessage(pkt.payload(),ICMP_ECHO_REPLY_TYPE,0,icmp_id,icmp_seqnum,struct.unpack('!I',srcIp)[0],ipLevel)
 
     elif tipo == ICMP_ECHO_REPLY_TYPE:
         with timeLock:
@@ -79,7 +85,7 @@ def process_ICMP_message(us,header,data,srcIp):
         	# print(struct.unpack('!h',data[4:6])[0])
         	# print(struct.unpack('!h',data[6:8])[0])
         	# print("\n\n\n")
-        	tiempo_dict = icmp_send_times[struct.unpack('!I',srcIp)[0]+struct.unpack('!h',data[4:6])[0]+struct.unpack('!h',data[6:8])[0]]
+        	tiempo_dict = icmp_send_times[struct.unpack('!I',srcIp)[0]+icmp_id+icmp_seqnum]
 
         # print(header.ts.tv_sec)
         # print(tiempo_dict)
@@ -116,10 +122,14 @@ def process_ICMP_message(us,header,data,srcIp):
         -icmp_id: entero que contiene el valor del campo ID de ICMP a enviar
         -icmp_seqnum: entero que contiene el valor del campo Seqnum de ICMP a enviar
         -dstIP: entero de 32 bits con la IP destino del mensaje ICMP
-    Retorno: True o False en función de si se ha enviado el mensaje correctamente o no
+        -ipLevel: nivel IP (IPLevel) por el que se envia el mensaje (None => defaultIP)
+    Retorno: True o False en función de si se ha enviado el mensaje correctamente o no (el resultado de sendIPDatagram, tanto en modo scatter-gather como copiando los datos)
 
 '''
-def sendICMPMessage(data,type,code,icmp_id,icmp_seqnum,dstIP):
+def sendICMPMessage(data,type,code,icmp_id,icmp_seqnum,dstIP,ipLevel=None):
+
+    if ipLevel is None:
+        ipLevel = defaultIP
 
     # header[0] = type
     # header[1] = code
@@ -134,6 +144,14 @@ def sendICMPMessage(data,type,code,icmp_id,icmp_seqnum,dstIP):
     header += icmp_id.to_bytes(2, byteorder='big') 
     header += icmp_seqnum.to_bytes(2, byteorder='big')
 
+    # En modo scatter-gather la cabecera y los datos bajan por separado, sin copiar los datos
+    if ipLevel.eth.scatterGatherEnabled():
+        header[2:4] = struct.pack('!H',chksumV([header,data]))
+        if type == ICMP_ECHO_REQUEST_TYPE:
+            with timeLock:
+                icmp_send_times[dstIP+icmp_id+icmp_seqnum] = time.time()
+        return ipLevel.sendIPDatagram(dstIP, [header, memoryview(data)], 1)
+
     datagram = bytes()
     datagram += header
     datagram += data
@@ -152,9 +170,7 @@ def sendICMPMessage(data,type,code,icmp_id,icmp_seqnum,dstIP):
 
     # print(datagram)
 
-    sendIPDatagram(dstIP, datagram, 1)  # protocol = 1 porque es icmp
-  
-    return
+    return ipLevel.sendIPDatagram(dstIP, datagram, 1)  # protocol = 1 porque es icmp
 
 
 '''
@@ -164,9 +180,30 @@ def sendICMPMessage(data,type,code,icmp_id,icmp_seqnum,dstIP):
         -Registrar (llamando a registerIPProtocol) la función process_ICMP_message con el valor de protocolo 1
 
     Argumentos:
-        -Ninguno
+        -ipLevel: nivel IP (IPLevel) en el que se registra (None => defaultIP). Las respuestas salen por ese mismo nivel
+    Retorno: Ninguno
+
+'''
+def initICMP(ipLevel=None):
+    if ipLevel is None:
+        ipLevel = defaultIP
+    ipLevel.registerIPProtocol(functools.partial(process_ICMP_message, ipLevel=ipLevel), 1)
+    ipLevel.eth.registerSharedState(shareICMPState)
+
+
+'''
+    Nombre: shareICMPState
+    Descripción: Esta función se registra en el nivel Ethernet (registerSharedState) y sustituye el diccionario icmp_send_times
+    por uno del gestor que recibe, para que los procesos de captura del modo PACKET_FANOUT puedan calcular el RTT de los
+    ECHO_REPLY de los mensajes enviados desde el proceso principal.
+
+    Argumentos:
+        -manager: multiprocessing.Manager creado por startFanout
     Retorno: Ninguno
 
 '''
-def initICMP():
-    registerIPProtocol(process_ICMP_message, 1)
\ No newline at end of file
+def shareICMPState(manager):
+    global icmp_send_times
+    with timeLock:
+        shared = manager.dict(icmp_send_times)
+        icmp_send_times = shared
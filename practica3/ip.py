@@ -8,14 +8,12 @@ import functools
 import logging
 from arp import *
 from ethernet import *
+from packet import Packet
 from fcntl import ioctl
 import subprocess
 
 SIOCGIFMTU = 0x8921
 SIOCGIFNETMASK = 0x891b
-#Diccionario de protocolos. Las claves con los valores numéricos de protocolos de nivel superior a IP
-#por ejemplo (1, 6 o 17) y los valores son los nombres de las funciones de callback a ejecutar.
-protocols={}
 #Valor inicial para el IPID
 IPID = 0
 #Valor de ToS por defecto
@@ -50,6 +48,25 @@ def chksum(msg):
 
     return s
 
+def chksumV(buffers):
+    '''
+        Nombre: chksumV
+        Descripción: Esta función calcula el mismo checksum que chksum sobre la concatenación de una lista de buffers, sin
+            concatenarlos. Todos los buffers salvo el último deben tener longitud par (como las cabeceras ICMP/UDP).
+        Argumentos:
+            -buffers: lista de objetos bytes/bytearray/memoryview
+        Retorno: Entero de 16 bits con el resultado del checksum en ORDEN DE RED
+    '''
+    s = 0
+    for b in buffers:
+        m = memoryview(b).cast('B')
+        # Bytes pares en la parte baja y bytes impares en la alta, igual que en chksum
+        s += sum(m[0::2]) + (sum(m[1::2]) << 8)
+    s = s + (s >> 16)
+    s = ~s & 0xffff
+
+    return s
+
 def getMTU(interface):
     '''
         Nombre: getMTU
@@ -98,6 +115,214 @@ def getDefaultGW(interface):
     return struct.unpack('!I',socket.inet_aton(dfw))[0]
 
 
+'''
+Clase que implementa el nivel IP sobre un nivel Ethernet (eth) y su nivel ARP (arp, si no se indica se crea uno sobre
+eth). Guarda la IP propia, la MTU, la mascara, el gateway, las opciones y los protocolos registrados, que antes eran
+globales del modulo, de modo que cada interfaz tiene su propio nivel IP y los datagramas salen por la interfaz del
+nivel. Las funciones del modulo (initIP, registerIPProtocol, sendIPDatagram...) trabajan sobre defaultIP.
+Cada metodo hace lo mismo que la funcion del modulo del mismo nombre (init es initIP, ver su descripcion mas adelante).
+'''
+class IPLevel():
+
+    def __init__(self, eth, arp=None):
+        self.eth = eth
+        self.arp = arp if arp is not None else ARPLevel(eth)
+        #Diccionario de protocolos. Las claves con los valores numéricos de protocolos de nivel superior a IP
+        #por ejemplo (1, 6 o 17) y los valores son los nombres de las funciones de callback a ejecutar.
+        self.protocols = {}
+        #IP propia, MTU, mascara de red y gateway por defecto (enteros) y opciones IP (bytes o None)
+        self.myIP = None
+        self.MTU = None
+        self.netmask = None
+        self.defaultGW = None
+        self.ipOpts = None
+
+    def process_IP_datagram(self,us,header,data,srcMac):
+
+        # Vista de la trama (ver packet.py): la cabecera IP se decodifica una vez, con un solo unpack_from, y el resto de
+        # niveles reciben la misma vista
+        pkt = Packet.of(data)
+        pkt.l3 = pkt.off
+
+        # Todos los campos de la cabecera fija salen de la misma tupla (ver IP_HDR en packet.py)
+        verIhl, ToService, totalLength, identification, flagsOffset, TtoLive, protocol, HChecksum, ipSrc, ipdestino = pkt.ipHeader
+
+        # version => 4 primeros bits => XXXX----
+        version = verIhl >> 4
+
+        # ihl => 4 ultimos bits => ----XXXX (en palabras de 4 bytes)
+        ihl = (verIhl & 0x0F) * 4
+
+        # Los 3 primeros bits del septimo byte. Nos interesan el bit 2 y 3 porque el primero esta reservado y es igual a 0
+        DF = (flagsOffset >> 14) & 0x01
+        MF = (flagsOffset >> 13) & 0x01
+
+        # Offset es el resto del septimo byte y el octavo => ---X XXXX 
+        offset = flagsOffset & 0x1F
+
+        # IP origen como 4 bytes para el nivel superior
+        iporigen = pkt.ipSrcAddr
+
+        # Faltan por extraer las opciones y el padding que vienen a continuacion
+
+        checksum = chksum(pkt[:ihl])
+
+        # si el checksum no es 0 retornamos
+        # if checksum != 0:
+        #    return
+
+        # Si el offset no es 0 retornamos
+        if offset != 0:
+            return
+
+        # Realizacion del logueado de los campos pedidos (solo se construyen los mensajes si el nivel DEBUG esta activo)
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("Cabecera IP: "+str(ihl))
+            logging.debug("IPID: "+str(identification))
+            logging.debug("DF flag: "+str(DF))
+            logging.debug("MF flaf: "+str(MF))
+            logging.debug("offset: "+str(offset))
+            logging.debug("IP Origen: "+socket.inet_ntoa(struct.pack('!I', ipSrc)))
+            logging.debug("IP Destino: "+socket.inet_ntoa(struct.pack('!I', ipdestino)))
+            if protocol  == 1:
+                logging.debug("Protocolo: ICMP")
+            if protocol == 6:
+                logging.debug("Protocolo: IP")
+            if protocol == 17:
+                logging.debug("Protocolo: UDP")
+
+
+        if not protocol in self.protocols:
+            logging.debug("No se ha encontrado un protocolo en el diccionario")
+            return
+
+        func = self.protocols[protocol]
+
+        # Llamamos a la funcion pasandole el payload: la misma vista, colocada despues de la cabecera IP
+        pkt.l4 = pkt.off = pkt.l3 + ihl
+        func(us, header, pkt, iporigen)
+
+    def registerIPProtocol(self,callback,protocol):
+
+        self.protocols[protocol] = callback
+
+    def init(self,interface,opts=None):
+
+        # Llamamos a initARP
+        self.arp.init(interface)
+
+        # Almacenamos la informacion en el nivel. Si el nivel Ethernet esta sobre un enlace se toma de su configuracion
+        link = self.eth.link
+        if link is not None:
+            self.myIP = link.ip
+            self.MTU = link.mtu
+            self.netmask = link.netmask
+            self.defaultGW = link.gateway
+        else:
+            self.myIP = getIP(interface)
+            self.MTU = getMTU(interface)
+            self.netmask = getNetmask(interface)
+            self.defaultGW = getDefaultGW(interface)
+        self.ipOpts = opts
+
+        # Registramos el nivel Ethernet
+        self.eth.registerCallback(self.process_IP_datagram,bytes([0x08,0x00]))
+
+    def sendIPDatagram(self,dstIP,data,protocol):
+
+        if self.ipOpts is not None:
+            ipHeaderLenght = IP_MIN_HLEN + len(self.ipOpts)
+        else:
+            ipHeaderLenght = IP_MIN_HLEN
+
+        if ipHeaderLenght > IP_MAX_HLEN:
+            logging.debug("ERROR, la cabecerea IP es demasiado grande")
+            return False
+
+        # El payload no se junta: cada fragmento es una lista de memoryview sobre los buffers recibidos
+        scatter = self.eth.scatterGatherEnabled()
+        if isinstance(data, list):
+            buffers = data
+        else:
+            buffers = [data]
+        dataLength = sum(len(b) for b in buffers)
+
+        #####################################################################################
+        ########################Calculamos el numero de paquetes#############################
+        #####################################################################################
+
+        # Los fragmentos se ajustan a la MTU de la interfaz (o del enlace, ver init). 1500 si aun no se conoce
+        maxPayloadLenght = (self.MTU or 1500) - ipHeaderLenght
+        maxPayloadLenght -= maxPayloadLenght % 8
+
+        numPackages = (dataLength // maxPayloadLenght) # El numero de paquetes es la division entera
+        if dataLength % maxPayloadLenght != 0:
+            numPackages += 1 # Si el resto no es 0 tengo que enviar otro paquete con el resto de la informacion
+        logging.debug("Numero de fragmentos: "+str(numPackages))
+
+        # Calculamos la MAC de destino (una sola vez para todos los fragmentos)
+        if (self.myIP & self.netmask) == (dstIP & self.netmask):
+            dstMAC = self.arp.ARPResolution(dstIP)
+        else:
+            dstMAC = self.arp.ARPResolution(self.defaultGW)
+        if dstMAC is None:
+            logging.debug("No se ha podido resolver la MAC de destino")
+            return False
+
+        #####################################################################################
+        ########################Creamos y enviamos los paquetes##############################
+        #####################################################################################
+        frames = []
+        for i in range(numPackages):
+            start = i * maxPayloadLenght
+            end = min(start + maxPayloadLenght, dataLength)
+            # Offset en unidades de 8 bytes y flag MF en todos los fragmentos menos el ultimo
+            flagsOffset = start // 8
+            if i < numPackages - 1:
+                flagsOffset |= 0x2000
+            header = self.createIPHeader(ipHeaderLenght, ipHeaderLenght + end - start, flagsOffset, protocol, dstIP)
+            # Cada fragmento es la cabecera IP mas un trozo (sin copiar) de los datos
+            frames.append(([header] + sliceBuffers(buffers, start, end), ipHeaderLenght + end - start, bytes([0x08,0x00]), dstMAC))
+
+        # En modo scatter-gather cada fragmento se envia con su propio sendmsg sin copiar los datos.
+        # Si no, todos los fragmentos se envian en una unica rafaga (sendmmsg)
+        if scatter:
+            for fragment in frames:
+                if self.eth.sendFrameV(*fragment) != 0:
+                    return False
+            return True
+
+        return all(ret == 0 for ret in self.eth.sendFrames(frames))
+
+    def createIPHeader(self,ipHeaderLenght,totalLength,flagsOffset,protocol,dstIP):
+
+        header = bytearray(ipHeaderLenght)
+        # Primer byte. version y la longitud total de la cabecera
+        header[0] = 0x40 + ipHeaderLenght//4
+        # Segundo byte. Tipo de servicio
+        header[1] = DEFAULT_TOS
+        header[2:4] = totalLength.to_bytes(2, byteorder='big')
+        # Quinto y sexto la identificacion
+        header[4:6] = bytes([0x12,0x34])
+        header[6:8] = flagsOffset.to_bytes(2, byteorder='big')
+        # noveno byte en TTL. Por defecto es 64
+        header[8] = DEFAULT_TTL
+        # Decimo byte el protocolo
+        header[9] = protocol
+        # IPs origen y destino
+        header[12:16] = self.myIP.to_bytes(4, byteorder='big')
+        header[16:20] = dstIP.to_bytes(4, byteorder='big')
+        # Si hay ipOpts lo añadimos
+        if self.ipOpts is not None:
+            header[20:] = self.ipOpts
+        header[10:12] = struct.pack('!H',chksum(header))
+        return header
+
+
+#Nivel IP sobre el que trabajan las funciones del modulo (sobre el nivel Ethernet y el nivel ARP por defecto)
+defaultIP = IPLevel(defaultLevel, defaultARP)
+
+
 '''
     Nombre: process_IP_datagram
     Descripción: Esta función procesa datagramas IP recibidos.
@@ -122,109 +347,13 @@ def getDefaultGW(interface):
     Argumentos:
         -us: Datos de usuario pasados desde la llamada de pcap_loop. En nuestro caso será None
         -header: cabecera pcap_pktheader
-        -data: array de bytes con el contenido del datagrama IP
+        -data: array de bytes (o vista Packet, ver packet.py) con el contenido del datagrama IP
         -srcMac: MAC origen de la trama Ethernet que se ha recibido
     Retorno: Ninguno
 '''
 def process_IP_datagram(us,header,data,srcMac):
 
-    data = bytes(data)
-
-    # version => 4 primeros bits => XXXX----
-    version = data[0] >> 0x04 # Lo desplazo 4 bytes
-    # print("VERSION: "+str(version))
-
-    # ihl => 4 ultimos bytes => ----XXXX
-    ihl = data[0] & 0x0F # aplico mascara 0000 1111 (0x0f)
-    ihl = ihl*4
-    # print("ihl: "+str(ihl))
-    # TOService es el segundo byte
-    ToService = data[1]
-    # print("type of service: "+str(ToService))
-    # Total lenght son el tercer y cuarto byte
-    totalLength = data[2:4]
-    # print("Total lenght: "+str(totalLength[0]) +" "+str(totalLength[1]))
-
-    # Identification son el quinto y sexto byte
-    identification = data[4:6]
-    # print("Identification: "+str(identification[0]) +" "+str(identification[1]))
-    # Los 3 primeros bits del septimo byte. Realizamos desplazamiento despues de aplicar la mascara correspondiente
-    # Nos interesan el bit 2 y 3 porque el primero esta reservado y es igual a 0
-    DF = data[6] & 0x40 # -X-- ---- de data[7]
-    DF = DF >> 6 # desplazo 6 a la izquierda => ---- ---X>
-    MF = data[6] & 0x20 # --X- ---- de data[7]
-    MF = MF >> 5 # desplazo 5 a la izquierda => ---- ---X>
-    # print("DF: "+str(DF))
-    # print("MF: "+str(MF))
-
-    # Offset es el resto del septimo byte y el octavo => ---X XXXX 
-    offset=int(binascii.hexlify(data[6:8]),16) & 0x1F
-
-    print("\n\n\n")
-    print(offset)
-    print("\n\n\n")
-    # print("offset: "+str(offset))
-    # time to live es el noveno byte
-    TtoLive = data[8]
-    # print("Time to live: "+str(TtoLive))
-
-    # protocol es el decimo byte
-    protocol = data[9]
-    # print("protocol "+str(protocol))
-
-    # Header Checksum son los bytes 11 y 12
-    HChecksum = data[10:12]
-    # print("Checksum de su pùta madre: "+str(HChecksum))
-
-    # Las direcciones ip origen y destino ocupan 4 bytes y vienen a continuacion
-    iporigen = data[12:16]
-    # print("IP ORIGEN: "+str(iporigen[0]) + " " +str(iporigen[1]) + " "+str(iporigen[2]) + " "+str(iporigen[3]) + " ")
-    ipdestino = data[16:20]
-    # print("IP DESTINO: "+str(ipdestino[0]) + " " +str(ipdestino[1]) + " "+str(ipdestino[2]) + " "+str(ipdestino[3]) + " ")
-
-    # Faltan por extraer las opciones y el padding que vienen a continuacion
-
-    # print(data[:ihl])
-    checksum = chksum(data[:ihl])
-    # print(checksum)
-    # print(HChecksum)
-
-    # si el checksum no es 0 retornamos
-    # if checksum != 0:
-    #    print("MI POLLA")
-    #    return
-
-    # Si el offset no es 0 retornamos
-    if offset != 0:
-        return
-
-    # Realizacion del logueado de los campos pedidos
-    logging.debug("Cabecera IP: "+str(ihl))
-    logging.debug("IPID: "+str(identification))
-    logging.debug("DF flag: "+str(DF))
-    logging.debug("MF flaf: "+str(MF))
-    logging.debug("offset: "+str(offset))
-    logging.debug("IP Origen: "+str(iporigen))
-    logging.debug("IP Destino: "+str(ipdestino))
-    if protocol  == 1:
-        logging.debug("Protocolo: ICMP")
-    if protocol == 6:
-        logging.debug("Protocolo: IP")
-    if protocol == 17:
-        logging.debug("Protocolo: UDP")
-
-
-    if not protocol in protocols:
-        logging.debug("No se ha encontrado un protocolo en el diccionario")
-        return
-
-    func = protocols[protocol]
-
-    # Llamamos a la funcion pasandole el payload
-    # print(data)
-    payload = data[ihl:]
-    # print(payload)
-    func(us, header, payload, iporigen)
+    defaultIP.process_IP_datagram(us,header,data,srcMac)
 
 
 '''
@@ -242,14 +371,16 @@ def process_IP_datagram(us,header,data,srcMac):
                     -us: son los datos de usuarios pasados por pcap_loop (en nuestro caso este valor será siempre None)
                     -header: estructura pcap_pkthdr que contiene los campos len, caplen y ts.
                     -data: payload del datagrama IP. Es decir, la cabecera IP NUNCA se pasa hacia arriba.
-                    -srcIP: dirección IP que ha enviado el datagrama actual.
+                        Es una vista Packet (ver packet.py) colocada en el payload, con la cabecera IP ya decodificada:
+                        se usa como el payload en bytes y, si se quiere guardar, hay que copiarlo con bytes().
+                    -srcIP: dirección IP que ha enviado el datagrama actual (4 bytes, una memoryview de la trama).
                 La función no retornará nada. Si un datagrama se quiere descartar basta con hacer un return sin valor y dejará de procesarse.
             -protocol: valor del campo protocolo de IP para el cuál se quiere registrar una función de callback.
         Retorno: Ninguno 
     '''
 def registerIPProtocol(callback,protocol):
     
-    protocols[protocol] = callback
+    defaultIP.registerIPProtocol(callback,protocol)
 
 '''
         Nombre: initIP
@@ -268,20 +399,8 @@ def registerIPProtocol(callback,protocol):
         Retorno: True o False en función de si se ha inicializado el nivel o no
     '''
 def initIP(interface,opts=None):
-    global myIP, MTU, netmask, defaultGW,ipOpts
-
-    # Llamamos a initARP
-    initARP(interface)
 
-    # Almacenamos la informacion en las variables globales
-    myIP = getIP(interface)
-    MTU = getMTU(interface)
-    netmask = getNetmask(interface)
-    defaultGW = getDefaultGW(interface)
-    ipOpts = opts
-
-    # Registramos el nivel Ethernet
-    registerCallback(process_IP_datagram,bytes([0x08,0x00]))
+    return defaultIP.init(interface,opts)
     
 '''
         Nombre: sendIPDatagram
@@ -304,151 +423,51 @@ def initIP(interface,opts=None):
                 -Incrementar la variable IPID en 1.
         Argumentos:
             -dstIP: entero de 32 bits con la IP destino del datagrama 
-            -data: array de bytes con los datos a incluir como payload en el datagrama
+            -data: array de bytes con los datos a incluir como payload en el datagrama, o lista de buffers (cabecera del
+            nivel superior y payload) si se quiere usar el envío scatter-gather del nivel Ethernet
             -protocol: valor numérico del campo IP protocolo que indica el protocolo de nivel superior de los datos
             contenidos en el payload. Por ejemplo 1, 6 o 17.
         Retorno: True o False en función de si se ha enviado el datagrama correctamente o no
           
     '''
 def sendIPDatagram(dstIP,data,protocol):
-    global IPID
-    
-    
-
-    if ipOpts is not None:
-        ipHeaderLenght = IP_MIN_HLEN + len(ipOpts)
-    else:
-        ipHeaderLenght = IP_MIN_HLEN
-
-    if ipHeaderLenght > IP_MAX_HLEN:
-        logging.debug("ERROR, la cabecerea IP es demasiado grande")
-        return Falseindiceopts
-     
-    
-
-    #####################################################################################
-    ########################Calculamos el numero de paquetes#############################
-    #####################################################################################
-
-
-    maxPayloadLenght = 1500 - ipHeaderLenght
-    
-    while (maxPayloadLenght % 8) != 0:
-        maxPayloadLenght -= 1
-
-
-    numPackages = (len(data) // maxPayloadLenght) # El numero de paquetes es la division entera
-    if len(data) % maxPayloadLenght is not 0:
-        numPackages += 1 # Si el resto no es 0 tengo que enviar otro paquete con el resto de la informacion
-
-    i = 0
-    print("NUMERO DE PAQUETES DE LOS COJONES: "+str(numPackages))
-
-    #####################################################################################
-    ########################Creamos y enviamos los paquetes##############################
-    #####################################################################################
-    while i < numPackages:
-        # Me da igual que el programa sea mas ineficiente o lo que pollas pase, no voy a optimizar esto
-
-        header = bytearray()
-        # Construimos lo que falta de la cabecera IP
-        # Comprobaciones si es el ultimo paquete
-        if i == (numPackages-1):
-            # Primer byte. version y la longitud total de la cabecera  
-            header += ((0x40)+(ipHeaderLenght//4)).to_bytes(1, byteorder='big')
-            # Segundo byte. Siempre 0
-            header += (0).to_bytes(1, byteorder='big')
-            # Su longitud será lo que no hemos enviado del data mas la longitud del header
-            header += ((len(data) - (maxPayloadLenght * (numPackages-1))) + ipHeaderLenght).to_bytes(2, byteorder='big')
-            # Quinto y sexto la identificacion
-            header += bytes([0x12,0x34])
-            # Ponemos a 0 los flags y el puto offser ATENTO A ESTO OSTIA PUTA QUE VAS A TENER QUE CAMBIARLO, NO ME SEAS PUTO SUBNORMAL
-            # Si solo hay un paquete todo a 0
-            if numPackages == 1:
-                header += b'\x00\x00' #Por defecto 0
-            # Si no, se trata del ultimo paquete. Los flags a 0, pero hay un offset
-            else: 
-                offset = (i * maxPayloadLenght)//8
-                print(offset.to_bytes(2, byteorder='big'))
-                # los flags son 001
-                header += offset.to_bytes(2, byteorder='big')
-            # noveno byte en TTL. Por defecto es 64
-            header += (64).to_bytes(1, byteorder='big')
-            # Decimo byte el protocolo
-            header += protocol.to_bytes(1, byteorder='big')
-            # Calculamos el checksum y lo añadimos
-            header += b'\x00\x00' #Por defecto 0
-            # IPs origen y destino
-            # TODO revisar el pack
-            header +=  myIP.to_bytes(4, byteorder='big')
-            header += dstIP.to_bytes(4, byteorder='big')
-            # Si hay ipOpts lo añadimos
-            if ipOpts is not None:
-                header += ipOpts
-            checksum = chksum(header)
-            # print(struct.pack('!H',checksum))
-            header[10:12] = struct.pack('!H',checksum)
-        else:
-            # Primer byte. version y la longitud total de la cabecera  
-            header += ((0x40)+(ipHeaderLenght//4)).to_bytes(1, byteorder='big')
-            # Segundo byte. Siempre 0
-            header += (0).to_bytes(1, byteorder='big')
-            # Su longitud será lo que no hemos enviado del data mas la longitud del header
-            header += (maxPayloadLenght + ipHeaderLenght).to_bytes(2, byteorder='big')
-            # Quinto y sexto la identificacion
-            header += bytes([0x12,0x34])
-            # if i == (numPackages):
-            #    header += ((i * maxPayloadLenght) // 8).to_bytes(2, byteorder='big')
-            # else:
-            #    header += (32 + ((i * maxPayloadLenght) // 8)).to_bytes(2, byteorder='big')
-            # Ponemos a 0 los flags y el puto offset ATENTO A ESTO OSTIA PUTA QUE VAS A TENER QUE CAMBIARLO, NO ME SEAS PUTO SUBNORMAL
-            # El offset en este caso siempre va a ser esto
-            offset = (i * maxPayloadLenght)//8
-            # los flags son 001
-            flags = b'\x20\x00'
-
-            header += flags + offset.to_bytes(2, byteorder='big')
-            # noveno byte en TTL. Por defecto es 64
-            header += (64).to_bytes(1, byteorder='big')
-            # Decimo byte el protocolo
-            header += protocol.to_bytes(1, byteorder='big')
-            # Calculamos el checksum y lo añadimos
-            header += b'\x00\x00' #Por defecto 0
-            # IPs origen y destino
-            # TODO revisar el pack
-            header +=  myIP.to_bytes(4, byteorder='big')
-            header += dstIP.to_bytes(4, byteorder='big')
-            
-            # Si hay ipOpts lo añadimos
-            if ipOpts is not None:
-                header += ipOpts
-            checksum = chksum(header)
-            # print(struct.pack('!H',checksum))
-            header[10:12] = struct.pack('!H',checksum)
-        # Añadimos los datos del payload al datagrama final
-        datagram = bytearray()
-        datagram += header
-        if numPackages == 1:
-            print("yeah")
-            datagram += data
-        elif i == (numPackages):
-            datagram += data[i * maxPayloadLenght :]
-        else:
-            datagram += data[i * maxPayloadLenght : (i+1) * maxPayloadLenght]
-        
-        # Calculamos la MAC de destino
-        if (myIP & netmask) == (dstIP & netmask):
-            dstMAC = ARPResolution(dstIP)
-        else:
-            dstMAC = ARPResolution(defaultGW)
-            print("HERE WE ARE :)")
-        # Enviamos el datagrama con sendEthernetFrame
-        # print(datagram)
-        sendEthernetFrame(datagram, len(datagram), bytes([0x08,0x00]),dstMAC)
-        i += 1
-
 
-    
+    return defaultIP.sendIPDatagram(dstIP,data,protocol)
 
+'''
+        Nombre: createIPHeader
+        Descripción: Esta función construye la cabecera IP (incluidas las opciones ipOpts y el checksum) de un datagrama o fragmento.
+        Argumentos:
+            -ipHeaderLenght: longitud de la cabecera IP en bytes
+            -totalLength: longitud total del datagrama o fragmento (cabecera + datos)
+            -flagsOffset: entero de 16 bits con las banderas (DF/MF) y el offset en unidades de 8 bytes
+            -protocol: valor del campo protocolo
+            -dstIP: entero de 32 bits con la IP destino
+        Retorno: bytearray con la cabecera IP
+    '''
+def createIPHeader(ipHeaderLenght,totalLength,flagsOffset,protocol,dstIP):
 
+    return defaultIP.createIPHeader(ipHeaderLenght,totalLength,flagsOffset,protocol,dstIP)
 
+'''
+        Nombre: sliceBuffers
+        Descripción: Esta función devuelve, sin copiar datos, los trozos de una lista de buffers que corresponden al rango
+            [start, end) de su concatenación.
+        Argumentos:
+            -buffers: lista de objetos bytes/bytearray/memoryview
+            -start: posición inicial dentro de la concatenación
+            -end: posición final (no incluida)
+        Retorno: lista de memoryview
+    '''
+def sliceBuffers(buffers,start,end):
+
+    pieces = []
+    pos = 0
+    for b in buffers:
+        n = len(b)
+        if pos + n > start and pos < end:
+            pieces.append(memoryview(b)[max(start - pos, 0):min(end - pos, n)])
+        pos += n
+        if pos >= end:
+            break
+    return pieces
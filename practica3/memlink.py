@@ -0,0 +1,185 @@
+'''
+    memlink.py
+    Backend de enlace en memoria. Sustituye a la interfaz de red (pcap o TPACKET_V3) por colas dentro del propio proceso,
+    de modo que varias pilas (EthernetLevel + IPLevel) se pueden conectar entre si y ejecutar todo el camino
+    ARP/IP/ICMP/UDP sin privilegios ni interfaces reales. El segmento (memorySwitch) entrega cada trama a los puertos
+    cuya MAC es la destino (o a todos si es broadcast) con la perdida y el retardo configurados.
+'''
+
+from rc1_pcap import pcap_pkthdr, timeval
+import heapq
+import random
+import socket
+import struct
+import threading
+import time
+
+#Direccion de difusion (Broadcast)
+BROADCAST = bytes([0xFF]*6)
+#Tramas que puede tener en cola cada puerto (las que no caben se descartan)
+LINK_QUEUE_SIZE = 4096
+#MTU por defecto de los puertos
+LINK_MTU = 1500
+#Segundos que espera loop como mucho sin tramas antes de volver a comprobar si se ha llamado a breakloop
+LINK_POLL_TIMEOUT = 0.1
+
+'''
+Nombre: macAddr
+Descripcion: Esta funcion convierte una direccion MAC en texto ('02:00:00:00:00:01') a bytes. Si ya son bytes los devuelve tal cual
+'''
+def macAddr(mac):
+    if isinstance(mac, str):
+        return bytes.fromhex(mac.replace(':', '').replace('-', ''))
+    return bytes(mac)
+
+'''
+Nombre: ipAddr
+Descripcion: Esta funcion convierte una direccion IP en texto ('10.0.0.1') a entero de 32 bits. Si ya es un entero lo devuelve tal cual
+'''
+def ipAddr(ip):
+    if isinstance(ip, str):
+        return struct.unpack('!I', socket.inet_aton(ip))[0]
+    return ip
+
+
+'''
+Clase que implementa un segmento de red en memoria al que se conectan los puertos (memoryLink) con attach. Cada trama
+enviada por un puerto se entrega a los demas puertos cuya MAC coincide con la destino, a todos si es broadcast y
+siempre a los puertos en modo promiscuo. En cada entrega:
+    -loss: probabilidad (0 a 1) de que la trama se pierda
+    -delay: segundos que tarda la trama en estar disponible en el puerto destino
+    -jitter: segundos maximos (aleatorios, uniformes) que se suman a delay. Con jitter las tramas se pueden reordenar
+Los valores del segmento se aplican a los puertos que no indiquen los suyos en attach. Con seed la secuencia de
+perdidas y retardos es siempre la misma, para poder repetir las medidas.
+'''
+class memorySwitch():
+
+    def __init__(self, loss=0.0, delay=0.0, jitter=0.0, seed=None, queueSize=LINK_QUEUE_SIZE):
+        self.loss = loss
+        self.delay = delay
+        self.jitter = jitter
+        self.queueSize = queueSize
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.ports = []
+
+    def attach(self, name, mac, ip=0, netmask=0, gateway=0, mtu=LINK_MTU, loss=None, delay=None, jitter=None, promisc=False):
+        link = memoryLink(self, name, macAddr(mac), ipAddr(ip), ipAddr(netmask), ipAddr(gateway), mtu,
+                          self.loss if loss is None else loss, self.delay if delay is None else delay,
+                          self.jitter if jitter is None else jitter, promisc)
+        with self.lock:
+            self.ports.append(link)
+        return link
+
+    def detach(self, link):
+        with self.lock:
+            if link in self.ports:
+                self.ports.remove(link)
+
+    def deliver(self, src, frame):
+        dst = frame[0:6]
+        now = time.monotonic()
+        with self.lock:
+            for port in self.ports:
+                if port is src or not (port.promisc or dst == port.mac or dst == BROADCAST):
+                    continue
+                if port.loss > 0 and self.random.random() < port.loss:
+                    port.lost += 1
+                    continue
+                due = now + port.delay
+                if port.jitter > 0:
+                    due += self.random.uniform(0, port.jitter)
+                port.enqueue(due, frame)
+
+
+'''
+Clase que implementa un puerto del segmento en memoria. Tiene la configuracion de la "interfaz" (name, mac, ip,
+netmask, gateway y mtu, que los niveles ARP e IP usan en lugar de consultar el sistema) y se usa como backend del
+nivel Ethernet (EthernetLevel.start(None, backend=link), ver ethernet.py):
+    -loop(callback,us) y breakloop(): igual que packetRing.loop en tpacket.py, con los mismos argumentos que pcap_loop
+    -send(buffer) y sendmsg(buffers): como los de un socket, para que txEngine envie por el puerto sin cambios
+    -stats(): (recibidas, descartadas). Las descartadas son las perdidas (loss) mas las que no caben en la cola
+    -close(): desconecta el puerto del segmento. EthernetLevel.stop no lo llama, asi que el mismo puerto se puede volver a
+        usar en otro start; se cierra cuando ya no se va a usar
+'''
+class memoryLink():
+
+    def __init__(self, switch, name, mac, ip, netmask, gateway, mtu, loss, delay, jitter, promisc):
+        self.switch = switch
+        self.name = name
+        self.mac = mac
+        self.ip = ip
+        self.netmask = netmask
+        self.gateway = gateway
+        self.mtu = mtu
+        self.loss = loss
+        self.delay = delay
+        self.jitter = jitter
+        self.promisc = promisc
+        # Tramas pendientes ordenadas por instante de entrega: (instante, numero de orden, trama)
+        self.pending = []
+        self.seq = 0
+        self.cond = threading.Condition()
+        # Lo activa breakloop y lo desactiva loop al terminar, asi que no se pierde aunque llegue antes de empezar
+        self.stopEvent = threading.Event()
+        self.closed = False
+        self.received = 0
+        self.lost = 0
+        self.overflow = 0
+        self.sent = 0
+
+    def enqueue(self, due, frame):
+        with self.cond:
+            if len(self.pending) >= self.switch.queueSize:
+                self.overflow += 1
+                return
+            heapq.heappush(self.pending, (due, self.seq, frame))
+            self.seq += 1
+            self.received += 1
+            self.cond.notify()
+
+    def send(self, data):
+        # La trama se copia: el llamante (txEngine) reutiliza su buffer para la siguiente
+        frame = bytes(data)
+        self.sent += 1
+        self.switch.deliver(self, frame)
+        return len(frame)
+
+    def sendmsg(self, buffers):
+        return self.send(b''.join(buffers))
+
+    def stats(self):
+        return self.received, self.lost + self.overflow
+
+    def loop(self, callback, us=None):
+        pending = self.pending
+        cond = self.cond
+        stopEvent = self.stopEvent
+        # Si el puerto ya esta cerrado no se espera nada
+        while not stopEvent.is_set() and not self.closed:
+            with cond:
+                if not pending:
+                    cond.wait(LINK_POLL_TIMEOUT)
+                    continue
+                wait = pending[0][0] - time.monotonic()
+                if wait > 0:
+                    # La primera trama aun no ha "llegado": se espera a su instante (o a que llegue otra antes)
+                    cond.wait(min(wait, LINK_POLL_TIMEOUT))
+                    continue
+                due, seq, frame = heapq.heappop(pending)
+            now = time.time()
+            header = pcap_pkthdr()
+            header.len = header.caplen = len(frame)
+            header.ts = timeval(int(now), int((now % 1) * 1000000))
+            callback(us, header, frame)
+        stopEvent.clear()
+
+    def breakloop(self):
+        with self.cond:
+            self.stopEvent.set()
+            self.cond.notify_all()
+
+    def close(self):
+        self.closed = True
+        self.breakloop()
+        self.switch.detach(self)
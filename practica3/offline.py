@@ -0,0 +1,249 @@
+'''
+    offline.py
+    Procesado en paralelo de trazas pcap. El fichero se divide en tantos rangos de bytes como procesos, cada rango
+    empezando en la cabecera de un registro, y cada proceso recorre el suyo sobre el fichero proyectado en memoria:
+        -con los manejadores de la pila (process_Ethernet_frame y, por debajo, ARP, IP, ICMP y UDP), o
+        -con una funcion de callback propia con el mismo prototipo que la de pcap_loop.
+    Los resultados y contadores de cada proceso se juntan al terminar.
+    Uso como programa: python3 offline.py --file traza.pcap [--workers N] [--mac MAC] [--ip IP]
+'''
+
+from icmp import *
+from udp import *
+import arp
+import ethernet
+import ip
+import argparse
+import bisect
+import logging
+import multiprocessing
+import os
+import socket
+import struct
+import sys
+import time
+
+#Numero de registros consecutivos que deben tener una cabecera valida para aceptar una posicion como inicio de rango
+SPLIT_CHAIN = 8
+#Longitud maxima razonable de un registro al buscar cabeceras
+SPLIT_MAX_CAPLEN = 262144
+#Segundos que puede retroceder el timestamp entre registros consecutivos al buscar cabeceras
+SPLIT_MAX_BACKWARDS = 60
+#Trabajo en curso: lo heredan los procesos hijos (fork) para no tener que serializar las funciones de callback
+_job = None
+
+'''
+Nombre: initOfflineStack
+Descripcion: Esta funcion registra los manejadores de la pila (ARP, IP, ICMP y UDP) sin abrir ninguna interfaz, para
+    procesar tramas leidas de una traza. No hay nivel Ethernet iniciado, asi que las respuestas que generen los
+    manejadores (ECHO_REPLY, respuestas ARP...) no se envian.
+Argumentos:
+    -mac: direccion MAC (bytes) que se considera propia. Solo se procesan las tramas dirigidas a ella o a broadcast
+    -ipAddr: direccion IP propia como entero de 32 bits (o None)
+    -netmask: mascara de red como entero de 32 bits
+Retorno: Ninguno
+'''
+def initOfflineStack(mac=None, ipAddr=None, netmask=0):
+
+    ethernet.defaultLevel.macAddress = mac
+    arp.defaultARP.myMAC = mac
+    arp.defaultARP.myIP = ipAddr
+    ip.defaultIP.myIP = ipAddr
+    ip.defaultIP.netmask = netmask
+    ip.defaultIP.defaultGW = 0
+    ip.defaultIP.ipOpts = None
+    registerCallback(arp.process_arp_frame, bytes([0x08,0x06]))
+    registerCallback(ip.process_IP_datagram, bytes([0x08,0x00]))
+    initICMP()
+    initUDP()
+
+
+'''
+Nombre: splitTrace
+Descripcion: Esta funcion divide un fichero pcap en parts rangos de bytes [inicio, fin) que empiezan siempre en la
+    cabecera de un registro. Si el fichero tiene indice (.idx, ver PcapIndex) los cortes se toman de el; si no, se
+    parte en trozos del mismo tamanno y se busca hacia delante una posicion desde la que haya SPLIT_CHAIN cabeceras
+    validas seguidas.
+Argumentos:
+    -reader: PcapReader abierto sobre el fichero
+    -parts: numero de rangos
+Retorno: lista de tuplas (inicio, fin)
+'''
+def splitTrace(reader, parts):
+
+    if reader.pcapng:
+        raise ValueError('Solo se pueden dividir ficheros pcap')
+    start = reader.data_offset
+    size = reader.size
+    cuts = [start]
+    index = None
+    try:
+        index = PcapIndex.load(str(reader.fname) + PCAP_INDEX_SUFFIX)
+    except (OSError, ValueError):
+        pass
+    for i in range(1, parts):
+        target = start + (size - start) * i // parts
+        if index is not None and index.offsets:
+            # Primera entrada del indice a partir del punto de corte
+            j = min(bisect.bisect_left(index.offsets, target), len(index.offsets) - 1)
+            cut = index.offsets[j]
+        else:
+            cut = _resync(reader, target)
+        if cut > cuts[-1] and cut < size:
+            cuts.append(cut)
+    cuts.append(size)
+    return [(cuts[i], cuts[i + 1]) for i in range(len(cuts) - 1)]
+
+
+def _resync(reader, off):
+    # Busca desde off la primera posicion en la que empiezan SPLIT_CHAIN cabeceras validas seguidas (o el final)
+    unpack_from = struct.Struct(reader.endian + 'IIII').unpack_from
+    view = reader._view
+    size = reader.size
+    snaplen = reader.snaplen if reader.snaplen > 0 else SPLIT_MAX_CAPLEN
+    first = unpack_from(view, reader.data_offset)[0] if reader.data_offset + PCAP_RECORD_HLEN <= size else 0
+    while off + PCAP_RECORD_HLEN <= size:
+        pos = off
+        last = first
+        for n in range(SPLIT_CHAIN):
+            if pos == size:
+                return off
+            if pos + PCAP_RECORD_HLEN > size:
+                break
+            tv_sec, tv_frac, caplen, length = unpack_from(view, pos)
+            # Cabecera plausible: longitudes coherentes y timestamps que no retroceden mas de SPLIT_MAX_BACKWARDS
+            if (length == 0 or caplen > snaplen or caplen > length or length > SPLIT_MAX_CAPLEN or tv_frac >= reader.tsresol
+                    or tv_sec + SPLIT_MAX_BACKWARDS < last or pos + PCAP_RECORD_HLEN + caplen > size):
+                break
+            last = max(last, tv_sec)
+            pos += PCAP_RECORD_HLEN + caplen
+        else:
+            return off
+        off += 1
+    return size
+
+
+'''
+Nombre: mergeResults
+Descripcion: Junta los resultados de los procesos: los diccionarios se suman clave a clave (de forma recursiva), las
+    listas se concatenan, los numeros se suman y para el resto se devuelve la lista de resultados.
+'''
+def mergeResults(results):
+
+    results = [r for r in results if r is not None]
+    if not results:
+        return None
+    if all(isinstance(r, dict) for r in results):
+        merged = {}
+        for r in results:
+            for k, v in r.items():
+                merged[k] = mergeResults([merged[k], v]) if k in merged else v
+        return merged
+    if all(isinstance(r, list) for r in results):
+        return [x for r in results for x in r]
+    if all(isinstance(r, (int, float)) for r in results):
+        return sum(results)
+    return results
+
+
+def _processRange(span):
+    fname, callback, init = _job
+    start, end = span
+    result = init() if init is not None else {}
+    counters = {'packets': 0, 'bytes': 0, 'errors': 0}
+    if callback is None:
+        ethernet.stats.reset()
+        callback = process_Ethernet_frame
+    with PcapReader(fname) as reader:
+        usec = reader.tsresol == 1000000
+        off = start
+        for tv_sec, tv_frac, caplen, length, data in reader._iter_pcap(start):
+            if off >= end:
+                break
+            off += PCAP_RECORD_HLEN + caplen
+            header = pcap_pkthdr()
+            header.len = length
+            header.caplen = caplen
+            header.ts = timeval(tv_sec, tv_frac if usec else tv_frac // 1000)
+            try:
+                callback(result, header, data)
+            except Exception:
+                counters['errors'] += 1
+                logging.debug('Error procesando el registro de la posicion ' + str(off), exc_info=True)
+            counters['packets'] += 1
+            counters['bytes'] += caplen
+    if callback is process_Ethernet_frame:
+        result = ethernet.stats.snapshot()
+    return result, counters
+
+
+'''
+Nombre: processTrace
+Descripcion: Esta funcion procesa un fichero pcap repartiendo sus registros entre varios procesos.
+    Cada proceso llama a callback(us, header, data) por cada registro de su rango, igual que pcap_loop:
+        -us: resultado propio del proceso, creado con init() (por defecto un diccionario vacio) para ir acumulando en el
+        -header: pcap_pkthdr del registro (timestamp en microsegundos)
+        -data: memoryview con la trama, valida solo durante la llamada (copiarla si se quiere guardar)
+    Sin callback se usan los manejadores de la pila (process_Ethernet_frame, ver initOfflineStack) y el resultado de
+    cada proceso son sus estadisticas del nivel Ethernet (ver getEthernetStats).
+    Los procesos se crean con fork: heredan los manejadores registrados y las funciones no necesitan ser serializables,
+    pero los resultados si.
+Argumentos:
+    -fname: fichero pcap (sin comprimir)
+    -callback: funcion a llamar por cada registro o None
+    -workers: numero de procesos (por defecto uno por nucleo)
+    -init: funcion sin argumentos que crea el resultado inicial de cada proceso
+    -merge: funcion que recibe la lista de resultados de los procesos y los junta (por defecto mergeResults)
+Retorno: tupla (resultado, contadores) con los contadores packets, bytes, errors y workers sumados
+'''
+def processTrace(fname, callback=None, workers=None, init=None, merge=mergeResults):
+
+    global _job
+    if workers is None:
+        workers = os.cpu_count() or 1
+    with PcapReader(fname) as reader:
+        spans = splitTrace(reader, workers)
+    _job = (fname, callback, init)
+    try:
+        if len(spans) == 1:
+            outputs = [_processRange(spans[0])]
+        else:
+            with multiprocessing.get_context('fork').Pool(len(spans)) as pool:
+                outputs = pool.map(_processRange, spans, chunksize=1)
+    finally:
+        _job = None
+    counters = mergeResults([c for r, c in outputs])
+    counters['workers'] = len(spans)
+    return merge([r for r, c in outputs]), counters
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Procesa una traza pcap con los manejadores de la pila repartiendola entre varios procesos')
+    parser.add_argument('--file', dest='tracefile', default=False, help='Fichero pcap a procesar')
+    parser.add_argument('--workers', dest='workers', type=int, default=None, help='Número de procesos (por defecto uno por núcleo)')
+    parser.add_argument('--mac', dest='mac', default=None, help='Dirección MAC propia (solo se procesan las tramas dirigidas a ella o a broadcast)')
+    parser.add_argument('--ip', dest='ip', default=None, help='Dirección IP propia')
+    parser.add_argument('--netmask', dest='netmask', default='255.255.255.0', help='Máscara de red')
+    parser.add_argument('--debug', dest='debug', default=False, action='store_true', help='Activar Debug messages')
+    args = parser.parse_args()
+
+    if args.debug:
+        logging.basicConfig(level = logging.DEBUG, format = '[%(asctime)s %(levelname)s]\t%(message)s')
+    else:
+        logging.basicConfig(level = logging.INFO, format = '[%(asctime)s %(levelname)s]\t%(message)s')
+
+    if args.tracefile is False:
+        logging.error('No se ha especificado fichero')
+        parser.print_help()
+        sys.exit(-1)
+
+    mac = bytes.fromhex(args.mac.replace(':', '')) if args.mac else None
+    ipAddr = struct.unpack('!I', socket.inet_aton(args.ip))[0] if args.ip else None
+    initOfflineStack(mac, ipAddr, struct.unpack('!I', socket.inet_aton(args.netmask))[0])
+
+    start = time.perf_counter()
+    snap, counters = processTrace(args.tracefile, workers=args.workers)
+    elapsed = time.perf_counter() - start
+    logging.info(formatEthernetStats(snap))
+    logging.info('{} registros ({:.1f} MB) en {:.2f} s con {} procesos: {:.1f} paquetes/s, {} errores'.format(
+        counters['packets'], counters['bytes'] / 1e6, elapsed, counters['workers'], counters['packets'] / elapsed, counters['errors']))
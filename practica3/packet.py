@@ -0,0 +1,234 @@
+'''
+    packet.py
+    Vista de una trama recibida que comparten todos los niveles de la pila. La trama se guarda una sola vez (como
+    memoryview) junto con el inicio de cada nivel y los campos de cada cabecera se decodifican solo cuando se piden,
+    con un unico unpack_from por cabecera (objetos struct.Struct creados una vez), y se guardan para que ningun
+    nivel tenga que volver a leerlos.
+'''
+
+import struct
+
+#Longitud de la cabecera Ethernet
+ETH_HLEN = 14
+#Cabeceras que se decodifican de una vez (en orden de red)
+ETHERTYPE = struct.Struct('!H')
+#TPIDs de las etiquetas VLAN: 802.1Q, 802.1ad (QinQ) y 0x9100 (QinQ de equipos antiguos)
+VLAN_TPIDS = frozenset((0x8100, 0x88a8, 0x9100))
+#Etiqueta VLAN: TCI (prioridad, DEI y VLAN ID) y el Ethertype que la sigue
+VLAN_TAG = struct.Struct('!HH')
+VLAN_TAG_LEN = 4
+#Numero maximo de etiquetas que se quitan (2 => QinQ)
+VLAN_MAX_TAGS = 2
+#ARP: tipo de hardware, tipo de protocolo, longitudes de direccion y opcode
+ARP_HDR = struct.Struct('!HHBBH')
+#IP: version/IHL, ToS, longitud total, IPID, flags/offset, TTL, protocolo, checksum, IP origen, IP destino
+IP_HDR = struct.Struct('!BBHHHBBHII')
+#ICMP: tipo, codigo, checksum, id y numero de secuencia (con signo, como los lee icmp.py)
+ICMP_HDR = struct.Struct('!BBHhh')
+#UDP: puerto origen, puerto destino, longitud y checksum
+UDP_HDR = struct.Struct('!HHHH')
+
+'''
+Clase que implementa la vista de una trama. Cada nivel, al recibirla, marca el inicio de su cabecera (off) y al pasarla
+hacia arriba avanza off hasta su payload:
+    -l3: inicio de la cabecera de nivel 3 (ARP o IP), lo fija el nivel Ethernet (despues de las etiquetas VLAN)
+    -l4: inicio de la cabecera de nivel 4 (ICMP o UDP), lo fija el nivel IP
+Para los manejadores escritos sobre bytes la vista se comporta como el payload del nivel actual: len(), indices y
+slices son relativos a off (los slices devuelven memoryviews de la trama) y bytes(p) copia ese payload.
+Los campos de cada cabecera (eth*, arp*, ip*, icmp*, udp*) se decodifican en el primer acceso.
+Si la trama lleva etiquetas VLAN (802.1Q o QinQ) ethertype es el de despues de las etiquetas, vlans la tupla de VLAN
+IDs (la exterior primero), vlan el VLAN ID interior (None si no hay etiquetas) y ethHeaderLength incluye las etiquetas.
+'''
+class Packet():
+
+    __slots__ = ('buf', 'off', 'l3', 'l4', '_ethertype', '_vlans', '_l2len', '_arp', '_ip', '_l4')
+
+    def __init__(self, data, off=0):
+        self.buf = data if isinstance(data, memoryview) else memoryview(data)
+        self.off = off
+        self.l3 = None
+        self.l4 = None
+        self._ethertype = None
+        self._vlans = ()
+        self._l2len = ETH_HLEN
+        self._arp = None
+        self._ip = None
+        self._l4 = None
+
+    @classmethod
+    def of(cls, data):
+        # Los niveles aceptan tanto una vista ya creada como bytes/bytearray/memoryview
+        return data if isinstance(data, cls) else cls(data)
+
+    def __len__(self):
+        return len(self.buf) - self.off
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self.buf) - self.off)
+            return self.buf[self.off + start:self.off + stop:step]
+        if key < 0:
+            key += len(self.buf) - self.off
+        return self.buf[self.off + key]
+
+    def __bytes__(self):
+        return bytes(self.buf[self.off:])
+
+    def payload(self):
+        # memoryview con el payload del nivel actual (para pasarlo a funciones que necesitan un buffer)
+        return self.buf[self.off:]
+
+    # Ethernet
+    @property
+    def ethDst(self):
+        return self.buf[0:6]
+
+    @property
+    def ethSrc(self):
+        return self.buf[6:12]
+
+    def parseEthertype(self):
+        # Ethertype de la trama saltando las etiquetas VLAN, que se guardan en _vlans
+        buf = self.buf
+        ethertype = ETHERTYPE.unpack_from(buf, 12)[0]
+        if ethertype in VLAN_TPIDS:
+            vlans = []
+            off = ETH_HLEN - 2
+            while ethertype in VLAN_TPIDS and len(vlans) < VLAN_MAX_TAGS and off + VLAN_TAG_LEN + 2 <= len(buf):
+                tci, ethertype = VLAN_TAG.unpack_from(buf, off + 2)
+                vlans.append(tci & 0x0FFF)
+                off += VLAN_TAG_LEN
+            self._vlans = tuple(vlans)
+            self._l2len = off + 2
+        self._ethertype = ethertype
+
+    @property
+    def ethertype(self):
+        if self._ethertype is None:
+            self.parseEthertype()
+        return self._ethertype
+
+    @property
+    def vlans(self):
+        if self._ethertype is None:
+            self.parseEthertype()
+        return self._vlans
+
+    @property
+    def vlan(self):
+        vlans = self.vlans
+        return vlans[-1] if vlans else None
+
+    @property
+    def ethHeaderLength(self):
+        if self._ethertype is None:
+            self.parseEthertype()
+        return self._l2len
+
+    # ARP
+    @property
+    def arpHeader(self):
+        if self._arp is None:
+            self._arp = ARP_HDR.unpack_from(self.buf, self.l3)
+        return self._arp
+
+    @property
+    def arpOpcode(self):
+        return self.arpHeader[4]
+
+    # IP
+    @property
+    def ipHeader(self):
+        if self._ip is None:
+            self._ip = IP_HDR.unpack_from(self.buf, self.l3)
+        return self._ip
+
+    @property
+    def ipVersion(self):
+        return self.ipHeader[0] >> 4
+
+    @property
+    def ipHeaderLength(self):
+        return (self.ipHeader[0] & 0x0F) * 4
+
+    @property
+    def ipTos(self):
+        return self.ipHeader[1]
+
+    @property
+    def ipTotalLength(self):
+        return self.ipHeader[2]
+
+    @property
+    def ipId(self):
+        return self.ipHeader[3]
+
+    @property
+    def ipFlagsOffset(self):
+        return self.ipHeader[4]
+
+    @property
+    def ipTtl(self):
+        return self.ipHeader[5]
+
+    @property
+    def ipProtocol(self):
+        return self.ipHeader[6]
+
+    @property
+    def ipChecksum(self):
+        return self.ipHeader[7]
+
+    @property
+    def ipSrc(self):
+        return self.ipHeader[8]
+
+    @property
+    def ipDst(self):
+        return self.ipHeader[9]
+
+    @property
+    def ipSrcAddr(self):
+        # IP origen como 4 bytes (vista de la trama), el formato que reciben los manejadores de nivel 4
+        return self.buf[self.l3 + 12:self.l3 + 16]
+
+    # ICMP y UDP: la cabecera de nivel 4 se decodifica segun el metodo por el que se pida
+    @property
+    def icmpHeader(self):
+        if self._l4 is None:
+            self._l4 = ICMP_HDR.unpack_from(self.buf, self.l4)
+        return self._l4
+
+    @property
+    def icmpType(self):
+        return self.icmpHeader[0]
+
+    @property
+    def icmpCode(self):
+        return self.icmpHeader[1]
+
+    @property
+    def icmpId(self):
+        return self.icmpHeader[3]
+
+    @property
+    def icmpSeq(self):
+        return self.icmpHeader[4]
+
+    @property
+    def udpHeader(self):
+        if self._l4 is None:
+            self._l4 = UDP_HDR.unpack_from(self.buf, self.l4)
+        return self._l4
+
+    @property
+    def udpSrcPort(self):
+        return self.udpHeader[0]
+
+    @property
+    def udpDstPort(self):
+        return self.udpHeader[1]
+
+    @property
+    def udpLength(self):
+        return self.udpHeader[2]
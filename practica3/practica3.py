@@ -35,6 +35,11 @@ if __name__ == "__main__":
     parser.add_argument('--debug', dest='debug', default=False, action='store_true',help='Activar Debug messages')
     parser.add_argument('--addOptions', dest='addOptions', default=False, action='store_true',help='Añadir opciones a los datagranas IP')
     parser.add_argument('--dataFile',dest='dataFile',default = False,help='Fichero con datos a enviar')
+    parser.add_argument('--filter',dest='bpfFilter',default = None,help='Expresion BPF adicional para el filtro de captura')
+    parser.add_argument('--backend',dest='backend',default = BACKEND_PCAP,choices=[BACKEND_PCAP,BACKEND_TPACKET],help='Backend de captura: pcap (pcap_loop) o tpacket (anillo TPACKET_V3)')
+    parser.add_argument('--processes',dest='processes',type=int,default = 0,help='Numero de procesos de captura en modo PACKET_FANOUT (0 => captura en este proceso)')
+    parser.add_argument('--stats',dest='statsInterval',type=int,default = 0,help='Cada cuantos segundos mostrar las estadisticas del nivel Ethernet (0 => nunca)')
+    parser.add_argument('--profile',dest='profile',default = None,choices=sorted(PCAP_PROFILES),help='Perfil de captura (pcap_create/pcap_activate): low-latency o high-throughput')
     args = parser.parse_args()
 
     if args.debug:
@@ -64,14 +69,17 @@ if __name__ == "__main__":
             #Pasamos los datos de cadena a bytes
             data = data.encode()
     
-    startEthernetLevel(args.interface)
+    startEthernetLevel(args.interface,args.bpfFilter,backend=args.backend,statsInterval=args.statsInterval,profile=args.profile)
     initICMP()
     initUDP()
     if initIP(args.interface,ipOpts) == False:
         logging.error('Inicializando nivel IP')
         sys.exit(-1)
 
-    startEthernetLevel(args.interface)
+    # Con --processes la recepcion se reparte entre varios procesos (los niveles ya estan inicializados)
+    if args.processes > 0 and startFanout(args.interface,args.processes) != 0:
+        logging.error('Iniciando los procesos de captura')
+        sys.exit(-1)
     
     
     while True:
@@ -0,0 +1,206 @@
+'''
+    replay.py
+    Reinyecta en una interfaz las tramas de una traza pcap con pcap_inject. Modos de ritmo:
+        -original: respeta los tiempos entre paquetes de la traza, opcionalmente acelerados o frenados (--speed)
+        -pps: un numero fijo de paquetes por segundo
+        -mbps: un numero fijo de megabits por segundo
+        -top: tan rapido como se pueda
+    Un hilo de precarga va leyendo la traza (pcap_open_mmap: plana con mmap o comprimida en secuencia) y preparando
+    las tramas por lotes, de modo que el bucle de envio solo espera y llama a pcap_inject. La espera es de alta
+    resolucion: se duerme hasta poco antes del instante de envio y el resto se espera activamente.
+    Al terminar muestra el ritmo conseguido, los percentiles del error de ritmo y los fallos de pcap_inject.
+    Necesita permisos para abrir la interfaz (salvo con --dry, que mide el ritmo sin enviar nada).
+'''
+
+from rc1_pcap import *
+from array import array
+import argparse
+import logging
+import queue
+import sys
+import threading
+import time
+
+REPLAY_ORIGINAL = 'original'
+REPLAY_PPS = 'pps'
+REPLAY_MBPS = 'mbps'
+REPLAY_TOP = 'top'
+#Tramas por lote de precarga y lotes que puede adelantar el hilo de precarga
+PRELOAD_BATCH = 256
+PRELOAD_AHEAD = 64
+#Por debajo de este margen (ns) no se duerme: se espera activamente hasta el instante de envio
+SPIN_NS = 200000
+REPLAY_SNAPLEN = 65535
+PERCENTILES = (50, 90, 99, 99.9)
+
+'''
+Clase que implementa la reinyeccion de una traza. run() envia todas las tramas (loops veces) y devuelve un
+diccionario con el resultado (ver report).
+'''
+class replayEngine():
+
+    def __init__(self, handle, fname, mode=REPLAY_ORIGINAL, speed=1.0, rate=0, loops=1):
+        if mode not in (REPLAY_ORIGINAL, REPLAY_PPS, REPLAY_MBPS, REPLAY_TOP):
+            raise ValueError('Modo de reinyeccion desconocido: ' + str(mode))
+        if mode in (REPLAY_PPS, REPLAY_MBPS) and rate <= 0:
+            raise ValueError('El modo ' + mode + ' necesita un ritmo mayor que 0')
+        if mode == REPLAY_ORIGINAL and speed <= 0:
+            raise ValueError('El multiplicador de velocidad debe ser mayor que 0')
+        self.handle = handle
+        self.fname = fname
+        self.mode = mode
+        self.speed = speed
+        self.rate = rate
+        self.loops = loops
+        self.batches = queue.Queue(maxsize=PRELOAD_AHEAD)
+        self.stopped = False
+        self.error = None
+
+    def preload(self):
+        # Lotes de (instante de envio relativo en ns, trama). Al final se encola None
+        try:
+            offset = 0
+            sent = 0
+            bits = 0
+            for loop in range(self.loops):
+                first = None
+                last = 0
+                reader = pcap_open_mmap(self.fname)
+                try:
+                    scale = 1000000000 // reader.tsresol
+                    batch = []
+                    for tv_sec, tv_frac, caplen, length, data in reader:
+                        if self.stopped:
+                            return
+                        if self.mode == REPLAY_ORIGINAL:
+                            ts = (tv_sec * reader.tsresol + tv_frac) * scale
+                            if first is None:
+                                first = ts
+                            last = offset + int((ts - first) / self.speed)
+                            due = last
+                        elif self.mode == REPLAY_PPS:
+                            due = int(sent * 1000000000 / self.rate)
+                        elif self.mode == REPLAY_MBPS:
+                            due = int(bits * 1000 / self.rate)
+                            bits += caplen * 8
+                        else:
+                            due = 0
+                        sent += 1
+                        batch.append((due, bytes(data)))
+                        if len(batch) == PRELOAD_BATCH:
+                            self.batches.put(batch)
+                            batch = []
+                    if batch:
+                        self.batches.put(batch)
+                finally:
+                    reader.close()
+                # La siguiente vuelta empieza justo despues del ultimo paquete de esta
+                offset = last
+        except (OSError, ValueError) as e:
+            self.error = e
+        finally:
+            self.batches.put(None)
+
+    def run(self):
+        loader = threading.Thread(target=self.preload, daemon=True)
+        loader.start()
+        errors = array('q')
+        packets = 0
+        nbytes = 0
+        failures = 0
+        handle = self.handle
+        paced = self.mode != REPLAY_TOP
+        clock = time.perf_counter_ns
+        sleep = time.sleep
+        # El reloj empieza con la primera trama precargada para no contar el arranque del hilo de precarga
+        batch = self.batches.get()
+        start = clock()
+        try:
+            while batch is not None:
+                for due, frame in batch:
+                    if paced:
+                        target = start + due
+                        now = clock()
+                        if target - now > SPIN_NS:
+                            sleep((target - now - SPIN_NS) / 1e9)
+                        while clock() < target:
+                            pass
+                        errors.append(clock() - target)
+                    if handle is not None and pcap_inject(handle, frame, len(frame)) == -1:
+                        if failures == 0:
+                            logging.error('Error en pcap_inject: ' + pcap_geterr(handle))
+                        failures += 1
+                    packets += 1
+                    nbytes += len(frame)
+                batch = self.batches.get()
+        except KeyboardInterrupt:
+            logging.info('Control C pulsado')
+            self.stopped = True
+            # Vaciamos la cola para que el hilo de precarga pueda terminar
+            while batch is not None:
+                batch = self.batches.get()
+        elapsed = (clock() - start) / 1e9
+        loader.join()
+        if self.error is not None:
+            logging.error('Error leyendo la traza: ' + str(self.error))
+        return report(packets, nbytes, failures, elapsed, errors)
+
+
+'''
+Nombre: report
+Descripcion: Construye el diccionario de resultados de una reinyeccion: paquetes y bytes enviados, fallos de
+    pcap_inject, duracion, ritmo conseguido y percentiles (PERCENTILES) del error de ritmo en microsegundos, es decir,
+    del retraso de cada envio respecto al instante en el que le tocaba salir.
+'''
+def report(packets, nbytes, failures, elapsed, errors):
+
+    result = {'packets': packets, 'bytes': nbytes, 'failures': failures, 'elapsed': elapsed,
+              'pps': packets / elapsed if elapsed > 0 else 0.0,
+              'mbps': nbytes * 8 / elapsed / 1e6 if elapsed > 0 else 0.0, 'pacing': {}}
+    if errors:
+        ordered = sorted(errors)
+        for p in PERCENTILES:
+            result['pacing'][p] = ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] / 1000
+        result['pacing']['max'] = ordered[-1] / 1000
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Reinyecta una traza pcap en una interfaz con pcap_inject')
+    parser.add_argument('--file', dest='tracefile', default=False, help='Traza a reinyectar (pcap plano o comprimido, o pcapng)')
+    parser.add_argument('--itf', dest='interface', default=False, help='Interfaz por la que enviar')
+    parser.add_argument('--mode', dest='mode', default=REPLAY_ORIGINAL, choices=[REPLAY_ORIGINAL, REPLAY_PPS, REPLAY_MBPS, REPLAY_TOP], help='Ritmo de envio')
+    parser.add_argument('--speed', dest='speed', type=float, default=1.0, help='Multiplicador de velocidad en modo original (2 => el doble de rapido)')
+    parser.add_argument('--rate', dest='rate', type=float, default=0, help='Paquetes por segundo (modo pps) o megabits por segundo (modo mbps)')
+    parser.add_argument('--loops', dest='loops', type=int, default=1, help='Número de veces que se reinyecta la traza')
+    parser.add_argument('--dry', dest='dry', default=False, action='store_true', help='No enviar: solo medir el ritmo')
+    parser.add_argument('--debug', dest='debug', default=False, action='store_true', help='Activar Debug messages')
+    args = parser.parse_args()
+
+    if args.debug:
+        logging.basicConfig(level = logging.DEBUG, format = '[%(asctime)s %(levelname)s]\t%(message)s')
+    else:
+        logging.basicConfig(level = logging.INFO, format = '[%(asctime)s %(levelname)s]\t%(message)s')
+
+    if args.tracefile is False or (args.interface is False and not args.dry):
+        logging.error('Hay que especificar la traza y la interfaz')
+        parser.print_help()
+        sys.exit(-1)
+
+    handle = None
+    if not args.dry:
+        errbuf = bytearray()
+        handle = pcap_open_live(args.interface, REPLAY_SNAPLEN, 0, 10, errbuf)
+        if not handle:
+            logging.error('Error abriendo la interfaz ' + args.interface + ': ' + errbuf.decode('ascii', 'replace'))
+            sys.exit(-1)
+
+    engine = replayEngine(handle, args.tracefile, args.mode, args.speed, args.rate, args.loops)
+    result = engine.run()
+    if handle is not None:
+        pcap_close(handle)
+
+    logging.info('{} paquetes ({:.2f} MB) en {:.3f} s: {:.1f} paquetes/s, {:.2f} Mb/s, {} fallos de pcap_inject'.format(
+        result['packets'], result['bytes'] / 1e6, result['elapsed'], result['pps'], result['mbps'], result['failures']))
+    if result['pacing']:
+        logging.info('Error de ritmo (us): ' + ' '.join(['p{}={:.1f}'.format(k, v) for k, v in result['pacing'].items()]))
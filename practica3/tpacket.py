@@ -0,0 +1,150 @@
+'''
+    tpacket.py
+    Backend de captura alternativo a pcap_loop. Abre un socket AF_PACKET con un anillo de recepcion TPACKET_V3
+    (PACKET_RX_RING) proyectado en memoria con mmap. El kernel va llenando bloques de tramas y desde Python se recorren
+    bloques completos sin hacer una llamada al sistema por trama; solo se espera (poll) cuando no hay ningun bloque listo.
+'''
+
+from rc1_pcap import pcap_pkthdr, timeval
+import mmap
+import select
+import socket
+import struct
+import threading
+
+SOL_PACKET = 263
+PACKET_ADD_MEMBERSHIP = 1
+PACKET_RX_RING = 5
+PACKET_STATISTICS = 6
+PACKET_VERSION = 10
+PACKET_FANOUT = 18
+PACKET_FANOUT_HASH = 0
+PACKET_FANOUT_FLAG_DEFRAG = 0x8000
+TPACKET_V3 = 2
+PACKET_MR_PROMISC = 1
+SO_ATTACH_FILTER = 26
+ETH_P_ALL = 0x0003
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+#El kernel ha quitado la etiqueta VLAN de la trama y la ha dejado en tp_vlan_tci (y su TPID en tp_vlan_tpid)
+TP_STATUS_VLAN_VALID = 1 << 4
+TP_STATUS_VLAN_TPID_VALID = 1 << 6
+ETH_P_8021Q = 0x8100
+
+#Tamanno por defecto de cada bloque del anillo (multiplo del tamanno de pagina) y numero de bloques
+RING_BLOCK_SIZE = 1 << 20
+RING_BLOCK_NR = 32
+RING_FRAME_SIZE = 2048
+
+#Campos de tpacket_block_desc que se usan: block_status, num_pkts, offset_to_first_pkt
+BLOCK_HDR = struct.Struct('III')
+BLOCK_HDR_OFFSET = 8
+#Campos de tpacket3_hdr: tp_next_offset, tp_sec, tp_nsec, tp_snaplen, tp_len, tp_status, tp_mac, tp_net y de hv1:
+#tp_rxhash, tp_vlan_tci, tp_vlan_tpid
+PKT_HDR = struct.Struct('IIIIIIHHIIH')
+#Etiqueta VLAN que se vuelve a insertar en la trama (TPID y TCI)
+VLAN_TAG = struct.Struct('!HH')
+#struct tpacket_stats_v3: tp_packets, tp_drops, tp_freeze_q_cnt
+STATS = struct.Struct('III')
+
+'''
+Clase que implementa el anillo de captura TPACKET_V3 sobre una interfaz.
+    -loop(callback,us): recorre los bloques del anillo y llama a callback(us,header,data) por cada trama, con los
+        mismos argumentos que pcap_loop (header es un pcap_pkthdr y data un bytearray con la trama), hasta que se llama
+        a breakloop (si breakloop llega antes de que empiece loop, loop vuelve enseguida, como con pcap_breakloop).
+        Si el kernel ha quitado la etiqueta VLAN de la trama se vuelve a insertar, como hace libpcap.
+    -stats(): devuelve (recibidas, descartadas) acumuladas desde que se abrio el anillo segun PACKET_STATISTICS.
+    -attachFilter(length,insns): instala en el socket un programa BPF ya compilado (por ejemplo con pcap_compile).
+Si se indica fanout (identificador de grupo de 16 bits) el socket se une a ese grupo PACKET_FANOUT en modo hash: el
+kernel reparte las tramas entre todos los sockets del grupo y las de un mismo flujo van siempre al mismo.
+'''
+class packetRing():
+
+    def __init__(self, interface, promisc=True, timeoutMs=10, blockSize=RING_BLOCK_SIZE, blockNr=RING_BLOCK_NR, fanout=None):
+        self.blockSize = blockSize
+        self.blockNr = blockNr
+        self.timeoutMs = timeoutMs
+        # Lo activa breakloop y lo desactiva loop al terminar, asi que no se pierde aunque llegue antes de empezar
+        self.stopEvent = threading.Event()
+        self.packets = 0
+        self.drops = 0
+        self.statsLock = threading.Lock()
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        try:
+            self.sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+            # struct tpacket_req3: block_size, block_nr, frame_size, frame_nr, retire_blk_tov, sizeof_priv, feature_req_word
+            req = struct.pack('7I', blockSize, blockNr, RING_FRAME_SIZE, (blockSize * blockNr) // RING_FRAME_SIZE, timeoutMs, 0, 0)
+            self.sock.setsockopt(SOL_PACKET, PACKET_RX_RING, req)
+            self.mm = mmap.mmap(self.sock.fileno(), blockSize * blockNr, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+            self.sock.bind((interface, ETH_P_ALL))
+            if promisc:
+                # struct packet_mreq: mr_ifindex, mr_type, mr_alen, mr_address
+                mreq = struct.pack('iHH8s', socket.if_nametoindex(interface), PACKET_MR_PROMISC, 0, b'')
+                self.sock.setsockopt(SOL_PACKET, PACKET_ADD_MEMBERSHIP, mreq)
+            if fanout is not None:
+                # Los fragmentos IP se reagrupan antes de calcular el hash para que no cambien de socket
+                self.sock.setsockopt(SOL_PACKET, PACKET_FANOUT, struct.pack('I', (fanout & 0xffff) | ((PACKET_FANOUT_HASH | PACKET_FANOUT_FLAG_DEFRAG) << 16)))
+        except OSError:
+            self.sock.close()
+            raise
+        self.view = memoryview(self.mm)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def attachFilter(self, length, insns):
+        # struct sock_fprog: unsigned short len; struct sock_filter *filter
+        self.sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, struct.pack('HP', length, insns))
+
+    def stats(self):
+        # Cada lectura de PACKET_STATISTICS pone a cero los contadores del kernel: se acumulan aqui
+        packets, drops, freeze = STATS.unpack(self.sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, STATS.size))
+        with self.statsLock:
+            self.packets += packets
+            self.drops += drops
+            return self.packets, self.drops
+
+    def loop(self, callback, us=None):
+        mm = self.mm
+        view = self.view
+        poller = select.poll()
+        poller.register(self.sock, select.POLLIN | select.POLLERR)
+        block = 0
+        stopEvent = self.stopEvent
+        while not stopEvent.is_set():
+            off = block * self.blockSize
+            status, num, first = BLOCK_HDR.unpack_from(mm, off + BLOCK_HDR_OFFSET)
+            if not status & TP_STATUS_USER:
+                # Ningun bloque listo: esperamos como mucho timeoutMs para poder comprobar si se ha llamado a breakloop
+                poller.poll(self.timeoutMs)
+                continue
+            pkt = off + first
+            for i in range(num):
+                nextOffset, sec, nsec, snaplen, length, pktStatus, mac, net, rxhash, tci, tpid = PKT_HDR.unpack_from(mm, pkt)
+                header = pcap_pkthdr()
+                header.len = length
+                header.caplen = snaplen
+                header.ts = timeval(sec, nsec // 1000)
+                start = pkt + mac
+                # Copia de la trama: el bloque vuelve al kernel en cuanto se termina de recorrer
+                frame = bytearray(view[start:start + snaplen])
+                if pktStatus & TP_STATUS_VLAN_VALID and snaplen >= 12:
+                    # Etiqueta 802.1Q (o la exterior de QinQ) despues de las MAC
+                    frame[12:12] = VLAN_TAG.pack(tpid if pktStatus & TP_STATUS_VLAN_TPID_VALID else ETH_P_8021Q, tci)
+                    header.len += 4
+                    header.caplen += 4
+                callback(us, header, frame)
+                pkt += nextOffset
+            # Devolvemos el bloque al kernel y pasamos al siguiente
+            struct.pack_into('I', mm, off + BLOCK_HDR_OFFSET, TP_STATUS_KERNEL)
+            block = (block + 1) % self.blockNr
+        stopEvent.clear()
+
+    def breakloop(self):
+        self.stopEvent.set()
+
+    def close(self):
+        self.stopEvent.set()
+        self.view.release()
+        self.mm.close()
+        self.sock.close()
@@ -2,7 +2,8 @@ from ip import *
 import struct
 import logging
 
-from ip import registerIPProtocol, sendIPDatagram
+from ip import registerIPProtocol, sendIPDatagram, defaultIP
+from packet import Packet
 
 UDP_HLEN = 8
 UDP_PROTO = 17
@@ -39,7 +40,7 @@ def getUDPSourcePort():
     Argumentos:
         -us: son los datos de usuarios pasados por pcap_loop (en nuestro caso este valor será siempre None)
         -header: estructura pcap_pkthdr que contiene los campos len, caplen y ts.
-        -data: array de bytes con el conenido del datagrama UDP
+        -data: array de bytes (o vista Packet, ver packet.py) con el conenido del datagrama UDP
         -srcIP: dirección IP que ha enviado el datagrama actual.
     Retorno: Ninguno
 
@@ -51,15 +52,17 @@ def process_UDP_datagram(us,header,data,srcIP):
         lenght: bytes 5 y 6
         checksum: bytes 7 y 8
     '''
-    source_port = data[0:2]
-    destination_port = data[2:4]
-    lenght = data[4:6]
-    checksum = data[6:8]
-
-    logging.debug("Puerto origen:: " + str(source_port[0]) + "." + str(source_port[1]))
-    logging.debug("Puerto destino: " + str(destination_port[0]) + "." + str(destination_port[1]))
-    logging.debug("informacion del paquete: " + str(data[8:(struct.unpack('!h',lenght)[0])]))
-    logging.debug("datagrama udp: " + str(data[:(struct.unpack('!h',lenght)[0])]))
+    # Vista de la trama (ver packet.py): la cabecera UDP se decodifica una sola vez
+    pkt = Packet.of(data)
+    pkt.l4 = pkt.off
+    source_port, destination_port, lenght, checksum = pkt.udpHeader
+
+    # Solo se copia (bytes) el contenido para construir los mensajes de DEBUG
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug("Puerto origen:: " + str(source_port))
+        logging.debug("Puerto destino: " + str(destination_port))
+        logging.debug("informacion del paquete: " + str(bytes(pkt[8:lenght])))
+        logging.debug("datagrama udp: " + str(bytes(pkt[:lenght])))
 
     return
 
@@ -78,10 +81,14 @@ def process_UDP_datagram(us,header,data,srcIP):
         -data: array de bytes con los datos a incluir como payload en el datagrama UDP
         -dstPort: entero de 16 bits que indica el número de puerto destino a usar
         -dstIP: entero de 32 bits con la IP destino del datagrama UDP
-    Retorno: True o False en función de si se ha enviado el datagrama correctamente o no
+        -ipLevel: nivel IP (IPLevel) por el que se envia el datagrama (None => defaultIP)
+    Retorno: True o False en función de si se ha enviado el datagrama correctamente o no (el resultado de sendIPDatagram, tanto en modo scatter-gather como copiando los datos)
 
 '''
-def sendUDPDatagram(data,dstPort,dstIP):
+def sendUDPDatagram(data,dstPort,dstIP,ipLevel=None):
+
+    if ipLevel is None:
+        ipLevel = defaultIP
     # header = bytearray(UDP_HLEN)
     
     
@@ -92,6 +99,10 @@ def sendUDPDatagram(data,dstPort,dstIP):
     header = bytes()
     header = getUDPSourcePort().to_bytes(2, byteorder='big') + dstPort.to_bytes(2, byteorder='big') + (UDP_HLEN + len(data)).to_bytes(2, byteorder='big') + (0).to_bytes(2, byteorder='big')
 
+    # En modo scatter-gather la cabecera y los datos bajan por separado, sin copiar los datos
+    if ipLevel.eth.scatterGatherEnabled():
+        return ipLevel.sendIPDatagram(dstIP,[header,memoryview(data)],17)
+
     datagram = bytes()
     datagram += header
     datagram += data
@@ -101,9 +112,7 @@ def sendUDPDatagram(data,dstPort,dstIP):
     # print(data)
     # print(datagram)
     # print("\n\n\n")
-    sendIPDatagram(dstIP,datagram,17) # protocol = 17 porque es UDP
-
-    return
+    return ipLevel.sendIPDatagram(dstIP,datagram,17) # protocol = 17 porque es UDP
 
 '''
     Nombre: initUDP
@@ -112,10 +121,12 @@ def sendUDPDatagram(data,dstPort,dstIP):
         -Registrar (llamando a registerIPProtocol) la función process_UDP_datagram con el valor de protocolo 17
 
     Argumentos:
-        -Ninguno
+        -ipLevel: nivel IP (IPLevel) en el que se registra (None => defaultIP)
     Retorno: Ninguno
 
 '''
-def initUDP():
-    registerIPProtocol(process_UDP_datagram, 17)
+def initUDP(ipLevel=None):
+    if ipLevel is None:
+        ipLevel = defaultIP
+    ipLevel.registerIPProtocol(process_UDP_datagram, 17)
     return